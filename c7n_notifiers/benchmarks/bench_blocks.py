@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Compares the Block Kit renderer with the legacy code block table, both in
+# the time taken to render the resources and the number of slack messages
+# the result needs.
+#
+#   python3 benchmarks/bench_blocks.py
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                    'notifiers')
+)
+
+import lib.blocks  # noqa: E402
+import lib.formatting  # noqa: E402
+from bench_resource_table import make_resources  # noqa: E402
+
+ROW_COUNTS = [10, 100, 1000, 10000]
+TITLE = "Cloud Custodian ec2 Reaper for account 123456789012 (example)"
+INTRO = "I would have deleted the following ec2 resources in us-east-1."
+
+
+def main():
+    print("{:>7}  {:>11}  {:>9}  {:>11}  {:>9}".format(
+        "rows", "legacy (s)", "messages", "blocks (s)", "messages"))
+    for count in ROW_COUNTS:
+        resources = make_resources(count)
+        repeat = max(1, 10000 // count)
+
+        table = lib.formatting.format_resource_table(resources)
+        # The legacy path always sends one message, but anything past the
+        # message character limit is truncated by slack, so count the
+        # messages it would need to deliver everything.
+        legacy_messages = math.ceil(
+            len(table) / lib.blocks.MAX_MESSAGE_CHARACTERS
+        )
+        legacy = min(timeit.repeat(
+            lambda: lib.formatting.format_resource_table(resources),
+            number=repeat, repeat=3)) / repeat
+
+        pages = lib.blocks.format_resource_pages(TITLE, INTRO, resources)
+        blocks = min(timeit.repeat(
+            lambda: lib.blocks.format_resource_pages(TITLE, INTRO,
+                                                     resources),
+            number=repeat, repeat=3)) / repeat
+
+        print("{:>7}  {:>11.5f}  {:>9}  {:>11.5f}  {:>9}".format(
+            count, legacy, legacy_messages, blocks, len(pages)))
+
+
+if __name__ == '__main__':
+    main()
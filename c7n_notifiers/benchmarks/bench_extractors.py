@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Times the extractors generated for each resource mapping against
+# searching the mappings' JMESPath expressions, over the same randomly
+# generated resources. That the two return the same resource info is
+# checked by tests/test_extractors.py.
+#
+#   python3 benchmarks/bench_extractors.py [--show TYPE]
+import argparse
+import os
+import random
+import sys
+import timeit
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies'),
+    os.path.join(base_dir, 'devtools')
+]
+
+import lib.resources  # noqa: E402
+from resource_generator import make_resource  # noqa: E402
+
+RESOURCE_COUNT = 10000
+REGION = 'eu-west-1'
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the generated resource extractors."
+    )
+    parser.add_argument('--show', metavar='TYPE',
+                        help="print the extractor generated for TYPE")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    mappings = lib.resources.get_mappings()
+    prepared_mappings = {
+        resource_type: lib.resources.prepare_mapping(resource_mapping)
+        for resource_type, resource_mapping in sorted(mappings.items())
+    }
+    if args.show:
+        print(prepared_mappings[args.show]['extract'].source)
+        return
+
+    print("{:<28}  {:>14}  {:>14}  {:>8}".format(
+        "type", "jmespath (ms)", "generated (ms)", "speedup"
+    ))
+    totals = [0, 0]
+    for resource_type, prepared_mapping in prepared_mappings.items():
+        resources = [
+            make_resource(prepared_mapping, rng)
+            for _ in range(RESOURCE_COUNT)
+        ]
+        interpret = lib.resources.extract_resource_info
+        extract = prepared_mapping['extract']
+        interpreted = min(timeit.repeat(
+            lambda: [interpret(prepared_mapping, resource, REGION)
+                     for resource in resources],
+            number=1, repeat=3
+        ))
+        generated = min(timeit.repeat(
+            lambda: [extract(resource, REGION) for resource in resources],
+            number=1, repeat=3
+        ))
+        totals[0] += interpreted
+        totals[1] += generated
+        print("{:<28}  {:>14.1f}  {:>14.1f}  {:>7.1f}x".format(
+            resource_type, interpreted * 1000, generated * 1000,
+            interpreted / generated
+        ))
+    print("{:<28}  {:>14.1f}  {:>14.1f}  {:>7.1f}x".format(
+        "total", totals[0] * 1000, totals[1] * 1000, totals[0] / totals[1]
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Measures the cold start import cost of the notifier with -X importtime
+# (Python 3.7+) and fails when it regresses.
+#
+#   python3 benchmarks/bench_import_time.py
+#   python3 benchmarks/bench_import_time.py --save import_times.json
+#   python3 benchmarks/bench_import_time.py --compare import_times.json
+#
+# Exits non zero when importing slack_notifier takes longer than --max-ms,
+# when a module that should only be imported on first use is imported at
+# cold start, or when a notifier module is more than --tolerance slower
+# than in the --compare file.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PYTHON_PATH = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+ENTRY_MODULE = 'slack_notifier'
+# Heavy modules the notifier imports the first time they are needed
+LAZY_MODULES = [
+    'jinja2', 'jmespath', 'yaml', 'concurrent.futures', 'uuid', 'asyncio'
+]
+MIN_REGRESSION_US = 1000
+
+
+def measure_once():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        PYTHON_PATH + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import {}'.format(ENTRY_MODULE)],
+        env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(cumulative_us)
+    return times
+
+
+def measure(runs):
+    samples = [measure_once() for _ in range(runs)]
+    modules = set().union(*samples)
+    return {
+        module: statistics.median(
+            sample[module] for sample in samples if module in sample
+        )
+        for module in modules
+    }
+
+
+def is_notifier_module(module):
+    return module == ENTRY_MODULE or module.startswith('lib.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cold start import time of the notifier"
+    )
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--max-ms', type=float, default=150)
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+    if sys.version_info < (3, 7):
+        # Older Pythons ignore the option and report nothing
+        sys.exit("-X importtime needs Python 3.7 or later, run this with a "
+                 "newer python3 than {}".format(sys.version.split()[0]))
+
+    times = measure(args.runs)
+    failures = []
+
+    print("Heaviest imports (cumulative ms, median of {} runs)".format(
+        args.runs))
+    for module, cumulative in sorted(times.items(),
+                                     key=lambda item: -item[1])[:15]:
+        print("  {:>8.1f}  {}".format(cumulative / 1000, module))
+
+    print("Notifier modules")
+    for module in sorted(filter(is_notifier_module, times)):
+        print("  {:>8.1f}  {}".format(times[module] / 1000, module))
+
+    total_ms = times[ENTRY_MODULE] / 1000
+    if total_ms > args.max_ms:
+        failures.append("importing {} took {:.1f}ms, over {}ms".format(
+            ENTRY_MODULE, total_ms, args.max_ms))
+    for module in LAZY_MODULES:
+        if module in times:
+            failures.append(
+                "{} is imported at cold start".format(module)
+            )
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        for module, previous in sorted(baseline.items()):
+            current = times.get(module)
+            # Sub millisecond modules are too noisy to compare relatively
+            if (current is not None and
+                    current > previous * (1 + args.tolerance) and
+                    current - previous > MIN_REGRESSION_US):
+                failures.append(
+                    "{} regressed from {:.1f}ms to {:.1f}ms".format(
+                        module, previous / 1000, current / 1000)
+                )
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({module: times[module]
+                       for module in filter(is_notifier_module, times)},
+                      baseline_file, indent=2, sort_keys=True)
+
+    for failure in failures:
+        print("FAIL: {}".format(failure))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
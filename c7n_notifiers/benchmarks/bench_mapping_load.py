@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Cold start cost of loading the resource mappings, from the YAML with the
+# vendored pure Python PyYAML compared with the JSON compiled at build time.
+# Each load runs in a fresh interpreter so it includes importing the parser.
+#
+#   python3 benchmarks/bench_mapping_load.py
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PYTHON_PATH = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+sys.path[:0] = PYTHON_PATH
+
+import lib.resources  # noqa: E402
+
+RUNS = 9
+LOAD_SCRIPT = """
+import time
+start = time.perf_counter()
+import lib.resources
+{call}
+print(time.perf_counter() - start)
+"""
+
+
+def time_cold_load(call):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        PYTHON_PATH + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    samples = []
+    for _ in range(RUNS):
+        result = subprocess.run(
+            [sys.executable, '-c', LOAD_SCRIPT.format(call=call)],
+            env=env, stdout=subprocess.PIPE, universal_newlines=True,
+            check=True
+        )
+        samples.append(float(result.stdout))
+    return statistics.median(samples)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as scratch:
+        compiled_path = os.path.join(scratch, 'resource_mappings.json')
+        lib.resources.build_mappings(compiled_path=compiled_path)
+
+        print("{:<8}  {:>10}".format("source", "cold (ms)"))
+        loads = [
+            ('yaml', "lib.resources.parse_mappings_file({!r})".format(
+                lib.resources.MAPPINGS_FILE_PATH)),
+            ('json', "lib.resources.load_compiled_mappings("
+                     "compiled_path={!r})".format(compiled_path))
+        ]
+        for label, call in loads:
+            print("{:<8}  {:>10.2f}".format(
+                label, time_cold_load(call) * 1000
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Extraction of a message's resources in this process compared with the
+# warm extraction process pool, at increasing message sizes. Checks both
+# give the same resources in the same order, reports where the pool starts
+# to pay off, and the threshold the pool's tuner learns from the runs.
+#
+#   python3 benchmarks/bench_parallel_extraction.py [--workers N]
+import argparse
+from datetime import datetime, timedelta
+from operator import itemgetter
+import os
+import sys
+import time
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+
+import lib.parallel  # noqa: E402
+import lib.resources  # noqa: E402
+
+RESOURCE_COUNTS = [1000, 5000, 20000, 50000, 100000]
+REPEAT = 3
+RESOURCE_TYPE = 'ec2'
+REGION = 'eu-west-1'
+
+
+def make_resources(count):
+    start = datetime(2021, 1, 1)
+    return [
+        {
+            'InstanceId': 'i-{:017x}'.format(index),
+            # Plenty of resources share a launch time
+            'LaunchTime': (
+                start + timedelta(seconds=index // 3 * 17)
+            ).strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+            'Tags': [
+                {'Key': 'Name', 'Value': 'instance-{}'.format(index)},
+                {'Key': 'Creator', 'Value': 'user-{}'.format(index % 50)},
+                {'Key': 'Team', 'Value': 'platform'}
+            ]
+        }
+        for index in range(count)
+    ]
+
+
+def extract_serial(resources):
+    extracted = [
+        lib.resources.get_resource_info(RESOURCE_TYPE, resource, REGION)
+        for resource in resources
+    ]
+    extracted.sort(key=itemgetter('creation_datetime'), reverse=True)
+    return extracted
+
+
+def best_time(function):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time serial and parallel resource extraction."
+    )
+    parser.add_argument('--workers', type=int,
+                        default=lib.parallel.EXTRACTION_WORKERS)
+    args = parser.parse_args()
+    if args.workers < 2:
+        sys.exit("Parallel extraction needs at least 2 workers")
+
+    pool = lib.parallel.ExtractionPool(workers=args.workers)
+    # Always extract in parallel, the tuner below learns from the timings
+    pool.tuner.default_threshold = 0
+    tuner = lib.parallel.ExtractionTuner(args.workers)
+    # Start the workers so the first size doesn't pay for it
+    pool.extract(RESOURCE_TYPE, make_resources(1000), REGION)
+
+    print("{} workers\n".format(args.workers))
+    print("{:>9}  {:>11}  {:>13}  {:>8}".format(
+        "resources", "serial (ms)", "parallel (ms)", "speedup"
+    ))
+    crossover = None
+    for count in RESOURCE_COUNTS:
+        resources = make_resources(count)
+        serial, expected = best_time(lambda: extract_serial(resources))
+        parallel, actual = best_time(
+            lambda: pool.extract(RESOURCE_TYPE, resources, REGION)
+        )
+        if actual != expected:
+            sys.exit("Parallel extraction of {} resources differs from "
+                     "serial extraction".format(count))
+        tuner.record_serial(count, serial)
+        tuner.record_parallel(count, parallel)
+        if crossover is None and parallel < serial:
+            crossover = count
+        print("{:>9}  {:>11.1f}  {:>13.1f}  {:>7.1f}x".format(
+            count, serial * 1000, parallel * 1000, serial / parallel
+        ))
+    pool.shutdown()
+
+    if crossover:
+        print("\nparallel first faster at {} resources".format(crossover))
+    else:
+        print("\nparallel not faster at any size")
+    print("tuned threshold: {} resources (default {})".format(
+        tuner.get_threshold(), lib.parallel.PARALLEL_EXTRACTION_THRESHOLD
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Compares the columnar resource table formatter against the row at a time
+# loop it replaced in format_slack_resource_message.
+#
+#   python3 benchmarks/bench_resource_table.py
+from datetime import datetime, timedelta
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                    'notifiers')
+)
+
+import lib.formatting  # noqa: E402
+
+ROW_COUNTS = [1000, 10000, 100000]
+
+
+def legacy_format(resources):
+    formatted_lines = []
+    resource_id_pad = 22
+    resource_name_pad = 15
+    creation_dt_pad = 19
+    creator_pad = 12
+    line_layout = (
+        "{:<{resource_id_pad}}  {:<{resource_name_pad}}  "
+        "{:<{creation_dt_pad}}  {:<{creator_pad}}"
+    )
+    header_line = line_layout.format("ResourceId",
+                                     "ResourceName",
+                                     "CreationDateTime",
+                                     "Creator",
+                                     resource_id_pad=resource_id_pad,
+                                     resource_name_pad=resource_name_pad,
+                                     creation_dt_pad=creation_dt_pad,
+                                     creator_pad=creator_pad
+                                     )
+    formatted_lines.append(header_line)
+    for resource_info in resources:
+        resource_pad = resource_id_pad
+        if resource_info.get('url'):
+            resource = resource_info['id'][:resource_id_pad]
+            resource_url = resource_info['url']
+            resource_link = '<{}|{}>'.format(resource_url, resource)
+            resource_pad = (
+                len(resource_link) - len(resource) + resource_id_pad
+            )
+            resource = resource_link
+        else:
+            resource = resource_info['id'][:resource_id_pad]
+
+        name = resource_info['name'][:resource_name_pad]
+
+        datetime_string = resource_info['creation_datetime'].strftime(
+            '%Y-%m-%d %H:%M:%S'
+        )
+        creator = resource_info['creator'][:creator_pad]
+
+        formatted_lines.append(
+            line_layout.format(resource,
+                               name,
+                               datetime_string,
+                               creator,
+                               resource_id_pad=resource_pad,
+                               resource_name_pad=resource_name_pad,
+                               creation_dt_pad=creation_dt_pad,
+                               creator_pad=creator_pad
+                               )
+        )
+    return "\n".join(formatted_lines)
+
+
+def make_resources(count):
+    # Resources reaped by a policy tend to be created in batches, so only a
+    # fraction of the timestamps are unique.
+    start = datetime(2018, 1, 1)
+    resources = []
+    for i in range(count):
+        resource_id = 'i-{:017x}'.format(i)
+        resource = {
+            'id': resource_id,
+            'name': 'resource-name-{}'.format(i),
+            'creation_datetime': start + timedelta(minutes=i // 10),
+            'creator': 'creator{}@example.com'.format(i % 50),
+            'region': 'us-east-1'
+        }
+        if i % 4:
+            resource['url'] = (
+                "https://console.aws.amazon.com/ec2/v2/home?region=us-east-1"
+                "#Instances:instanceId={}".format(resource_id)
+            )
+        resources.append(resource)
+    return resources
+
+
+def main():
+    print("{:>8}  {:>12}  {:>12}  {:>8}".format(
+        "rows", "legacy (s)", "columnar (s)", "speedup"))
+    for count in ROW_COUNTS:
+        resources = make_resources(count)
+        if (legacy_format(resources) !=
+                lib.formatting.format_resource_table(
+                    resources, lib.formatting.FIXED_COLUMN_WIDTHS)):
+            raise RuntimeError(
+                "Columnar output differs from legacy output for {} "
+                "rows".format(count)
+            )
+        repeat = max(1, 100000 // count)
+        legacy = min(timeit.repeat(lambda: legacy_format(resources),
+                                   number=repeat, repeat=3)) / repeat
+        columnar = min(timeit.repeat(
+            lambda: lib.formatting.format_resource_table(
+                resources, lib.formatting.FIXED_COLUMN_WIDTHS),
+            number=repeat, repeat=3)) / repeat
+        print("{:>8}  {:>12.5f}  {:>12.5f}  {:>7.2f}x".format(
+            count, legacy, columnar, legacy / columnar))
+
+
+if __name__ == '__main__':
+    main()
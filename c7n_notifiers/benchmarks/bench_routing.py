@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Matching messages against 10k routes with the indexed routing table,
+# compared with checking every route in turn. Both must match the same
+# routes for every message before they're timed.
+#
+#   python3 benchmarks/bench_routing.py
+import os
+import random
+import sys
+import timeit
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+
+import lib.routing  # noqa: E402
+
+ROUTE_COUNT = 10000
+MESSAGE_COUNT = 10000
+ACCOUNTS = ['{:012d}'.format(n) for n in range(500)]
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'eu-central-1',
+           'ap-southeast-2']
+RESOURCE_TYPES = ['ec2', 'ebs', 'rds', 's3', 'asg', 'elb', 'emr']
+POLICIES = ['policy-{}'.format(n) for n in range(200)]
+SEVERITIES = ['danger', 'warning']
+VALUES = {
+    'account_id': ACCOUNTS,
+    'region': REGIONS,
+    'resource_type': RESOURCE_TYPES,
+    'policy': POLICIES,
+    'severity': SEVERITIES
+}
+
+
+def make_route(rng, number):
+    route = {'to': ['https://hooks.example.com/{}'.format(number)]}
+    # Most routes match on an account and one or two other keys
+    keys = ['account_id'] + rng.sample(lib.routing.MATCH_KEYS[1:],
+                                       rng.choice([0, 1, 2]))
+    if rng.random() < 0.001:
+        keys = []
+    for key in keys:
+        if rng.random() < 0.2:
+            route[key] = rng.sample(VALUES[key], 2)
+        else:
+            route[key] = rng.choice(VALUES[key])
+    if rng.random() < 0.3:
+        route['template'] = 'reaper'
+    return route
+
+
+def make_attributes(rng):
+    return {key: rng.choice(values) for key, values in VALUES.items()}
+
+
+def linear_match(routes, attributes):
+    matched = []
+    for route in routes:
+        for key in lib.routing.MATCH_KEYS:
+            values = lib.routing.get_match_values(route, key)
+            if values is not None and attributes[key] not in values:
+                break
+        else:
+            matched.append(route)
+    return matched
+
+
+def main():
+    rng = random.Random(0)
+    routes = [make_route(rng, number) for number in range(ROUTE_COUNT)]
+    lib.routing.validate_routes({'routes': routes}, 'benchmark')
+    messages = [make_attributes(rng) for _ in range(MESSAGE_COUNT)]
+
+    compile_seconds = min(timeit.repeat(
+        lambda: lib.routing.RoutingTable(routes), number=1, repeat=3
+    ))
+    table = lib.routing.RoutingTable(routes)
+    matched = 0
+    for attributes in messages[:1000]:
+        expected = linear_match(routes, attributes)
+        if table.match(attributes) != expected:
+            sys.exit("Routing table differs from a linear scan for "
+                     "{}".format(attributes))
+        matched += len(expected)
+
+    indexed = min(timeit.repeat(
+        lambda: [table.match(attributes) for attributes in messages],
+        number=1, repeat=3
+    ))
+    linear = min(timeit.repeat(
+        lambda: [linear_match(routes, attributes)
+                 for attributes in messages[:100]],
+        number=1, repeat=3
+    )) * (len(messages) / 100)
+
+    print("{} routes in {} indexes, compiled in {:.1f}ms".format(
+        ROUTE_COUNT, len(table.indexes), compile_seconds * 1000
+    ))
+    print("{:.1f} routes matched per message\n".format(matched / 1000))
+    print("{:<8}  {:>16}".format("", "per message (us)"))
+    print("{:<8}  {:>16.2f}".format("indexed",
+                                    indexed / len(messages) * 1e6))
+    print("{:<8}  {:>16.2f}".format("linear", linear / len(messages) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Counts the file system calls made while loading and rendering templates
+# from the templates directory compared with a template bundle. The calls
+# are counted by wrapping the os and io functions Jinja's loaders use, so
+# no strace is needed.
+#
+#   python3 benchmarks/bench_template_loading.py
+import builtins
+import collections
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(base_dir, 'notifiers'))
+sys.path.insert(1, os.path.join(base_dir, 'dependencies'))
+
+import jinja2  # noqa: E402
+
+import lib.templates  # noqa: E402
+
+RENDERS = 1000
+TEMPLATE_INFO = {
+    'resource_type': 'ec2',
+    'region': 'us-east-1',
+    'account_info': '123456789012 (example)',
+    'resources': 'ResourceId  ResourceName  CreationDateTime  Creator',
+    'resource_count': 1
+}
+COUNTED_CALLS = [
+    (os, 'stat'), (os, 'lstat'), (os, 'fstat'), (os, 'open'),
+    (os, 'listdir'), (os, 'scandir'), (builtins, 'open'), (io, 'open')
+]
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.originals = []
+
+    def __enter__(self):
+        for module, name in COUNTED_CALLS:
+            original = getattr(module, name)
+            self.originals.append((module, name, original))
+            setattr(module, name, self.wrap(name, original))
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, name, original in self.originals:
+            setattr(module, name, original)
+
+    def wrap(self, name, original):
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return original(*args, **kwargs)
+        return counted
+
+
+def render_all(environment):
+    for name in environment.loader.list_templates():
+        if name.startswith('exception'):
+            continue
+        environment.get_template(name).render(**TEMPLATE_INFO)
+
+
+def measure(label, make_environment):
+    environment = make_environment()
+    with CallCounter() as cold:
+        render_all(environment)
+    with CallCounter() as warm:
+        for _ in range(RENDERS):
+            render_all(environment)
+    elapsed = min(timeit.repeat(lambda: render_all(environment),
+                                number=RENDERS, repeat=3))
+    print("{:<12}  {:>10}  {:>13}  {:>14.2f}".format(
+        label,
+        sum(cold.counts.values()),
+        sum(warm.counts.values()),
+        elapsed / RENDERS * 1e6
+    ))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as scratch:
+        bundle_path = os.path.join(scratch, 'templates.bundle')
+        lib.templates.build_bundle(bundle_path=bundle_path)
+        bundle = lib.templates.load_bundle(bundle_path)
+
+        print("{:<12}  {:>10}  {:>13}  {:>14}".format(
+            "loader", "cold calls",
+            "calls/{}".format(RENDERS), "us per render"))
+        measure("filesystem", lambda: jinja2.Environment(
+            loader=jinja2.FileSystemLoader(lib.templates.TEMPLATES_PATH)
+        ))
+        measure("bundle", lambda: jinja2.Environment(
+            loader=lib.templates.BundleLoader(bundle), auto_reload=False
+        ))
+
+
+if __name__ == '__main__':
+    main()
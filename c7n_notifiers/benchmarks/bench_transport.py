@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Sending a fan-out of webhook posts to a local sink that takes LATENCY
+# seconds to answer each one and HANDSHAKE to accept a connection: one at a
+# time with urllib as the notifier used to, over a thread pool with urllib,
+# and with the asyncio transport over kept connections, one at a time and
+# from a thread pool as the delivery scheduler's workers send them. Every
+# request must have reached the sink before it's timed.
+#
+#   python3 benchmarks/bench_transport.py
+import concurrent.futures
+import http.server
+import os
+import socketserver
+import sys
+import threading
+import time
+import urllib.request
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+
+import lib.transport  # noqa: E402
+
+REQUEST_COUNTS = [10, 50, 200]
+# Seconds the sink takes to answer, as a stand-in for the round trip to
+# Slack
+LATENCY = 0.02
+# Seconds the sink takes to accept a connection, as a stand-in for the TCP
+# and TLS handshakes, two more round trips
+HANDSHAKE = 2 * LATENCY
+BODY = b'{"text": "' + b'x' * 2000 + b'"}'
+
+
+class SinkServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SinkRequestHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class SinkRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        time.sleep(HANDSHAKE)
+        self.server.count('connections')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(LATENCY)
+        self.server.count('requests')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+def make_requests(url, count):
+    return [
+        urllib.request.Request(url, data=BODY,
+                               headers={'Content-Type': 'application/json'})
+        for _ in range(count)
+    ]
+
+
+def send_sequential(reqs):
+    for req in reqs:
+        urllib.request.urlopen(req, timeout=10).read()
+
+
+def send_threaded(reqs, urlopen=urllib.request.urlopen):
+    with concurrent.futures.ThreadPoolExecutor(
+            lib.transport.HOST_CONCURRENCY) as executor:
+        for response in executor.map(
+                lambda req: urlopen(req, timeout=10), reqs):
+            response.read()
+
+
+def send_transport(reqs):
+    for req in reqs:
+        lib.transport.urlopen(req, timeout=10).read()
+
+
+def send_transport_threaded(reqs):
+    send_threaded(reqs, lib.transport.urlopen)
+
+
+def main():
+    server = SinkServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/services/T0/B0/bench'.format(
+        server.server_address[1]
+    )
+    senders = [
+        ("sequential", send_sequential),
+        ("threaded", send_threaded),
+        ("asyncio", send_transport),
+        ("asyncio threaded", send_transport_threaded)
+    ]
+    # Opens the transport's loop and first connections
+    send_transport_threaded(
+        make_requests(url, lib.transport.HOST_CONCURRENCY)
+    )
+
+    print("{} concurrent requests per host, {:.0f}ms per connection, "
+          "{:.0f}ms per response\n".format(
+              lib.transport.HOST_CONCURRENCY, HANDSHAKE * 1000,
+              LATENCY * 1000
+          ))
+    print("{:<8}  {:<16}  {:>10}  {:>10}  {:>11}".format(
+        "requests", "", "total (ms)", "per second", "connections"
+    ))
+    for count in REQUEST_COUNTS:
+        for name, send in senders:
+            reqs = make_requests(url, count)
+            requests, connections = server.requests, server.connections
+            start = time.perf_counter()
+            send(reqs)
+            seconds = time.perf_counter() - start
+            if server.requests - requests != count:
+                sys.exit("{} sent {} of {} requests".format(
+                    name, server.requests - requests, count
+                ))
+            print("{:<8}  {:<16}  {:>10.1f}  {:>10.0f}  {:>11}".format(
+                count, name, seconds * 1000, count / seconds,
+                server.connections - connections
+            ))
+        print()
+    lib.transport.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -54,6 +54,19 @@ rsync -a ./${DEPENDS_DIR}/ ./${PACKAGE_DIR}/
 rsync -a ./${CODE_DIR}/ ./${PACKAGE_DIR}/
 #pip install --requirement package_requirements.txt --target ${PACKAGE_DIR} --quiet
 
+echo "Build Deploy Package"
+# Built with the function's runtime, as the vendored dependencies don't
+# import on newer Pythons and compiled code is only used by the Python that
+# compiled it. Without it the package is shipped unbuilt, and the function
+# prepares everything at cold start instead.
+BUILD_PYTHON=${BUILD_PYTHON:-python3.6}
+if ! command -v ${BUILD_PYTHON} > /dev/null || \
+        ! (cd ${PACKAGE_DIR} && ${BUILD_PYTHON} -m lib.build) ; then
+    echo "Unable to build with ${BUILD_PYTHON}, shipping the package unbuilt"
+    rm -f ${PACKAGE_DIR}/lib/resource_mappings.json \
+        ${PACKAGE_DIR}/templates.bundle ${PACKAGE_DIR}/warm_state.snapshot
+fi
+
 aws cloudformation package --template-file ${CFN_TEMPLATE} --s3-prefix deploy --s3-bucket ${BUCKET} --output-template-file ${OUTPUT_TEMPLATE}
 
 # Upload Package
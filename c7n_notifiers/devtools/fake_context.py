@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# A stand-in for the Lambda context passed to the handlers, whose remaining
+# time follows a clock. With a FakeClock, time only passes when it is moved
+# on, so how the handlers behave near their deadline can be tried without
+# waiting for it:
+#
+#   clock = FakeClock()
+#   context = FakeContext(timeout=3, clock=clock)
+#   clock.advance(2.5)
+#   context.get_remaining_time_in_millis()  # 500
+#
+# Pass clock=time.monotonic for a context that runs out in real time.
+import os
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    # Can be given as the sleep of a RateLimiter or DeliveryScheduler, so
+    # waiting on a rate limit moves the clock on instead
+    sleep = advance
+
+
+class FakeContext:
+    def __init__(self, timeout=3.0, clock=None,
+                 function_name='c7n-notifier-standin', memory_limit=128):
+        self.clock = FakeClock() if clock is None else clock
+        self.end = self.clock() + timeout
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.memory_limit_in_mb = memory_limit
+        self.aws_request_id = os.urandom(16).hex()
+        self.invoked_function_arn = (
+            'arn:aws:lambda:us-east-1:123456789012:function:' + function_name
+        )
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.end - self.clock()) * 1000))
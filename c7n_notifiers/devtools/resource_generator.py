@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Makes up resources for a prepared resource mapping, putting a generated
+# value wherever each of its JMESPath expressions will look. With odd=True
+# some values are missing, malformed or of the wrong type, and tags are
+# duplicated or absent, for comparing the generated extractors with
+# searching the expressions:
+#
+#   rng = random.Random(0)
+#   make_resource(lib.resources.prepare_mapping(resource_mapping), rng)
+DATETIMES = [
+    '2021-03-04T05:06:07+00:00',
+    '2021-03-04T05:06:07.123456+00:00',
+    '2021-03-04T05:06:07.5+00:00',
+    '2021-3-4T5:06:07+00:00',
+    '2021-02-30T05:06:07+00:00',
+    '2021-03-04T05:06:60+00:00',
+    '2021-03-04 05:06:07',
+    '',
+    None,
+    12
+]
+ODD_VALUES = [None, '', 0, 1, True, [], {}, ['a', 'b'], 'x' * 100]
+
+
+def place(node, resource, value, rng, odd):
+    # Puts value where the expression will find it
+    node_type = node['type']
+    if node_type == 'field':
+        resource[node['value']] = value
+    elif node_type == 'subexpression':
+        for child in node['children'][:-1]:
+            if odd and rng.random() < 0.2:
+                resource[child['value']] = rng.choice(ODD_VALUES)
+                return
+            resource = resource.setdefault(child['value'], {})
+        place(node['children'][-1], resource, value, rng, odd)
+    elif node_type == 'filter_projection':
+        base_node, projection_node, comparator_node = node['children']
+        key_node, key_literal = comparator_node['children']
+        tags = resource.setdefault(base_node['value'], [])
+        if type(tags) is not list:
+            return
+        if odd and rng.random() < 0.1:
+            resource[base_node['value']] = rng.choice(ODD_VALUES)
+            return
+        if odd and rng.random() < 0.3:
+            tags.append(rng.choice(ODD_VALUES))
+        tags.append({
+            key_node['value']: 'Other',
+            projection_node['value']: 'noise'
+        })
+        count = rng.choice([0, 1, 1, 1, 2]) if odd else 1
+        for _ in range(count):
+            tag = {key_node['value']: key_literal['value']}
+            if not odd or rng.random() < 0.9:
+                tag[projection_node['value']] = value
+            tags.append(tag)
+
+
+def make_resource(resource_mapping, rng, odd=False):
+    resource = {}
+    for key, expression in resource_mapping['info']:
+        if key == 'creation_datetime':
+            value = rng.choice(DATETIMES if odd else DATETIMES[:3])
+        else:
+            value = "{}-{:08x}".format(key, rng.getrandbits(32))
+        if odd and rng.random() < 0.1:
+            value = rng.choice(ODD_VALUES)
+        if odd and rng.random() < 0.05:
+            continue
+        place(expression.parsed, resource, value, rng, odd)
+    return resource
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# A local stand-in for the slack endpoints used by the notifier, so the
+# notifier can be run and benchmarked without sending anything to slack.
+# Every request is recorded and answered the way slack would answer it.
+#
+#   python3 devtools/slack_standin.py --port 8765
+#   SLACK_API_URL=http://127.0.0.1:8765/api/ SLACK_API_TOKEN=xoxb-test ...
+#
+# Webhook destinations can be pointed at http://127.0.0.1:8765/services/...
+import argparse
+import http.server
+import json
+import socketserver
+import threading
+import time
+
+
+class StandinServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, StandinRequestHandler)
+        self.requests = []
+        self.requests_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def record(self, path, headers, body):
+        with self.requests_lock:
+            self.requests.append({
+                'path': path,
+                'headers': dict(headers),
+                'body': body
+            })
+
+    def requests_for(self, path):
+        with self.requests_lock:
+            return [r for r in self.requests if r['path'] == path]
+
+
+class StandinRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Responses are buffered and sent in one write, as a body written after
+    # its headers waits on a client that keeps the connection open
+    # acknowledging them
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_api(self, result):
+        self.respond(200, json.dumps(result).encode('utf8'))
+
+    def do_POST(self):
+        body = self.read_body()
+        self.server.record(self.path, self.headers, body)
+
+        if self.path.startswith('/services/'):
+            self.respond(200, b'ok', content_type='text/html')
+        elif self.path == '/api/chat.postMessage':
+            payload = json.loads(body.decode('utf8'))
+            self.respond_api({
+                'ok': True,
+                'channel': payload.get('channel'),
+                'ts': '{:.6f}'.format(time.time()),
+                'message': payload
+            })
+        elif self.path == '/api/files.upload':
+            self.respond_api({
+                'ok': True,
+                'file': {
+                    'id': 'F{:010d}'.format(len(self.server.requests)),
+                    'size': len(body),
+                    'chunked': 'Transfer-Encoding' in self.headers
+                }
+            })
+        else:
+            self.respond_api({'ok': False, 'error': 'unknown_method'})
+
+
+def start_standin(host='127.0.0.1', port=0):
+    # Starts the stand-in on a background thread. Port 0 picks a free port,
+    # use base_url to find where it is listening.
+    server = StandinServer((host, port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the slack Web API and webhooks"
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = start_standin(args.host, args.port)
+    print("Slack stand-in listening on {}".format(server.base_url))
+    seen = 0
+    try:
+        while True:
+            time.sleep(0.5)
+            with server.requests_lock:
+                new_requests = server.requests[seen:]
+            for request in new_requests:
+                print(request['path'], request['body'][:200])
+            seen += len(new_requests)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# A local stand-in for an SQS queue subscribed to the notifier's SNS topic,
+# feeding slack_notifier.sqs_handler the way a Lambda event source mapping
+# would. Messages are delivered in batches, those reported in
+# batchItemFailures are delivered again, and after max_receives attempts
+# they are moved to the dead letters.
+#
+#   python3 devtools/sqs_standin.py message.json [message.json ...]
+#
+# Each file is a decoded Cloud Custodian message, as JSON. Combine with
+# slack_standin.py to run without sending anything to slack.
+import argparse
+import base64
+from datetime import datetime
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+import fake_context
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+NOTIFIER_PATH = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies')
+]
+
+QUEUE_ARN = 'arn:aws:sqs:us-east-1:123456789012:c7n-notifier-standin'
+TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:c7n-notifier-standin'
+
+
+def encode_message(c7n_message):
+    # The same encoding Cloud Custodian uses for SNS
+    return base64.b64encode(
+        zlib.compress(json.dumps(c7n_message).encode('utf8'))
+    ).decode('ascii')
+
+
+def get_sns_envelope(message, message_id):
+    return json.dumps({
+        'Type': 'Notification',
+        'MessageId': message_id,
+        'TopicArn': TOPIC_ARN,
+        'Message': message,
+        'Timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'SignatureVersion': '1'
+    })
+
+
+class StandinQueue:
+    def __init__(self, max_receives=3, raw_message_delivery=False):
+        self.max_receives = max_receives
+        self.raw_message_delivery = raw_message_delivery
+        self.messages = []
+        self.dead_letters = []
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        # Queue an encoded Cloud Custodian message as SNS would deliver it,
+        # returns its message id
+        with self.lock:
+            self.sent += 1
+            # Random, like SNS's, so message ids recorded by the idempotency
+            # store in earlier runs aren't seen again
+            message_id = '{:08d}-0000-4000-8000-{}'.format(
+                self.sent, os.urandom(6).hex()
+            )
+            if self.raw_message_delivery:
+                body = message
+            else:
+                body = get_sns_envelope(message, message_id)
+            self.messages.append({'id': message_id, 'body': body,
+                                  'receives': 0,
+                                  'sent': int(time.time() * 1000)})
+            return message_id
+
+    def receive(self, batch_size=10):
+        # Returns an SQS event of up to batch_size records, or None when the
+        # queue is empty. Received messages stay invisible until they are
+        # deleted or released.
+        with self.lock:
+            batch = self.messages[:batch_size]
+            del self.messages[:batch_size]
+        if not batch:
+            return None
+        records = []
+        for message in batch:
+            message['receives'] += 1
+            records.append({
+                'messageId': message['id'],
+                'receiptHandle': message['id'],
+                'body': message['body'],
+                'attributes': {
+                    'ApproximateReceiveCount': str(message['receives']),
+                    'SentTimestamp': str(message['sent'])
+                },
+                'messageAttributes': {},
+                'md5OfBody': hashlib.md5(
+                    message['body'].encode('utf8')
+                ).hexdigest(),
+                'eventSource': 'aws:sqs',
+                'eventSourceARN': QUEUE_ARN,
+                'awsRegion': 'us-east-1'
+            })
+        return {'Records': records}, batch
+
+    def release(self, batch, failed_ids):
+        # Successful messages are deleted, failed ones are delivered again
+        # until they have been received max_receives times
+        with self.lock:
+            for message in batch:
+                if message['id'] not in failed_ids:
+                    continue
+                if message['receives'] >= self.max_receives:
+                    self.dead_letters.append(message)
+                else:
+                    self.messages.append(message)
+
+    def drain(self, handler, batch_size=10, context=None, get_context=None):
+        # Invoke handler with batches until the queue is empty, returns the
+        # number of invocations. get_context, if given, makes the context of
+        # each invocation, see fake_context.py.
+        invocations = 0
+        while True:
+            received = self.receive(batch_size)
+            if received is None:
+                return invocations
+            event, batch = received
+            invocations += 1
+            if get_context is not None:
+                context = get_context()
+            try:
+                response = handler(event, context) or {}
+                failed_ids = {
+                    failure['itemIdentifier']
+                    for failure in response.get('batchItemFailures', [])
+                }
+            except Exception:
+                # An error from the handler fails the whole batch
+                failed_ids = {message['id'] for message in batch}
+            self.release(batch, failed_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Feed Cloud Custodian messages to sqs_handler through "
+                    "a local stand-in queue"
+    )
+    parser.add_argument('messages', nargs='+',
+                        help="files of decoded Cloud Custodian messages")
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--max-receives', type=int, default=3)
+    parser.add_argument('--raw', action='store_true',
+                        help="deliver messages without the SNS envelope")
+    parser.add_argument('--timeout', type=float,
+                        help="seconds each invocation has, as the function's "
+                             "timeout would give it")
+    args = parser.parse_args()
+
+    sys.path[:0] = NOTIFIER_PATH
+    import slack_notifier
+
+    queue = StandinQueue(max_receives=args.max_receives,
+                         raw_message_delivery=args.raw)
+    for path in args.messages:
+        with open(path) as message_file:
+            queue.send(encode_message(json.load(message_file)))
+    get_context = None
+    if args.timeout is not None:
+        def get_context():
+            return fake_context.FakeContext(args.timeout,
+                                            clock=time.monotonic)
+    invocations = queue.drain(slack_notifier.sqs_handler, args.batch_size,
+                              get_context=get_context)
+    print("{} messages in {} invocations, {} dead letters".format(
+        queue.sent, invocations, len(queue.dead_letters)
+    ))
+    for message in queue.dead_letters:
+        print("dead letter", message['id'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import logging
+
+import lib.formatting
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Limits slack places on Block Kit messages
+# https://api.slack.com/reference/block-kit/blocks
+MAX_BLOCKS = 50
+MAX_HEADER_CHARACTERS = 150
+MAX_SECTION_CHARACTERS = 3000
+MAX_SECTION_FIELDS = 10
+MAX_FIELD_CHARACTERS = 2000
+MAX_MESSAGE_CHARACTERS = 40000
+
+
+def truncate(text, length):
+    if len(text) <= length:
+        return text
+    return text[:length - 1] + "…"
+
+
+def get_header_block(text):
+    return {
+        'type': 'header',
+        'text': {
+            'type': 'plain_text',
+            'text': truncate(text, MAX_HEADER_CHARACTERS)
+        }
+    }
+
+
+def get_text_block(text):
+    return {
+        'type': 'section',
+        'text': {
+            'type': 'mrkdwn',
+            'text': truncate(text, MAX_SECTION_CHARACTERS)
+        }
+    }
+
+
+def get_fields_block(fields):
+    return {
+        'type': 'section',
+        'fields': [{'type': 'mrkdwn', 'text': field} for field in fields]
+    }
+
+
+def get_context_block(text):
+    return {
+        'type': 'context',
+        'elements': [{'type': 'mrkdwn', 'text': text}]
+    }
+
+
+def get_block_characters(block):
+    if block['type'] == 'context':
+        return sum(len(element['text']) for element in block['elements'])
+    characters = len(block.get('text', {}).get('text', ''))
+    for field in block.get('fields', []):
+        characters += len(field['text'])
+    return characters
+
+
+def format_resource_fields(resources):
+    # Each resource is rendered into a single section field, with its id
+    # linked to the console when there is a url.
+    datetime_column = lib.formatting.format_datetime_column(
+        [resource['creation_datetime'] for resource in resources]
+    )
+    fields = []
+    for resource, datetime_string in zip(resources, datetime_column):
+        if resource.get('url'):
+            resource_id = '<{}|{}>'.format(resource['url'], resource['id'])
+        else:
+            resource_id = resource['id']
+        field = "*{}*\n{}\n{} by {}".format(
+            resource_id,
+            resource['name'] or resource['id'],
+            datetime_string,
+            resource['creator'] or 'unknown'
+        )
+        fields.append(truncate(field, MAX_FIELD_CHARACTERS))
+    return fields
+
+
+def paginate_fields(fields, reserved_blocks=0, reserved_characters=0,
+                    max_blocks=MAX_BLOCKS,
+                    max_characters=MAX_MESSAGE_CHARACTERS):
+    # Pack the already rendered fields into sections and the sections into
+    # pages so each page stays within the block and character limits once
+    # the reserved blocks (header, intro, footer etc) are added to it.
+    # Fields are only ever moved, never rendered again.
+    block_budget = max_blocks - reserved_blocks
+    character_budget = max_characters - reserved_characters
+    if block_budget < 1:
+        raise ValueError(
+            "{} blocks are reserved, but a message can only contain "
+            "{}".format(reserved_blocks, max_blocks)
+        )
+
+    pages = []
+    page_blocks = []
+    section_fields = []
+    page_characters = 0
+    for field in fields:
+        if len(section_fields) == MAX_SECTION_FIELDS:
+            page_blocks.append(get_fields_block(section_fields))
+            section_fields = []
+
+        page_full = (
+            page_characters + len(field) > character_budget or
+            (not section_fields and len(page_blocks) == block_budget)
+        )
+        if page_full and (page_blocks or section_fields):
+            if section_fields:
+                page_blocks.append(get_fields_block(section_fields))
+                section_fields = []
+            pages.append(page_blocks)
+            page_blocks = []
+            page_characters = 0
+
+        section_fields.append(field)
+        page_characters += len(field)
+
+    if section_fields:
+        page_blocks.append(get_fields_block(section_fields))
+    if page_blocks:
+        pages.append(page_blocks)
+
+    logger.debug(
+        "Paginated {} resource fields into {} pages".format(len(fields),
+                                                          len(pages))
+    )
+
+    return pages
+
+
+def format_resource_pages(title, intro, resources):
+    # Returns a list of block lists, one per slack message. Every page gets
+    # a header, the first page also gets the intro text. One block is left
+    # free on each page for the footer added when the message is sent.
+    intro_block = get_text_block(intro) if intro.strip() else None
+    reserved_blocks = 2 + (1 if intro_block else 0)
+    reserved_characters = MAX_HEADER_CHARACTERS
+    if intro_block:
+        reserved_characters += get_block_characters(intro_block)
+
+    pages = paginate_fields(format_resource_fields(resources),
+                            reserved_blocks=reserved_blocks,
+                            reserved_characters=reserved_characters)
+    if not pages:
+        pages = [[]]
+
+    messages = []
+    for page_number, page_blocks in enumerate(pages, 1):
+        if len(pages) > 1:
+            # Leave room for the page number so it isn't truncated away
+            header = "{} ({}/{})".format(
+                truncate(title, MAX_HEADER_CHARACTERS - 12),
+                page_number,
+                len(pages)
+            )
+        else:
+            header = title
+        blocks = [get_header_block(header)]
+        if intro_block and page_number == 1:
+            blocks.append(intro_block)
+        blocks.extend(page_blocks)
+        messages.append(blocks)
+
+    return messages
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# Build steps for the Lambda deploy package. deploy.sh runs this from the
+# root of the package once the code and dependencies have been copied in.
+#
+#   python3 -m lib.build
+import logging
+
+import lib.resources
+import lib.snapshot
+import lib.templates
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+
+def main():
+    logging.basicConfig(format='%(message)s')
+    lib.resources.build_mappings()
+    lib.templates.build_bundle()
+    lib.snapshot.build_snapshot()
+
+
+if __name__ == '__main__':
+    main()
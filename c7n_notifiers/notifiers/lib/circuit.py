@@ -0,0 +1,177 @@
+import collections
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+import lib.deadline
+import lib.transport
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Seconds a request can take to connect or between reads before it fails
+HTTP_TIMEOUT = float(os.environ.get('C7N_NOTIFIERS_HTTP_TIMEOUT', 10))
+# A host's circuit opens when at least this fraction of its last
+# CIRCUIT_WINDOW requests failed or were slow, once there have been
+# CIRCUIT_MIN_REQUESTS of them
+CIRCUIT_FAILURE_RATE = float(
+    os.environ.get('C7N_NOTIFIERS_CIRCUIT_FAILURE_RATE', 0.5)
+)
+CIRCUIT_WINDOW = int(os.environ.get('C7N_NOTIFIERS_CIRCUIT_WINDOW', 10))
+CIRCUIT_MIN_REQUESTS = int(
+    os.environ.get('C7N_NOTIFIERS_CIRCUIT_MIN_REQUESTS', 4)
+)
+# Requests taking longer than this, in seconds, count as failures
+CIRCUIT_SLOW_SECONDS = float(
+    os.environ.get('C7N_NOTIFIERS_CIRCUIT_SLOW_SECONDS', 5)
+)
+# Seconds an open circuit waits before letting a request through to see if
+# the host has recovered
+CIRCUIT_OPEN_SECONDS = float(
+    os.environ.get('C7N_NOTIFIERS_CIRCUIT_OPEN_SECONDS', 30)
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    # Stops requests to a host once too many of its recent requests have
+    # failed or been slow, so they fail at once rather than each waiting on
+    # the network. After open_seconds a single probe request is let through
+    # (half-open), which closes the circuit if it succeeds and opens it
+    # again if not.
+    def __init__(self, host, failure_rate=CIRCUIT_FAILURE_RATE,
+                 window=CIRCUIT_WINDOW, min_requests=CIRCUIT_MIN_REQUESTS,
+                 slow_seconds=CIRCUIT_SLOW_SECONDS,
+                 open_seconds=CIRCUIT_OPEN_SECONDS, clock=time.monotonic):
+        self.host = host
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.clock = clock
+        # True for each recent request that failed
+        self.outcomes = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        # Whether a request would be refused now, without letting a probe
+        # through
+        with self.lock:
+            if self.state == OPEN:
+                return self.clock() - self.opened < self.open_seconds
+            return self.state == HALF_OPEN and self.probing
+
+    def allow(self):
+        # Whether a request can be made. Every allowed request must be
+        # followed by record().
+        with self.lock:
+            if self.state == OPEN:
+                if self.clock() - self.opened < self.open_seconds:
+                    return False
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record(self, failed):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self.trip()
+                else:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    logger.info("Circuit for {} closed".format(self.host))
+                return
+            self.outcomes.append(failed)
+            if (len(self.outcomes) >= self.min_requests and
+                    sum(self.outcomes) >= self.failure_rate *
+                    len(self.outcomes)):
+                self.trip()
+
+    def trip(self):
+        self.state = OPEN
+        self.opened = self.clock()
+        self.outcomes.clear()
+        logger.warning(
+            "Circuit for {} opened, not sending to it for {}s".format(
+                self.host, self.open_seconds
+            )
+        )
+
+
+# Circuit breakers by host, kept for as long as the container so every
+# invocation it handles knows which hosts are down
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_host(url):
+    return urllib.parse.urlsplit(url).netloc
+
+
+def get_circuit_breaker(host):
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(host)
+        return _circuit_breakers[host]
+
+
+def is_open(host):
+    return get_circuit_breaker(host).is_open()
+
+
+def urlopen(req, timeout=HTTP_TIMEOUT):
+    # lib.transport.urlopen through the circuit breaker of the request's
+    # host. Server errors, connection errors, timeouts and slow responses
+    # count against the host. Raises CircuitOpenError without making the
+    # request when its circuit is open. The timeout is cut short to the
+    # thread's deadline, if it has one, see lib/deadline.py.
+    breaker = get_circuit_breaker(get_host(req.full_url))
+    deadline = lib.deadline.get_current()
+    if deadline is not None:
+        deadline.check("to send to {}".format(breaker.host))
+        timeout = min(timeout, deadline.remaining())
+    if not breaker.allow():
+        raise CircuitOpenError(
+            "Circuit for {} is open".format(breaker.host)
+        )
+    failed = True
+    start = time.monotonic()
+    try:
+        response = lib.transport.urlopen(req, timeout=timeout)
+        failed = time.monotonic() - start > breaker.slow_seconds
+        return response
+    except urllib.error.HTTPError as e:
+        failed = e.code >= 500
+        raise
+    except OSError as e:
+        if deadline is not None and deadline.expired():
+            # Timing out on the deadline says nothing about the host
+            failed = False
+            raise lib.deadline.DeadlineExceeded(
+                "Ran out of time sending to {}".format(breaker.host)
+            ) from e
+        raise
+    except Exception:
+        failed = False
+        raise
+    finally:
+        breaker.record(failed)
@@ -0,0 +1,96 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Seconds before the Lambda timeout that all work must have stopped by, to
+# leave time to log metrics and return
+DEADLINE_MARGIN = float(os.environ.get('C7N_NOTIFIERS_DEADLINE_MARGIN', 0.3))
+# Share of the time left when messages arrive that extracting their
+# resources can take, the rest is for rendering and sending them
+EXTRACTION_SHARE = float(
+    os.environ.get('C7N_NOTIFIERS_EXTRACTION_SHARE', 0.5)
+)
+# Seconds kept back from sending to render and spool what couldn't be sent
+SPOOL_RESERVE = float(os.environ.get('C7N_NOTIFIERS_SPOOL_RESERVE', 0.5))
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class Deadline:
+    # The time left for some work, asked of get_remaining, a function
+    # returning seconds, every time so it follows whatever clock that uses.
+    # A Lambda context's get_remaining_time_in_millis in the handlers, a
+    # fake one in devtools/fake_context.py.
+    def __init__(self, get_remaining):
+        self.get_remaining = get_remaining
+
+    def remaining(self):
+        return max(0.0, self.get_remaining())
+
+    def expired(self):
+        return self.get_remaining() <= 0
+
+    def check(self, work):
+        if self.expired():
+            raise DeadlineExceeded("Ran out of time {}".format(work))
+
+    def keep_back(self, seconds):
+        # A deadline seconds before this one
+        return Deadline(lambda: self.get_remaining() - seconds)
+
+    def share(self, fraction):
+        # A deadline using fraction of the time left now
+        return self.keep_back(self.remaining() * (1 - fraction))
+
+
+def after(seconds, clock=time.monotonic):
+    end = clock() + seconds
+    return Deadline(lambda: end - clock())
+
+
+def from_context(context, margin=DEADLINE_MARGIN):
+    # The deadline of a Lambda invocation, or None if the context doesn't
+    # have one, e.g. when a handler is called locally without a context
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis',
+                                 None)
+    if get_remaining_time is None:
+        return None
+    return Deadline(lambda: get_remaining_time() / 1000 - margin)
+
+
+# The deadline of the send being made by each thread, which bounds the
+# timeouts of its requests, see lib/circuit.py
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def limit(deadline):
+    # Makes deadline the current thread's deadline
+    previous = get_current()
+    _current.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _current.deadline = previous
+
+
+def get_current():
+    return getattr(_current, 'deadline', None)
+
+
+def bind(function):
+    # function, made to run with the calling thread's deadline when it's
+    # called from another thread
+    deadline = get_current()
+
+    def bound(*args, **kwargs):
+        with limit(deadline):
+            return function(*args, **kwargs)
+    return bound
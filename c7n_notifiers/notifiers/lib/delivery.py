@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+import lib.circuit
+import lib.deadline
+import lib.ratelimit
+import lib.spool
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Deliveries are made in this order, then oldest first
+SEVERITY_PRIORITY = {'danger': 0, 'warning': 1}
+DEFAULT_PRIORITY = len(SEVERITY_PRIORITY)
+# Deliveries per second to each destination, and how many can be made at
+# once before the rate applies
+DESTINATION_RATE = float(
+    os.environ.get('C7N_NOTIFIERS_DESTINATION_RATE', 1)
+)
+DESTINATION_BURST = int(
+    os.environ.get('C7N_NOTIFIERS_DESTINATION_BURST', 1)
+)
+# Deliveries made at once, each to a different destination. Deliveries to
+# the same destination are always made one after the other, in order.
+DELIVERY_WORKERS = int(
+    os.environ.get('C7N_NOTIFIERS_DELIVERY_WORKERS', 4)
+)
+# Seconds deliveries can be made for before the rest are spooled, a little
+# under the function's timeout less the time taken to prepare them
+DELIVERY_BUDGET = float(
+    os.environ.get('C7N_NOTIFIERS_DELIVERY_BUDGET', 2.5)
+)
+# Seconds a delivery is expected to take until one has been timed
+DELIVERY_ESTIMATE = 1.0
+
+# Outcomes passed to Delivery.record
+DELIVERED = 'delivered'
+SPOOLED = 'spooled'
+
+
+class Delivery:
+    # Everything sent to one destination for one message. send makes the
+    # delivery, get_payload renders it for the spool should it be deferred
+    # instead, along with what send had sent if it ran out of time part
+    # way, or is None for deliveries replayed from the spool, which stay
+    # there when deferred and are recorded as spooled. key identifies
+    # the message it is for and host is the host it is sent to, whose
+    # circuit breaker is checked before sending. record, if given, is
+    # called with the outcome once the delivery has been sent or spooled.
+    def __init__(self, destination, severity, send, get_payload, key=None,
+                 created=None, host=None, record=None):
+        self.destination = destination
+        self.host = host
+        self.record = record
+        self.severity = severity
+        self.send = send
+        self.get_payload = get_payload
+        self.key = key
+        self.created = time.time() if created is None else created
+
+    @property
+    def priority(self):
+        return SEVERITY_PRIORITY.get(self.severity, DEFAULT_PRIORITY)
+
+
+class DeliveryReport:
+    def __init__(self):
+        self.delivered = []
+        self.deferred = []
+        # Deliveries there wasn't even time to spool
+        self.cancelled = []
+        # (delivery, exception)
+        self.failed = []
+
+    def get_summary(self):
+        return {
+            'delivered': len(self.delivered),
+            'deferred': [delivery.destination for delivery in self.deferred],
+            'cancelled': [
+                delivery.destination for delivery in self.cancelled
+            ],
+            'failed': len(self.failed)
+        }
+
+
+class DeliveryScheduler:
+    # Makes queued deliveries most severe and then oldest first, keeping to
+    # the rate limit of each destination. A delivery that is waiting on its
+    # destination's rate limit doesn't hold up deliveries to other
+    # destinations. Deliveries that can't be made within budget seconds of
+    # the scheduler being created are rendered into the spool rather than
+    # dropped, as are deliveries to hosts whose circuit is open. A budget of
+    # None has no deadline. Given a deadline, see lib/deadline.py, it's used
+    # in place of the budget and bounds each send. Once cancel_deadline has
+    # passed, the rest are cancelled without being spooled. Up to workers
+    # destinations are delivered to at once, on threads of their own, but
+    # only one delivery to each destination is ever in progress.
+    def __init__(self, budget=DELIVERY_BUDGET, rate=DESTINATION_RATE,
+                 burst=DESTINATION_BURST, clock=time.monotonic,
+                 sleep=time.sleep, spool=lib.spool.spool_payload,
+                 deadline=None, cancel_deadline=None,
+                 workers=DELIVERY_WORKERS):
+        if deadline is None and budget is not None:
+            deadline = lib.deadline.after(budget, clock)
+        self.deadline = deadline
+        self.cancel_deadline = cancel_deadline
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.spool = spool
+        self.queue = []
+        self.order = itertools.count()
+        self.rate_limiters = {}
+        self.estimate = DELIVERY_ESTIMATE
+        self.workers = workers
+        # Destinations with a delivery in progress
+        self.sending = set()
+        self.lock = threading.Lock()
+
+    def add(self, delivery):
+        with self.lock:
+            heapq.heappush(self.queue, (delivery.priority, delivery.created,
+                                        next(self.order), delivery))
+
+    def __len__(self):
+        return len(self.queue)
+
+    def get_rate_limiter(self, destination):
+        if destination not in self.rate_limiters:
+            self.rate_limiters[destination] = lib.ratelimit.RateLimiter(
+                self.rate, self.burst, clock=self.clock, sleep=self.sleep
+            )
+        return self.rate_limiters[destination]
+
+    def next_delivery(self):
+        # Pops the first delivery whose destination isn't rate limited,
+        # returning it with 0, or if all of them are, the first delivery
+        # with how long its destination is limited for. Deliveries to
+        # destinations already being sent to are left for the worker
+        # sending to them, so None is returned when only those are left.
+        with self.lock:
+            skipped = []
+            held = []
+            chosen = None
+            while self.queue:
+                entry = heapq.heappop(self.queue)
+                if entry[3].destination in self.sending:
+                    held.append(entry)
+                    continue
+                delay = self.get_rate_limiter(entry[3].destination).get_delay()
+                if delay == 0:
+                    chosen = (entry[3], 0)
+                    break
+                skipped.append((entry, delay))
+            if chosen is None and skipped:
+                entry, delay = min(skipped, key=lambda item: item[1])
+                skipped.remove((entry, delay))
+                chosen = (entry[3], delay)
+            for entry, _ in skipped:
+                heapq.heappush(self.queue, entry)
+            for entry in held:
+                heapq.heappush(self.queue, entry)
+            if chosen is not None:
+                self.sending.add(chosen[0].destination)
+            return chosen
+
+    def done(self, delivery, seconds=None):
+        with self.lock:
+            self.sending.discard(delivery.destination)
+            # The longest delivery so far is kept back from the deadline
+            if seconds is not None:
+                self.estimate = max(self.estimate, seconds)
+
+    def has_time_for(self, delay):
+        if self.deadline is None:
+            return True
+        return delay + self.estimate < self.deadline.remaining()
+
+    def defer(self, delivery, report):
+        if (self.cancel_deadline is not None and
+                self.cancel_deadline.expired()):
+            report.cancelled.append(delivery)
+            return
+        if delivery.get_payload is None:
+            report.deferred.append(delivery)
+            self.record(delivery, SPOOLED)
+            return
+        try:
+            self.spool(delivery.get_payload())
+        except Exception as e:
+            logger.exception("Unable to spool delivery to {}".format(
+                delivery.destination
+            ))
+            report.failed.append((delivery, e))
+            return
+        report.deferred.append(delivery)
+        self.record(delivery, SPOOLED)
+
+    def record(self, delivery, outcome):
+        if delivery.record is None:
+            return
+        try:
+            delivery.record(outcome)
+        except Exception:
+            logger.exception("Unable to record delivery to {}".format(
+                delivery.destination
+            ))
+
+    def run(self):
+        report = DeliveryReport()
+        destinations = len({entry[3].destination for entry in self.queue})
+        workers = min(self.workers, destinations)
+        if workers < 2:
+            self.work(report)
+        else:
+            threads = [
+                threading.Thread(target=self.work, args=(report,),
+                                 name='c7n-notifiers-delivery-{}'.format(n),
+                                 daemon=True)
+                for n in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if report.deferred or report.cancelled:
+            logger.warning(
+                "Deferred {} deliveries to the spool and cancelled {}, {} "
+                "were delivered: {}".format(len(report.deferred),
+                                            len(report.cancelled),
+                                            len(report.delivered),
+                                            report.get_summary())
+            )
+        return report
+
+    def work(self, report):
+        # Makes deliveries until there are none left this worker can make.
+        # The report's lists are only ever appended to, so are shared by
+        # every worker.
+        while True:
+            chosen = self.next_delivery()
+            if chosen is None:
+                break
+            delivery, delay = chosen
+            if not self.has_time_for(delay):
+                self.defer(delivery, report)
+                self.done(delivery)
+                continue
+            if delivery.host is not None and lib.circuit.is_open(
+                    delivery.host):
+                self.defer(delivery, report)
+                self.done(delivery)
+                continue
+            rate_limiter = self.get_rate_limiter(delivery.destination)
+            rate_limiter.wait()
+            start = self.clock()
+            try:
+                with lib.deadline.limit(self.deadline), \
+                        lib.ratelimit.limit(rate_limiter):
+                    delivery.send()
+            except (lib.circuit.CircuitOpenError,
+                    lib.deadline.DeadlineExceeded):
+                # The circuit opened after the delivery was scheduled, or
+                # the send ran out of time
+                self.defer(delivery, report)
+            except Exception as e:
+                logger.exception("Delivery to {} failed".format(
+                    delivery.destination
+                ))
+                report.failed.append((delivery, e))
+            else:
+                report.delivered.append(delivery)
+                self.record(delivery, DELIVERED)
+            self.done(delivery, self.clock() - start)
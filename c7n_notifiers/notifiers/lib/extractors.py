@@ -0,0 +1,218 @@
+from datetime import datetime
+import logging
+import re
+
+import lib.inference
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Matches the datetimes get_datetime parses, so they can be built without
+# strptime. Anything else is left to get_datetime.
+DATETIME_PATTERN = re.compile(
+    r'([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})'
+    r'(?:\.([0-9]{1,6}))?\+00:00\Z'
+)
+
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+def get_datetime_parser(get_datetime):
+    match = DATETIME_PATTERN.match
+
+    def parse_datetime(value):
+        if type(value) is str:
+            parts = match(value)
+            if parts:
+                (year, month, day,
+                 hour, minute, second, fraction) = parts.groups()
+                try:
+                    return datetime(
+                        int(year), int(month), int(day),
+                        int(hour), int(minute), int(second),
+                        int(fraction.ljust(6, '0')) if fraction else 0
+                    )
+                except ValueError:
+                    pass
+        return get_datetime(value)
+
+    return parse_datetime
+
+
+class Emitter:
+    # Turns JMESPath ASTs into Python statements with the same result as
+    # the JMESPath interpreter. Only the expressions used by resource
+    # mappings are supported: fields, subexpressions, literals and filter
+    # projections comparing a field with a string literal.
+    def __init__(self):
+        self.lines = []
+        self.indent = 1
+        self.names = 0
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def new_name(self):
+        self.names += 1
+        return "v{}".format(self.names)
+
+    def emit_node(self, node, source, target, source_is_dict=False):
+        node_type = node['type']
+        if node_type == 'field':
+            if source_is_dict:
+                self.emit("{} = {}.get({!r})".format(
+                    target, source, node['value']
+                ))
+            else:
+                self.emit(
+                    "{0} = {1}.get({2!r}) if isinstance({1}, dict) "
+                    "else None".format(target, source, node['value'])
+                )
+        elif node_type == 'subexpression':
+            for child in node['children']:
+                self.emit_node(child, source, target, source_is_dict)
+                source = target
+                source_is_dict = False
+        elif node_type == 'identity':
+            self.emit("{} = {}".format(target, source))
+        elif node_type == 'literal':
+            if type(node['value']) not in LITERAL_TYPES:
+                raise UnsupportedExpression(node_type)
+            self.emit("{} = {!r}".format(target, node['value']))
+        elif node_type == 'filter_projection':
+            self.emit_filter_projection(node, source, target, source_is_dict)
+        else:
+            raise UnsupportedExpression(node_type)
+
+    def emit_filter_projection(self, node, source, target, source_is_dict):
+        base_node, projection_node, comparator_node = node['children']
+        if comparator_node['value'] not in ('eq', 'ne'):
+            raise UnsupportedExpression(comparator_node['value'])
+        left_node, right_node = comparator_node['children']
+        if (right_node['type'] != 'literal' or
+                type(right_node['value']) is not str):
+            raise UnsupportedExpression("comparator")
+        operator = '==' if comparator_node['value'] == 'eq' else '!='
+
+        base = self.new_name()
+        item = self.new_name()
+        left = self.new_name()
+        current = self.new_name()
+        self.emit_node(base_node, source, base, source_is_dict)
+        self.emit("if isinstance({}, list):".format(base))
+        self.indent += 1
+        self.emit("{} = []".format(target))
+        self.emit("for {} in {}:".format(item, base))
+        self.indent += 1
+        self.emit_node(left_node, item, left)
+        self.emit("if {} {} {!r}:".format(left, operator,
+                                           right_node['value']))
+        self.indent += 1
+        self.emit_node(projection_node, item, current)
+        self.emit("if {} is not None:".format(current))
+        self.emit("    {}.append({})".format(target, current))
+        self.indent -= 3
+        self.emit("else:")
+        self.emit("    {} = None".format(target))
+
+
+def get_url_parts(url_template):
+    # Splits a url template into literal text and the names substituted
+    # into it, or returns None if it can't be substituted.
+    pattern = url_template.pattern
+    template = url_template.template
+    parts = []
+    position = 0
+    for match in pattern.finditer(template):
+        if match.start() > position:
+            parts.append((False, template[position:match.start()]))
+        if match.group('escaped') is not None:
+            parts.append((False, url_template.delimiter))
+        elif match.group('invalid') is not None:
+            return None
+        else:
+            parts.append((True,
+                          match.group('named') or match.group('braced')))
+        position = match.end()
+    if position < len(template):
+        parts.append((False, template[position:]))
+    return parts
+
+
+def get_extractor_source(prepared_mapping, name):
+    # The generated function makes the same dict as extract_resource_info,
+    # see lib/resources.py, with the JMESPath expressions, post processing
+    # and url template inlined. Expressions that can't be generated are
+    # searched with JMESPath, as are resources that aren't objects.
+    emitter = Emitter()
+    emitter.emit("if not isinstance(resource, dict):")
+    emitter.emit("    return interpret(resource, region)")
+    emitter.emit("info = {'region': region}")
+    for index, (key, expression) in enumerate(prepared_mapping['info']):
+        mark = len(emitter.lines)
+        try:
+            emitter.emit_node(expression.parsed, 'resource', 'value',
+                              source_is_dict=True)
+        except UnsupportedExpression as e:
+            logger.debug("Searching {} with JMESPath: {}".format(
+                expression.expression, e
+            ))
+            del emitter.lines[mark:]
+            emitter.indent = 1
+            emitter.emit(
+                "value = expressions[{}].search(resource)".format(index)
+            )
+
+        if key == 'creation_datetime':
+            emitter.emit("value = parse_datetime(value)")
+        elif key == 'creator' and not prepared_mapping['inferred']:
+            emitter.emit("if type(value) is list:")
+            emitter.emit("    value = value[0]")
+        elif key == 'name':
+            emitter.emit("if type(value) is list and len(value) < 2:")
+            emitter.emit("    value = value[0] if value else ''")
+        emitter.emit("info[{!r}] = value".format(key))
+
+    if prepared_mapping['inferred']:
+        emitter.emit("fill_missing_info(info)")
+
+    url_template = prepared_mapping['url']
+    if url_template:
+        url_parts = get_url_parts(url_template)
+        if url_parts is None:
+            emitter.emit("info['url'] = url_template.substitute(info)")
+        else:
+            emitter.emit("info['url'] = ''.join([{}])".format(", ".join(
+                "str(info[{!r}])".format(part) if is_name else repr(part)
+                for is_name, part in url_parts
+            )))
+    emitter.emit("return info")
+
+    return "def {}(resource, region):\n{}\n".format(
+        name, "\n".join(emitter.lines)
+    )
+
+
+def compile_extractor(prepared_mapping, interpret, get_datetime,
+                      name='extract'):
+    # Returns a function of (resource, region) generated for one resource
+    # mapping. interpret is the interpreted equivalent, used for anything
+    # the generated code doesn't handle itself.
+    source = get_extractor_source(prepared_mapping, name)
+    namespace = {
+        'interpret': interpret,
+        'expressions': [
+            expression for _, expression in prepared_mapping['info']
+        ],
+        'parse_datetime': get_datetime_parser(get_datetime),
+        'url_template': prepared_mapping['url'],
+        'fill_missing_info': lib.inference.fill_missing_info
+    }
+    exec(compile(source, '<extractor {}>'.format(name), 'exec'), namespace)
+    extractor = namespace[name]
+    extractor.source = source
+    return extractor
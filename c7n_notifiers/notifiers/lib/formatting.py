@@ -0,0 +1,183 @@
+from datetime import datetime
+import io
+import logging
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Creation time of resources whose inferred mapping found none, so they
+# sort after every other resource and are shown without one
+UNKNOWN_DATETIME = datetime.min
+
+RESOURCE_ID_PAD = 22
+RESOURCE_NAME_PAD = 15
+CREATION_DT_PAD = 19
+CREATOR_PAD = 12
+FIXED_COLUMN_WIDTHS = (
+    RESOURCE_ID_PAD, RESOURCE_NAME_PAD, CREATION_DT_PAD, CREATOR_PAD
+)
+
+# Upper bound on each column when sized to its content. Datetimes always
+# have the same length so that column is never resized.
+RESOURCE_ID_MAX_PAD = 48
+RESOURCE_NAME_MAX_PAD = 32
+CREATOR_MAX_PAD = 24
+# Number of characters a rendered line may use. Past this slack wraps the
+# lines of a code block which makes the table unreadable.
+LINE_WIDTH_BUDGET = 100
+
+HEADER = ("ResourceId", "ResourceName", "CreationDateTime", "Creator")
+COLUMN_SEPARATOR = "  "
+
+# Size of each piece a table is split into when it is sent over several
+# messages, small enough to read without expanding the message in slack.
+MAX_CHUNK_CHARACTERS = 3500
+
+
+def get_row_template(resource_name_pad, creation_dt_pad, creator_pad):
+    # The resource id column is padded while it is built, as its width on
+    # screen differs from its length whenever it is rendered as a link.
+    # Every other column has a fixed width, so the layout is compiled once
+    # per table into a bound format method.
+    return COLUMN_SEPARATOR.join([
+        "{}",
+        "{{:<{}}}".format(resource_name_pad),
+        "{{:<{}}}".format(creation_dt_pad),
+        "{{:<{}}}".format(creator_pad)
+    ]).format
+
+
+def format_datetime_column(datetimes):
+    # Resources created together share timestamps, so only strftime each
+    # unique value once.
+    formatted = {dt: format_datetime(dt) for dt in set(datetimes)}
+    return [formatted[dt] for dt in datetimes]
+
+
+def format_datetime(dt):
+    if dt == UNKNOWN_DATETIME:
+        return ''
+    return dt.strftime(DATETIME_FORMAT)
+
+
+def format_resource_id_column(ids, urls, resource_id_pad):
+    # Slack renders '<url|id>' as just the id, which removes many characters
+    # on screen, so white space needs to be added after the link to
+    # compensate for the removal of characters when rendered.
+    pads = [" " * width for width in range(resource_id_pad + 1)]
+    column = []
+    for resource_id, url in zip(ids, urls):
+        resource_id = resource_id[:resource_id_pad]
+        pad = pads[resource_id_pad - len(resource_id)]
+        if url:
+            column.append('<{}|{}>{}'.format(url, resource_id, pad))
+        else:
+            column.append(resource_id + pad)
+    return column
+
+
+def get_column_widths(resources, line_width=LINE_WIDTH_BUDGET):
+    # Size each column to its longest value in a single pass over the
+    # resources. Columns are never narrower than their header so the header
+    # line stays readable.
+    id_width = len(HEADER[0])
+    name_width = len(HEADER[1])
+    creator_width = len(HEADER[3])
+    for resource in resources:
+        if len(resource['id']) > id_width:
+            id_width = len(resource['id'])
+        if len(resource['name']) > name_width:
+            name_width = len(resource['name'])
+        if len(resource['creator']) > creator_width:
+            creator_width = len(resource['creator'])
+
+    widths = [
+        min(id_width, RESOURCE_ID_MAX_PAD),
+        min(name_width, RESOURCE_NAME_MAX_PAD),
+        CREATION_DT_PAD,
+        min(creator_width, CREATOR_MAX_PAD)
+    ]
+
+    # Shrink the widest resizable column a character at a time until the
+    # line fits the budget, or every column is down to its header.
+    resizable = [0, 1, 3]
+    overflow = (
+        sum(widths) + len(COLUMN_SEPARATOR) * (len(widths) - 1) - line_width
+    )
+    while overflow > 0:
+        shrinkable = [
+            column for column in resizable
+            if widths[column] > len(HEADER[column])
+        ]
+        if not shrinkable:
+            break
+        widest = max(shrinkable, key=lambda column: widths[column])
+        widths[widest] -= 1
+        overflow -= 1
+
+    logger.debug("resource table column widths: {}".format(widths))
+
+    return tuple(widths)
+
+
+def format_resource_table(resources, column_widths=None):
+    # Formatting is done a column at a time rather than a row at a time so
+    # truncation, link padding and datetime formatting are each done in a
+    # single pass, then the rows are stitched together with a precompiled
+    # template. Column widths are sized to the resources unless given.
+    if column_widths is None:
+        column_widths = get_column_widths(resources)
+    (resource_id_pad,
+     resource_name_pad,
+     creation_dt_pad,
+     creator_pad) = column_widths
+
+    row_template = get_row_template(resource_name_pad,
+                                    creation_dt_pad,
+                                    creator_pad)
+
+    id_column = format_resource_id_column(
+        [resource['id'] for resource in resources],
+        [resource.get('url') for resource in resources],
+        resource_id_pad
+    )
+    name_column = [
+        resource['name'][:resource_name_pad] for resource in resources
+    ]
+    datetime_column = format_datetime_column(
+        [resource['creation_datetime'] for resource in resources]
+    )
+    creator_column = [
+        resource['creator'][:creator_pad] for resource in resources
+    ]
+
+    output = io.StringIO()
+    output.write(
+        row_template(HEADER[0].ljust(resource_id_pad), *HEADER[1:])
+    )
+    for row in zip(id_column, name_column, datetime_column, creator_column):
+        output.write("\n")
+        output.write(row_template(*row))
+
+    return output.getvalue()
+
+
+def split_resource_table(table, max_characters=MAX_CHUNK_CHARACTERS):
+    # Split a formatted table into chunks of whole lines, each starting with
+    # the header line, so each chunk can be sent as a separate message.
+    lines = table.split("\n")
+    header = lines[0]
+    chunks = []
+    chunk = [header]
+    chunk_characters = len(header)
+    for line in lines[1:]:
+        if (len(chunk) > 1 and
+                chunk_characters + 1 + len(line) > max_characters):
+            chunks.append("\n".join(chunk))
+            chunk = [header]
+            chunk_characters = len(header)
+        chunk.append(line)
+        chunk_characters += 1 + len(line)
+    chunks.append("\n".join(chunk))
+    return chunks
@@ -0,0 +1,210 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Where the outcome of delivering each message to each destination is
+# recorded, so a message that is delivered again isn't sent again. A SQLite
+# database file, a sqlite:// url or memory:// to only keep outcomes in
+# memory. Lambda's /tmp only lasts as long as the container, so use a
+# mounted volume to share outcomes between containers.
+IDEMPOTENCY_LOCATION = os.environ.get(
+    'C7N_NOTIFIERS_IDEMPOTENCY_LOCATION',
+    '/tmp/c7n_notifiers/idempotency.sqlite3'
+)
+# Seconds outcomes are kept for. SNS stops retrying a Lambda Function well
+# within this.
+IDEMPOTENCY_TTL = float(
+    os.environ.get('C7N_NOTIFIERS_IDEMPOTENCY_TTL', 24 * 60 * 60)
+)
+# Number of messages whose outcomes are kept in memory
+IDEMPOTENCY_CACHE_SIZE = int(
+    os.environ.get('C7N_NOTIFIERS_IDEMPOTENCY_CACHE_SIZE', 1000)
+)
+
+
+class MemoryIdempotencyStore:
+    # The outcomes of the most recently used messages, by message id then
+    # (destination, template)
+    def __init__(self, size=IDEMPOTENCY_CACHE_SIZE):
+        self.size = size
+        self.outcomes = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, message_id):
+        with self.lock:
+            outcomes = self.outcomes.get(message_id)
+            if outcomes is None:
+                return None
+            self.outcomes.move_to_end(message_id)
+            return dict(outcomes)
+
+    def put(self, message_id, outcomes):
+        with self.lock:
+            self.outcomes[message_id] = dict(outcomes)
+            self.outcomes.move_to_end(message_id)
+            while len(self.outcomes) > self.size:
+                self.outcomes.popitem(last=False)
+
+    def record(self, message_id, destination, template, outcome):
+        with self.lock:
+            if message_id in self.outcomes:
+                self.outcomes[message_id][(destination, template)] = outcome
+                return
+        self.put(message_id, {(destination, template): outcome})
+
+
+class SQLiteIdempotencyStore:
+    # Outcomes in a SQLite database, so they outlast the process. Expired
+    # outcomes are removed when the database is opened.
+    def __init__(self, path, ttl=IDEMPOTENCY_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        if self.connection is None:
+            import sqlite3
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         check_same_thread=False)
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS outcomes ("
+                    "message_id TEXT NOT NULL, "
+                    "destination TEXT NOT NULL, "
+                    "template TEXT NOT NULL, "
+                    "outcome TEXT NOT NULL, "
+                    "recorded REAL NOT NULL, "
+                    "PRIMARY KEY (message_id, destination, template))"
+                )
+                connection.execute(
+                    "DELETE FROM outcomes WHERE recorded < ?",
+                    (self.clock() - self.ttl,)
+                )
+            self.connection = connection
+        return self.connection
+
+    def get(self, message_id):
+        with self.lock:
+            rows = self.get_connection().execute(
+                "SELECT destination, template, outcome FROM outcomes "
+                "WHERE message_id = ? AND recorded >= ?",
+                (message_id, self.clock() - self.ttl)
+            ).fetchall()
+        if not rows:
+            return None
+        return {
+            (destination, template): outcome
+            for destination, template, outcome in rows
+        }
+
+    def record(self, message_id, destination, template, outcome):
+        with self.lock:
+            connection = self.get_connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?)",
+                    (message_id, destination, template, outcome,
+                     self.clock())
+                )
+
+
+class CachedIdempotencyStore:
+    # A MemoryIdempotencyStore in front of another store, so retries that
+    # reach the same warm container don't read the store. Outcomes are
+    # written through to both.
+    def __init__(self, store, size=IDEMPOTENCY_CACHE_SIZE):
+        self.store = store
+        self.cache = MemoryIdempotencyStore(size)
+
+    def get(self, message_id):
+        outcomes = self.cache.get(message_id)
+        if outcomes is None:
+            outcomes = self.store.get(message_id)
+            if outcomes is not None:
+                self.cache.put(message_id, outcomes)
+        return outcomes
+
+    def record(self, message_id, destination, template, outcome):
+        self.cache.record(message_id, destination, template, outcome)
+        self.store.record(message_id, destination, template, outcome)
+
+
+def get_sqlite_store(location):
+    return CachedIdempotencyStore(SQLiteIdempotencyStore(location))
+
+
+def get_memory_store(location):
+    return MemoryIdempotencyStore()
+
+
+# Idempotency stores by url scheme, each created from the rest of the
+# location. Locations without a scheme are SQLite database files.
+IDEMPOTENCY_STORES = {
+    'memory': get_memory_store,
+    'sqlite': get_sqlite_store
+}
+
+
+def get_idempotency_store(location=IDEMPOTENCY_LOCATION):
+    scheme, separator, rest = location.partition('://')
+    if not separator:
+        return get_sqlite_store(location)
+    try:
+        return IDEMPOTENCY_STORES[scheme](rest)
+    except KeyError:
+        raise ValueError(
+            "Unknown idempotency location {}, must be a file or one of "
+            "{}".format(location, ', '.join(
+                scheme + '://' for scheme in sorted(IDEMPOTENCY_STORES)
+            ))
+        )
+
+
+_idempotency_store = None
+_idempotency_store_lock = threading.Lock()
+
+
+def get_store():
+    global _idempotency_store
+    with _idempotency_store_lock:
+        if _idempotency_store is None:
+            _idempotency_store = get_idempotency_store()
+        return _idempotency_store
+
+
+def get_outcomes(message_id):
+    # The recorded outcomes of the message by (destination, template),
+    # empty if it hasn't been seen or the store can't be read, in which
+    # case it is delivered as if it hadn't
+    if message_id is None:
+        return {}
+    try:
+        return get_store().get(message_id) or {}
+    except Exception:
+        logger.exception(
+            "Unable to read the outcomes of message {}".format(message_id)
+        )
+        return {}
+
+
+def record_outcome(message_id, destination, template, outcome):
+    if message_id is None:
+        return
+    try:
+        get_store().record(message_id, destination, template, outcome)
+    except Exception:
+        logger.exception(
+            "Unable to record the outcome of message {} for {}".format(
+                message_id, destination
+            )
+        )
@@ -0,0 +1,148 @@
+import logging
+import re
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Keys holding the id of some other resource rather than of the resource
+REFERENCE_KEYS = {
+    'AccountId', 'OwnerId', 'VpcId', 'SubnetId', 'KmsKeyId', 'KeyId',
+    'RequesterId', 'ReservationId', 'HostedZoneId', 'CanonicalHostedZoneId'
+}
+ID_SUFFIX_SCORES = [('Identifier', 5), ('Id', 4), ('Name', 3), ('Arn', 1)]
+CREATION_KEY_PATTERN = re.compile(r'Creat|Launch', re.IGNORECASE)
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# Only nested this deep is searched for the creation time, e.g.
+# Status.Timeline.CreationDateTime
+MAX_DEPTH = 3
+
+NAME_TAG_PATH = "Tags[?Key=='Name'].Value"
+CREATOR_TAG_PATH = "Tags[?Key=='Creator'].Value"
+# JMESPath literal for resources without anywhere to find a creator
+EMPTY_PATH = "''"
+
+
+def quote_key(key):
+    if IDENTIFIER_PATTERN.match(key):
+        return key
+    return '"{}"'.format(key.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def has_tags(sample):
+    tags = sample.get('Tags')
+    return (
+        type(tags) is list and
+        all(type(tag) is dict and 'Key' in tag for tag in tags)
+    )
+
+
+def find_id_key(resource_type, sample):
+    # Score every top level string by how much its key looks like the
+    # resource's own identifier, preferring keys that mention the resource
+    # type, e.g. ClusterIdentifier for a cluster.
+    type_tokens = [
+        token for token in resource_type.lower().split('-')
+        if len(token) >= 3
+    ]
+    best_key = None
+    best_score = 0
+    for key, value in sample.items():
+        if type(value) is not str or not value:
+            continue
+        score = 0
+        for suffix, suffix_score in ID_SUFFIX_SCORES:
+            if key.endswith(suffix):
+                score = suffix_score
+                break
+        if not score:
+            continue
+        if key in REFERENCE_KEYS:
+            score -= 3
+        if any(token in key.lower() for token in type_tokens):
+            score += 3
+        if score > best_score:
+            best_key = key
+            best_score = score
+    return best_key
+
+
+def find_name_path(sample, id_path):
+    if has_tags(sample):
+        return NAME_TAG_PATH
+    for key, value in sample.items():
+        if key.endswith('Name') and type(value) is str:
+            return quote_key(key)
+    return id_path
+
+
+def find_creation_path(sample, parse_datetime, path=(), depth=1):
+    # Breadth first, so a top level CreationDate wins over one nested in a
+    # sub resource.
+    nested = []
+    for key, value in sample.items():
+        if type(value) is dict and depth < MAX_DEPTH:
+            nested.append((key, value))
+        elif (type(value) is str and
+                CREATION_KEY_PATTERN.search(key)):
+            try:
+                parse_datetime(value)
+            except (RuntimeError, ValueError):
+                continue
+            return '.'.join(quote_key(k) for k in path + (key,))
+    for key, value in nested:
+        found = find_creation_path(value, parse_datetime, path + (key,),
+                                   depth + 1)
+        if found:
+            return found
+    return None
+
+
+def fill_missing_info(resource_info):
+    # The keys of an inferred mapping come from the first resource of its
+    # type, later ones may not have them. Whatever is missing is left
+    # blank, so the resource is still listed.
+    for key in ('id', 'name', 'creator'):
+        value = resource_info.get(key)
+        if type(value) is list:
+            value = value[0] if len(value) == 1 else None
+        if value is None:
+            value = ''
+        resource_info[key] = value if type(value) is str else str(value)
+    return resource_info
+
+
+def infer_mapping(resource_type, sample, parse_datetime):
+    # Build a resource mapping, in the same form as resource_mappings.yaml
+    # but without a url, by looking at the keys of one resource.
+    id_key = find_id_key(resource_type, sample)
+    if id_key is None:
+        raise RuntimeError(
+            "Resource type {} has no mapping and no id could be found in "
+            "its resources".format(resource_type)
+        )
+    id_path = quote_key(id_key)
+
+    creation_path = find_creation_path(sample, parse_datetime)
+    if creation_path is None:
+        raise RuntimeError(
+            "Resource type {} has no mapping and no creation time could be "
+            "found in its resources".format(resource_type)
+        )
+
+    mapping = {
+        'info': {
+            'id': id_path,
+            'name': find_name_path(sample, id_path),
+            'creation_datetime': creation_path,
+            'creator': CREATOR_TAG_PATH if has_tags(sample) else EMPTY_PATH
+        },
+        # Other resources of the type may not have the keys the sample did,
+        # see fill_missing_info and lib.resources.get_optional_datetime
+        'inferred': True
+    }
+    logger.warning(
+        "Resource type {} has no mapping, using inferred mapping {}. Add a "
+        "mapping for it to get console links.".format(resource_type,
+                                                      mapping)
+    )
+    return mapping
@@ -1,14 +1,24 @@
 import base64
+import io
 import json
 from operator import itemgetter
 import logging
+import time
 import zlib
 
+import lib.parallel
 import lib.resources
+import lib.suppression
 
 logger = logging.getLogger('c7n_notifiers')
 logger.setLevel(logging.INFO)
 
+# Bounds on the summary of a message given when it can't be processed
+PREVIEW_RESOURCE_IDS = 20
+PREVIEW_CHARACTERS = 2000
+# Resources extracted between checks of the deadline
+DEADLINE_CHECK_INTERVAL = 1000
+
 
 def decode_message(message):
     try:
@@ -27,7 +37,37 @@ def decode_message(message):
     return message_dict
 
 
-def get_message_data(c7n_message):
+def get_sqs_message(record):
+    # Returns the encoded message and its id. SNS wraps the message in a
+    # JSON envelope when it delivers to SQS, unless the subscription has raw
+    # message delivery enabled, in which case the SQS message id is used as
+    # SQS keeps it when the message is received again. An encoded message
+    # is base64 so can never look like JSON.
+    body = record['body']
+    if body.startswith('{'):
+        envelope = json.loads(body)
+        if envelope.get('Type') != 'Notification':
+            raise ValueError(
+                "SQS message {} is a {} from SNS, not a "
+                "Notification".format(record['messageId'],
+                                      envelope.get('Type'))
+            )
+        return envelope['Message'], envelope.get('MessageId')
+    return body, record['messageId']
+
+
+def get_sqs_sent_time(record):
+    # When the message was sent to the queue, as a time.time() timestamp, or
+    # None if SQS didn't say
+    sent_timestamp = record.get('attributes', {}).get('SentTimestamp')
+    if sent_timestamp is None:
+        return None
+    return int(sent_timestamp) / 1000
+
+
+def get_message_data(c7n_message, deadline=None):
+    # Raises DeadlineExceeded if deadline, see lib/deadline.py, passes
+    # before the resources have been extracted
     if c7n_message['account'] != '':
         account_info = "{} ({})".format(
             c7n_message['account_id'],
@@ -38,23 +78,70 @@ def get_message_data(c7n_message):
 
     resource_type = c7n_message['policy']['resource']
     region = c7n_message['region']
-    resources = []
-    for resource_info in c7n_message['resources']:
-        resource_info = lib.resources.get_resource_info(
-            c7n_message['policy']['resource'],
-            resource_info,
-            region
-        )
-        resources.append(resource_info)
+    # Resources matching a suppression are dropped before they're extracted,
+    # so they're never extracted or formatted
+    matcher = lib.suppression.get_matcher(c7n_message)
+    if matcher is not None and matcher.everything:
+        resources = []
+    else:
+        # Very large messages are extracted and sorted over several
+        # processes
+        resources = lib.parallel.extract_resources(resource_type,
+                                                   c7n_message['resources'],
+                                                   region,
+                                                   matcher,
+                                                   deadline)
+    if resources is None:
+        start = time.perf_counter()
+        resources = []
+        get_id = None
+        if matcher is not None and c7n_message['resources']:
+            get_id = lib.resources.get_id_getter(resource_type,
+                                                 c7n_message['resources'][0])
+        for index, resource_data in enumerate(c7n_message['resources']):
+            if (deadline is not None and
+                    index % DEADLINE_CHECK_INTERVAL == 0):
+                deadline.check("extracting {} resources".format(
+                    resource_type
+                ))
+            if (matcher is not None and
+                    matcher.is_suppressed(resource_data, get_id)):
+                continue
+            resources.append(lib.resources.get_resource_info(
+                c7n_message['policy']['resource'],
+                resource_data,
+                region
+            ))
 
-    # Sort resources by CreationDateTime
-    resources.sort(key=itemgetter('creation_datetime'), reverse=True)
+        # Sort resources by CreationDateTime
+        resources.sort(key=itemgetter('creation_datetime'), reverse=True)
+        lib.parallel.record_serial_extraction(len(c7n_message['resources']),
+                                              time.perf_counter() - start)
+    suppressed = len(c7n_message['resources']) - len(resources)
+    if suppressed:
+        logger.info("Suppressed {} of {} resources".format(
+            suppressed, len(c7n_message['resources'])
+        ))
+
+    # Past the overflow threshold only a summary is rendered and the
+    # resources are uploaded as a file instead.
+    overflow_threshold = c7n_message['action'].get('overflow_threshold')
+    overflow = (
+        overflow_threshold is not None and
+        len(resources) > overflow_threshold
+    )
 
     message_data = {
         'message_template': c7n_message['action']['template'],
+        'message_format': c7n_message['action'].get('format', 'attachments'),
+        'overflow': overflow,
+        'overflow_format': c7n_message['action'].get('overflow_format',
+                                                     'csv'),
+        'overflow_gzip': c7n_message['action'].get('overflow_gzip', False),
         'resource_type': resource_type,
         'region': region,
         'resources': resources,
+        'suppressed': suppressed,
         'account_info': account_info,
         'policy': c7n_message['policy']
     }
@@ -62,3 +149,74 @@ def get_message_data(c7n_message):
     logger.debug("message_data: {}".format(message_data))
 
     return message_data
+
+
+def get_resource_ids(resource_type, resources, limit):
+    # The ids of the first resources, found with just the id expression of
+    # their mapping. The message may have failed because of its resources,
+    # so any that can't be read are skipped.
+    try:
+        prepared_mapping = lib.resources.get_prepared_mapping(
+            resource_type, resources[0] if resources else None
+        )
+        expression = dict(prepared_mapping['info'])['id']
+    except Exception:
+        return []
+    resource_ids = []
+    for resource in resources[:limit]:
+        try:
+            resource_ids.append(str(expression.search(resource)))
+        except Exception:
+            pass
+    return resource_ids
+
+
+def get_message_preview(c7n_message, max_resource_ids=PREVIEW_RESOURCE_IDS,
+                        max_characters=PREVIEW_CHARACTERS):
+    # A short summary of a message, in place of the whole message in error
+    # reports. The most useful parts come first and it stops at
+    # max_characters, with no assumptions about what the message contains.
+    if type(c7n_message) is not dict:
+        return truncate_preview(repr(c7n_message), max_characters)
+    policy = c7n_message.get('policy')
+    if type(policy) is not dict:
+        policy = {}
+    resources = c7n_message.get('resources')
+    if type(resources) is not list:
+        resources = []
+    account = c7n_message.get('account_id', '')
+    if c7n_message.get('account'):
+        account = "{} ({})".format(account, c7n_message['account'])
+
+    lines = [
+        ('policy', policy.get('name')),
+        ('resource type', policy.get('resource')),
+        ('account', account),
+        ('region', c7n_message.get('region')),
+        ('resources', len(resources))
+    ]
+    resource_ids = get_resource_ids(policy.get('resource'), resources,
+                                    max_resource_ids)
+    if resource_ids:
+        if len(resources) > len(resource_ids):
+            resource_ids.append("and {} more".format(
+                len(resources) - len(resource_ids)
+            ))
+        lines.append(('resource ids', ", ".join(resource_ids)))
+
+    preview = io.StringIO()
+    for name, value in lines:
+        line = "{}: {}\n".format(name, value)
+        if preview.tell() + len(line) > max_characters:
+            preview.write(truncate_preview(
+                line, max_characters - preview.tell()
+            ))
+            break
+        preview.write(line)
+    return preview.getvalue().rstrip("\n")
+
+
+def truncate_preview(text, length):
+    if len(text) <= length:
+        return text
+    return text[:max(length - 1, 0)] + "…"
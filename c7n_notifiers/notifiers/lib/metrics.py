@@ -0,0 +1,31 @@
+import json
+import logging
+import threading
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Counters live for as long as the process, so they accumulate over warm
+# invocations of the Lambda Function.
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def increment(name, value=1):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get_metrics():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def reset():
+    with _counters_lock:
+        _counters.clear()
+
+
+def log_metrics():
+    logger.info("metrics: {}".format(json.dumps(get_metrics(),
+                                                sort_keys=True)))
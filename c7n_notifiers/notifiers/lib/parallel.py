@@ -0,0 +1,249 @@
+import heapq
+import json
+import logging
+from operator import itemgetter
+import os
+import threading
+import time
+
+import lib.deadline
+import lib.resources
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Number of processes resources are extracted in, one per CPU by default.
+# Lambda Functions get more CPUs the more memory they have.
+EXTRACTION_WORKERS = int(
+    os.environ.get('C7N_NOTIFIERS_EXTRACTION_WORKERS', os.cpu_count() or 1)
+)
+# Messages with fewer resources than this are extracted in this process,
+# until enough extractions have been timed to work out where extracting
+# in parallel starts to pay off, see ExtractionTuner.
+PARALLEL_EXTRACTION_THRESHOLD = int(
+    os.environ.get('C7N_NOTIFIERS_PARALLEL_EXTRACTION_THRESHOLD', 20000)
+)
+# Each worker is given this many chunks so a slow chunk doesn't hold up
+# the rest.
+CHUNKS_PER_WORKER = 2
+# Extractions of fewer resources than this are mostly overhead, so aren't
+# used for tuning.
+MIN_TUNING_RESOURCES = 500
+TUNING_WEIGHT = 0.3
+# Set in Lambda, which has no /dev/shm for multiprocessing, so the pool is
+# only ever used by the server, see server.py
+LAMBDA_FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+creation_datetime = itemgetter('creation_datetime')
+
+
+class ExtractionTuner:
+    # Learns the number of resources above which extracting in parallel is
+    # quicker than extracting in this process. Serial extractions give the
+    # cost of each resource, parallel ones the fixed cost of splitting
+    # the resources, sending them to the workers and merging the results.
+    # Both are moving averages so the crossover follows the function's
+    # memory size and the resource types it sees.
+    def __init__(self, workers, threshold=PARALLEL_EXTRACTION_THRESHOLD,
+                 weight=TUNING_WEIGHT):
+        self.workers = workers
+        self.default_threshold = threshold
+        self.weight = weight
+        self.resource_seconds = None
+        self.overhead_seconds = None
+        self.lock = threading.Lock()
+
+    def average(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.weight * (sample - current)
+
+    def record_serial(self, count, seconds):
+        if count < MIN_TUNING_RESOURCES:
+            return
+        with self.lock:
+            self.resource_seconds = self.average(self.resource_seconds,
+                                                 seconds / count)
+
+    def record_parallel(self, count, seconds):
+        if count < MIN_TUNING_RESOURCES or self.resource_seconds is None:
+            return
+        # What's left once the work itself is shared between the workers
+        overhead = max(
+            0.0, seconds - count * self.resource_seconds / self.workers
+        )
+        with self.lock:
+            self.overhead_seconds = self.average(self.overhead_seconds,
+                                                 overhead)
+
+    def get_threshold(self):
+        if self.workers < 2:
+            return None
+        with self.lock:
+            if self.resource_seconds is None or self.overhead_seconds is None:
+                return self.default_threshold
+            # Parallel extraction wins once the time saved by sharing the
+            # resources between the workers is more than its overhead
+            saved = self.resource_seconds * (1 - 1 / self.workers)
+            return max(MIN_TUNING_RESOURCES,
+                       int(self.overhead_seconds / saved))
+
+    def should_parallelize(self, count):
+        threshold = self.get_threshold()
+        return threshold is not None and count >= threshold
+
+
+def split_resources(resources, chunk_count):
+    # Serialises the resources into chunk_count JSON arrays of about the
+    # same size, so only bytes are pickled for the workers rather than
+    # every dict in the message. The message has already been decoded by
+    # then, so this is only worth it with a pool to send them to.
+    chunk_size = -(-len(resources) // chunk_count)
+    encoder = json.JSONEncoder(separators=(',', ':')).encode
+    return [
+        encoder(resources[start:start + chunk_size]).encode('utf8')
+        for start in range(0, len(resources), chunk_size)
+    ]
+
+
+# Prepared mappings in a worker, keyed on the resource type and the JSON
+# of its mapping, so they're only prepared once per process
+_worker_mappings = {}
+
+
+def extract_chunk(resource_type, resource_mapping, region, chunk,
+                  matcher=None):
+    # Runs in the workers. Returns the chunk's resource info, less any that
+    # are suppressed by matcher, sorted newest first ready to be merged with
+    # the other chunks.
+    key = (resource_type, json.dumps(resource_mapping, sort_keys=True))
+    prepared_mapping = _worker_mappings.get(key)
+    if prepared_mapping is None:
+        prepared_mapping = lib.resources.prepare_mapping(resource_mapping)
+        _worker_mappings[key] = prepared_mapping
+    extract = prepared_mapping['extract']
+    get_id = prepared_mapping['get_id']
+    resources = []
+    for resource_data in json.loads(chunk.decode('utf8')):
+        if (matcher is None or
+                not matcher.is_suppressed(resource_data, get_id)):
+            resources.append(extract(resource_data, region))
+    resources.sort(key=creation_datetime, reverse=True)
+    return resources
+
+
+def merge_chunks(chunks):
+    # k-way merge of the sorted chunks. heapq.merge keeps resources with the
+    # same creation time in chunk order, so the result is the same as
+    # sorting every resource at once.
+    return list(heapq.merge(*chunks, key=creation_datetime, reverse=True))
+
+
+class ExtractionPool:
+    # Worker processes kept for as long as this process, so only the first
+    # large message pays for starting them. Lambda has no /dev/shm, which
+    # multiprocessing needs, so there the pool is never available and
+    # resources are always extracted in this process without being split.
+    def __init__(self, workers=EXTRACTION_WORKERS,
+                 lambda_function_name=LAMBDA_FUNCTION_NAME):
+        self.workers = workers
+        self.tuner = ExtractionTuner(workers)
+        self.executor = None
+        self.unavailable = workers < 2 or bool(lambda_function_name)
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None and not self.unavailable:
+                import concurrent.futures
+                try:
+                    self.executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers
+                    )
+                except (OSError, ImportError, NotImplementedError):
+                    logger.warning(
+                        "Unable to start extraction processes, extracting "
+                        "resources in a single process",
+                        exc_info=True
+                    )
+                    self.unavailable = True
+            return self.executor
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def extract(self, resource_type, resources, region, matcher=None,
+                deadline=None):
+        # Returns the resource info sorted newest first, or None if the
+        # resources should be extracted in this process instead. Raises
+        # DeadlineExceeded if the deadline passes first. Nothing is split
+        # until there's a pool to extract them.
+        if self.unavailable:
+            return None
+        if not self.tuner.should_parallelize(len(resources)):
+            return None
+        executor = self.get_executor()
+        if executor is None:
+            return None
+
+        import concurrent.futures
+        from concurrent.futures.process import BrokenProcessPool
+        start = time.perf_counter()
+        # Inferred mappings are inferred here so every worker uses the same
+        # one
+        resource_mapping = lib.resources.get_mapping(resource_type,
+                                                     resources[0])
+        chunks = split_resources(resources,
+                                 self.workers * CHUNKS_PER_WORKER)
+        try:
+            futures = [
+                executor.submit(extract_chunk, resource_type,
+                                resource_mapping, region, chunk, matcher)
+                for chunk in chunks
+            ]
+            extracted = merge_chunks([
+                future.result(
+                    None if deadline is None else deadline.remaining()
+                )
+                for future in futures
+            ])
+        except concurrent.futures.TimeoutError:
+            for future in futures:
+                future.cancel()
+            raise lib.deadline.DeadlineExceeded(
+                "Ran out of time extracting {} {} resources".format(
+                    len(resources), resource_type
+                )
+            )
+        except BrokenProcessPool:
+            logger.exception(
+                "Extraction processes stopped, extracting resources in a "
+                "single process"
+            )
+            self.shutdown()
+            return None
+        seconds = time.perf_counter() - start
+
+        self.tuner.record_parallel(len(resources), seconds)
+        logger.debug(
+            "Extracted {} resources in {} chunks in {:.3f}s".format(
+                len(resources), len(chunks), seconds
+            )
+        )
+        return extracted
+
+
+_extraction_pool = ExtractionPool()
+
+
+def extract_resources(resource_type, resources, region, matcher=None,
+                      deadline=None):
+    return _extraction_pool.extract(resource_type, resources, region,
+                                    matcher, deadline)
+
+
+def record_serial_extraction(count, seconds):
+    _extraction_pool.tuner.record_serial(count, seconds)
@@ -0,0 +1,87 @@
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+
+class RateLimiter:
+    # Token bucket allowing `rate` calls per second with bursts of up to
+    # `burst` calls. Callers that arrive when the bucket is empty reserve
+    # the next token and sleep until it is due, so the limiter can be
+    # shared between threads.
+    def __init__(self, rate, burst=1, clock=time.monotonic,
+                 sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive, but is {}".format(rate))
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Take a token and return how many seconds the caller must wait
+        # before using it.
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def get_delay(self):
+        # How many seconds until a token is available, without taking it
+        with self.lock:
+            tokens = min(
+                self.burst,
+                self.tokens + (self.clock() - self.updated) * self.rate
+            )
+            if tokens >= 1:
+                return 0
+            return (1 - tokens) / self.rate
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            logger.debug("Rate limited, waiting {:.3f}s".format(delay))
+            self.sleep(delay)
+
+
+# The rate limiter of the destination each thread is delivering to, see
+# lib/delivery.py. Messages posted after the first of a delivery wait on
+# it, so they're kept to the same rate as the deliveries either side.
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def limit(rate_limiter):
+    # Makes rate_limiter the current thread's rate limiter
+    previous = get_current()
+    _current.rate_limiter = rate_limiter
+    try:
+        yield rate_limiter
+    finally:
+        _current.rate_limiter = previous
+
+
+def get_current():
+    return getattr(_current, 'rate_limiter', None)
+
+
+def sleep(seconds):
+    # Sleeps on the clock of the current thread's rate limiter, which is
+    # the scheduler's, or in real time without one
+    rate_limiter = get_current()
+    if rate_limiter is None:
+        time.sleep(seconds)
+    else:
+        rate_limiter.sleep(seconds)
@@ -1,24 +1,376 @@
 from datetime import datetime
+import functools
+import hashlib
+import json
 import logging
 import os
 import string
+import threading
+import time
 
-import jmespath
-import yaml
+import lib.extractors
+import lib.formatting
+import lib.inference
+import lib.snapshot
 
 logger = logging.getLogger('c7n_notifiers')
 logger.setLevel(logging.INFO)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 MAPPINGS_FILE_PATH = current_dir + "/resource_mappings.yaml"
+# resource_mappings.yaml compiled to JSON by build_mappings, see
+# lib/build.py
+COMPILED_MAPPINGS_FILE_PATH = current_dir + "/resource_mappings.json"
+# Files and/or directories of extra mappings (YAML or JSON), separated by
+# os.pathsep, merged over the shipped mappings. Later sources take
+# precedence over earlier ones, as do later files in a directory.
+MAPPINGS_PATH_ENVIRONMENT_VARIABLE = 'C7N_NOTIFIERS_MAPPINGS_PATH'
+# Its former name, when it took a single file, still read so functions
+# that set it keep their mappings
+FORMER_MAPPINGS_ENVIRONMENT_VARIABLE = 'C7N_NOTIFIERS_MAPPINGS_FILE'
+MAPPINGS_FILE_EXTENSIONS = ('.yaml', '.yml', '.json')
+# How often, in seconds, extra mappings are checked for changes
+MAPPINGS_CHECK_INTERVAL = float(
+    os.environ.get('C7N_NOTIFIERS_MAPPINGS_CHECK_INTERVAL', 10)
+)
 
+REQUIRED_INFO_KEYS = {'id', 'name', 'creation_datetime', 'creator'}
 
-def get_mappings(file_path=MAPPINGS_FILE_PATH):
+
+def validate_mappings(mappings, source):
+    # Check the mappings have everything extraction and formatting rely on,
+    # so a broken mappings file fails when it is loaded rather than part
+    # way through a message.
+    def invalid(message):
+        return ValueError("Invalid resource mappings in {}: {}".format(
+            source, message
+        ))
+
+    if type(mappings) is not dict:
+        raise invalid("must be a mapping of resource type to mapping")
+    for resource_type, resource_mapping in mappings.items():
+        if type(resource_mapping) is not dict:
+            raise invalid("{} must be a mapping".format(resource_type))
+        unknown_keys = set(resource_mapping) - {'info', 'url'}
+        if unknown_keys:
+            raise invalid("{} has unknown keys {}".format(
+                resource_type, sorted(unknown_keys)
+            ))
+
+        info = resource_mapping.get('info')
+        if type(info) is not dict:
+            raise invalid("{} info must be a mapping".format(resource_type))
+        missing_keys = REQUIRED_INFO_KEYS - set(info)
+        if missing_keys:
+            raise invalid("{} info is missing {}".format(
+                resource_type, sorted(missing_keys)
+            ))
+        for key, path in info.items():
+            if type(path) is not str:
+                raise invalid("{} info {} must be a JMESPath string".format(
+                    resource_type, key
+                ))
+
+        url = resource_mapping.get('url')
+        if url is None:
+            continue
+        if type(url) is not str:
+            raise invalid("{} url must be a string".format(resource_type))
+        available = set(info) | {'region'}
+        for match in string.Template.pattern.finditer(url):
+            name = match.group('named') or match.group('braced')
+            if match.group('invalid') is not None:
+                raise invalid("{} url has an invalid placeholder".format(
+                    resource_type
+                ))
+            if name and name not in available:
+                raise invalid("{} url uses unknown placeholder {}".format(
+                    resource_type, name
+                ))
+
+
+def get_file_checksum(file_path):
+    with open(file_path, 'rb') as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+
+def build_mappings(file_path=MAPPINGS_FILE_PATH,
+                   compiled_path=COMPILED_MAPPINGS_FILE_PATH):
+    # Validate the YAML mappings once at build time and write them as JSON,
+    # which the standard library loads much faster than the pure Python
+    # PyYAML shipped in the deploy package.
+    mappings = parse_mappings_file(file_path)
+    with open(compiled_path, 'w') as compiled_file:
+        json.dump({
+            'source_sha256': get_file_checksum(file_path),
+            'mappings': mappings
+        }, compiled_file, sort_keys=True)
+    logger.info("Compiled {} resource mappings into {}".format(
+        len(mappings), compiled_path
+    ))
+
+
+def parse_mappings_file(file_path):
+    # Custom mappings can be YAML or JSON. YAML is only ever loaded with the
+    # safe loader, and PyYAML is imported when first needed as it is slow
+    # to import.
     with open(file_path) as mapping_file:
-        mappings = yaml.load(mapping_file.read())
+        if file_path.endswith('.json'):
+            mappings = json.load(mapping_file)
+        else:
+            import yaml
+            mappings = yaml.safe_load(mapping_file.read())
+    validate_mappings(mappings, file_path)
     return mappings
 
 
+def load_compiled_mappings(file_path=MAPPINGS_FILE_PATH,
+                           compiled_path=COMPILED_MAPPINGS_FILE_PATH):
+    # Returns the compiled mappings, or None if they haven't been built or
+    # the YAML has changed since they were.
+    try:
+        with open(compiled_path) as compiled_file:
+            compiled = json.load(compiled_file)
+    except FileNotFoundError:
+        return None
+    if compiled.get('source_sha256') != get_file_checksum(file_path):
+        logger.warning(
+            "Compiled resource mappings {} are stale, ignoring them".format(
+                compiled_path
+            )
+        )
+        return None
+    return compiled['mappings']
+
+
+def get_mappings(file_path=MAPPINGS_FILE_PATH):
+    # The shipped mappings are loaded from their compiled JSON, only parsing
+    # the YAML if that hasn't been built.
+    if file_path == MAPPINGS_FILE_PATH:
+        mappings = load_compiled_mappings()
+        if mappings is not None:
+            return mappings
+    return parse_mappings_file(file_path)
+
+
+def get_shipped_mappings():
+    mappings = lib.snapshot.get_section('mappings')
+    if mappings is None:
+        mappings = get_mappings()
+    return mappings
+
+
+def get_mappings_paths():
+    paths = os.environ.get(MAPPINGS_PATH_ENVIRONMENT_VARIABLE)
+    if paths is None and FORMER_MAPPINGS_ENVIRONMENT_VARIABLE in os.environ:
+        logger.warning("{} is deprecated, set {} instead".format(
+            FORMER_MAPPINGS_ENVIRONMENT_VARIABLE,
+            MAPPINGS_PATH_ENVIRONMENT_VARIABLE
+        ))
+        paths = os.environ[FORMER_MAPPINGS_ENVIRONMENT_VARIABLE]
+    return [path for path in (paths or '').split(os.pathsep) if path]
+
+
+class MappingsCache:
+    # The shipped mappings merged with any extra mappings, along with each
+    # resource type prepared for extraction. Extra mapping files are checked
+    # at most every check_interval seconds, and only re-parsed when their
+    # mtime or size has changed and so has their checksum, so long running
+    # processes pick up changes without re-parsing for every message.
+    def __init__(self, paths, check_interval=MAPPINGS_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.paths = paths
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.shipped_mappings = None
+        # path -> (mtime_ns, size, checksum, mappings)
+        self.sources = {}
+        # Paths whose last good mappings are used as they can't be read
+        self.missing = set()
+        self.mappings = None
+        self.prepared_mappings = {}
+        # Mappings inferred for resource types that aren't mapped, these
+        # are kept across refreshes
+        self.inferred_mappings = {}
+        self.checked = None
+
+    def get_source_files(self):
+        files = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if name.endswith(MAPPINGS_FILE_EXTENSIONS):
+                        files.append(os.path.join(path, name))
+            else:
+                files.append(path)
+        return files
+
+    def refresh_source(self, path):
+        # Returns True if the mappings in the file have changed
+        known = self.sources.get(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Keep serving the last good mappings from a file that has gone,
+            # e.g. while it's being replaced, there are none to keep on the
+            # first load
+            if not known:
+                raise
+            if path not in self.missing:
+                logger.warning(
+                    "Unable to read resource mappings from {}, using the "
+                    "previous mappings".format(path)
+                )
+                self.missing.add(path)
+            return False
+        self.missing.discard(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return False
+        checksum = get_file_checksum(path)
+        if known and known[2] == checksum:
+            self.sources[path] = (stat.st_mtime_ns, stat.st_size) + known[2:]
+            return False
+        try:
+            mappings = parse_mappings_file(path)
+        except Exception:
+            # Keep serving the last good mappings from a file that has been
+            # broken by an edit, there are none to keep on the first load
+            if not known:
+                raise
+            logger.exception(
+                "Unable to reload resource mappings from {}, using the "
+                "previous mappings".format(path)
+            )
+            # Don't try again until the file changes
+            self.sources[path] = (stat.st_mtime_ns, stat.st_size, checksum,
+                                  known[3])
+            return False
+        self.sources[path] = (stat.st_mtime_ns, stat.st_size, checksum,
+                              mappings)
+        return True
+
+    def refresh(self):
+        with self.lock:
+            now = self.clock()
+            if (self.mappings is not None and
+                    now - self.checked < self.check_interval):
+                return
+            self.checked = now
+
+            if self.shipped_mappings is None:
+                self.shipped_mappings = get_shipped_mappings()
+            changed = self.mappings is None
+            files = self.get_source_files()
+            for path in set(self.sources) - set(files):
+                del self.sources[path]
+                changed = True
+            for path in files:
+                if self.refresh_source(path):
+                    changed = True
+            if not changed:
+                return
+
+            mappings = dict(self.shipped_mappings)
+            for path in files:
+                mappings.update(self.sources[path][3])
+            self.mappings = mappings
+            self.prepared_mappings = {}
+            logger.info(
+                "Loaded mappings for {} resource types from {} extra "
+                "files".format(len(mappings), len(files))
+            )
+
+    def get_mappings(self):
+        self.refresh()
+        return self.mappings
+
+    def get_prepared_mapping(self, resource_type, resource_data=None):
+        # Resource types without a mapping have one inferred from the first
+        # of their resources seen, given as resource_data.
+        self.refresh()
+        prepared_mappings = self.prepared_mappings
+        try:
+            return prepared_mappings[resource_type]
+        except KeyError:
+            pass
+        prepared_mapping = prepare_mapping(
+            self.get_mapping(resource_type, resource_data)
+        )
+        prepared_mappings[resource_type] = prepared_mapping
+        return prepared_mapping
+
+    def get_mapping(self, resource_type, resource_data=None):
+        self.refresh()
+        if resource_type in self.mappings or resource_data is None:
+            return self.mappings[resource_type]
+        return self.get_inferred_mapping(resource_type, resource_data)
+
+    def get_inferred_mapping(self, resource_type, resource_data):
+        with self.lock:
+            if resource_type not in self.inferred_mappings:
+                self.inferred_mappings[resource_type] = (
+                    lib.inference.infer_mapping(resource_type,
+                                                resource_data,
+                                                get_datetime)
+                )
+            return self.inferred_mappings[resource_type]
+
+
+def compile_expression(path):
+    import jmespath
+    expressions = lib.snapshot.get_section('expressions') or {}
+    if path in expressions:
+        return jmespath.parser.ParsedResult(path, expressions[path])
+    return jmespath.compile(path)
+
+
+def prepare_mapping(resource_mapping, generate_extractor=True):
+    # Mappings prepared once per process also get an extractor generated
+    # from their expressions, which is much quicker than searching each
+    # expression with JMESPath for every resource.
+    url_template = None
+    if resource_mapping.get('url'):
+        url_template = string.Template(resource_mapping['url'])
+    prepared_mapping = {
+        'info': [
+            (key, compile_expression(path))
+            for key, path in resource_mapping['info'].items()
+        ],
+        'url': url_template,
+        'inferred': bool(resource_mapping.get('inferred')),
+        'get_datetime': (
+            get_optional_datetime if resource_mapping.get('inferred')
+            else get_datetime
+        )
+    }
+    # Just the resource's id, for suppressions to match on before the rest
+    # is extracted
+    prepared_mapping['get_id'] = dict(prepared_mapping['info'])['id'].search
+    if generate_extractor:
+        prepared_mapping['extract'] = lib.extractors.compile_extractor(
+            prepared_mapping,
+            functools.partial(extract_resource_info, prepared_mapping),
+            prepared_mapping['get_datetime']
+        )
+    return prepared_mapping
+
+
+_mappings_cache = MappingsCache(get_mappings_paths())
+
+
+def get_all_mappings():
+    return _mappings_cache.get_mappings()
+
+
+def get_prepared_mapping(resource_type, resource_data=None):
+    return _mappings_cache.get_prepared_mapping(resource_type, resource_data)
+
+
+def get_mapping(resource_type, resource_data=None):
+    return _mappings_cache.get_mapping(resource_type, resource_data)
+
+
 def get_datetime(datetime_string):
     dt_obj = None
     datetime_patterns = [
@@ -45,26 +397,58 @@ def get_datetime(datetime_string):
     return dt_obj
 
 
+def get_optional_datetime(value):
+    # Inferred mappings only know where the first resource of their type
+    # kept its creation time. Resources without one there sort last rather
+    # than failing the whole message.
+    try:
+        return get_datetime(value)
+    except (RuntimeError, TypeError):
+        return lib.formatting.UNKNOWN_DATETIME
+
+
+def get_id_getter(resource_type, resource_data=None):
+    return get_prepared_mapping(resource_type, resource_data)['get_id']
+
+
 def get_resource_info(resource_type, resource_data, region,
                       resource_mappings=None):
-    # Generally the resource mapping is loaded when the Lambda starts and
-    # passed when calling the function. This minimizes the times the file
-    # needs to be loaded.
-    if not resource_mappings:
-        all_resource_mappings = get_mappings()
-        resource_mappings = all_resource_mappings[resource_type]
+    # Generally the resource mapping is prepared once per process, when
+    # the first resource of its type is seen, and the resource info comes
+    # from its generated extractor. A mapping can also be passed in, which
+    # is prepared and interpreted for this call only.
+    if resource_mappings:
+        resource_info = extract_resource_info(
+            prepare_mapping(resource_mappings, generate_extractor=False),
+            resource_data,
+            region
+        )
+    else:
+        prepared_mapping = get_prepared_mapping(resource_type, resource_data)
+        resource_info = prepared_mapping['extract'](resource_data, region)
 
+    logger.debug("resource_info: {}".format(resource_info))
+
+    return resource_info
+
+
+def extract_resource_info(prepared_mapping, resource_data, region):
+    # Searches each of the mapping's JMESPath expressions. Generated
+    # extractors, see lib/extractors.py, must return the same.
     resource_info = {
         'region': region
     }
     # Build initial resource_info dict
-    for key, path in resource_mappings['info'].items():
-        resource_info[key] = jmespath.search(path, resource_data)
+    for key, expression in prepared_mapping['info']:
+        resource_info[key] = expression.search(resource_data)
 
     for key, value in resource_info.items():
         if key == 'creation_datetime':
-            resource_info['creation_datetime'] = get_datetime(value)
-        elif key == 'creator' and type(value) is list:
+            resource_info['creation_datetime'] = (
+                prepared_mapping['get_datetime'](value)
+            )
+        elif (key == 'creator' and type(value) is list and
+                not prepared_mapping['inferred']):
             resource_info['creator'] = value[0]
         # If Name is a tag and is not set then JMESpath returns an empty list
         # in this case set the Name to empty, otherwise get the only item from
@@ -75,11 +459,11 @@ def get_resource_info(resource_type, resource_data, region,
             elif len(resource_info['name']) == 1:
                 resource_info['name'] = value[0]
 
-    if resource_mappings.get('url'):
-        resource_info['url'] = string.Template(
-            resource_mappings['url']
-        ).substitute(resource_info)
-
-    logger.debug("resource_info: {}".format(resource_info))
+    if prepared_mapping['inferred']:
+        lib.inference.fill_missing_info(resource_info)
+    if prepared_mapping['url']:
+        resource_info['url'] = prepared_mapping['url'].substitute(
+            resource_info
+        )
 
     return resource_info
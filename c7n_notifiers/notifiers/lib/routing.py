@@ -0,0 +1,220 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import lib.resources
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# A YAML or JSON file of routes sending messages to destinations other than
+# the one in the policy, see the README
+ROUTES_PATH = os.environ.get('C7N_NOTIFIERS_ROUTES_PATH', '')
+# How often, in seconds, the routes file is checked for changes
+ROUTES_CHECK_INTERVAL = float(
+    os.environ.get('C7N_NOTIFIERS_ROUTES_CHECK_INTERVAL', 10)
+)
+
+# What routes can match on, in the order they're looked up
+MATCH_KEYS = ('account_id', 'region', 'resource_type', 'policy', 'severity')
+ROUTE_KEYS = set(MATCH_KEYS) | {'to', 'template'}
+WILDCARD = '*'
+
+
+def validate_routes(config, source):
+    def invalid(message):
+        return ValueError("Invalid routes in {}: {}".format(source, message))
+
+    if type(config) is not dict or type(config.get('routes')) is not list:
+        raise invalid("must be a mapping with a list of routes")
+    for number, route in enumerate(config['routes'], 1):
+        if type(route) is not dict:
+            raise invalid("route {} must be a mapping".format(number))
+        unknown_keys = set(route) - ROUTE_KEYS
+        if unknown_keys:
+            raise invalid("route {} has unknown keys {}".format(
+                number, sorted(unknown_keys)
+            ))
+        to = route.get('to')
+        if (type(to) is not list or not to or
+                any(type(destination) is not str for destination in to)):
+            raise invalid("route {} to must be a list of destinations".format(
+                number
+            ))
+        if 'template' in route and type(route['template']) is not str:
+            raise invalid("route {} template must be a string".format(
+                number
+            ))
+        for key in MATCH_KEYS:
+            values = route.get(key, WILDCARD)
+            if type(values) is not list:
+                values = [values]
+            if not values or any(type(value) not in (str, int)
+                                 for value in values):
+                raise invalid(
+                    "route {} {} must be a value or list of values".format(
+                        number, key
+                    )
+                )
+
+
+def parse_routes_file(file_path):
+    with open(file_path) as routes_file:
+        if file_path.endswith('.json'):
+            config = json.load(routes_file)
+        else:
+            import yaml
+            config = yaml.safe_load(routes_file.read())
+    validate_routes(config, file_path)
+    return config['routes']
+
+
+def get_match_values(route, key):
+    # The values a route matches for a key, or None if it matches any.
+    # Account ids written without quotes in YAML are loaded as numbers.
+    values = route.get(key, WILDCARD)
+    if type(values) is not list:
+        values = [values]
+    if WILDCARD in values:
+        return None
+    return [str(value) for value in values]
+
+
+class RoutingTable:
+    # Routes are indexed by the keys they match on, so a message is matched
+    # with a dict lookup for each combination of keys used by a route,
+    # rather than by checking every route. Keys a route doesn't match on,
+    # or matches with *, match anything.
+    def __init__(self, routes):
+        self.routes = routes
+        # keys -> {values of those keys -> indexes of routes}
+        self.indexes = {}
+        for route_index, route in enumerate(routes):
+            keys = []
+            key_values = []
+            for key in MATCH_KEYS:
+                values = get_match_values(route, key)
+                if values is not None:
+                    keys.append(key)
+                    key_values.append(values)
+            index = self.indexes.setdefault(tuple(keys), {})
+            for values in itertools.product(*key_values):
+                index.setdefault(values, []).append(route_index)
+
+    def match(self, attributes):
+        # Every route matching the message's attributes, in file order
+        route_indexes = set()
+        for keys, index in self.indexes.items():
+            matched = index.get(tuple(attributes[key] for key in keys))
+            if matched:
+                route_indexes.update(matched)
+        return [self.routes[i] for i in sorted(route_indexes)]
+
+    def get_destinations(self, attributes, default_template):
+        # (destination, template) for every destination of the matching
+        # routes, once each. Routes without a template use the default.
+        destinations = []
+        for route in self.match(attributes):
+            template = route.get('template', default_template)
+            for destination in route['to']:
+                route_destination = (destination, template)
+                if route_destination not in destinations:
+                    destinations.append(route_destination)
+        return destinations
+
+
+class RoutesCache:
+    # The routing table compiled from the routes file, only recompiled when
+    # the file has changed. It is checked at most every check_interval
+    # seconds, as with MappingsCache in lib/resources.py.
+    def __init__(self, path, check_interval=ROUTES_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.table = None
+        # (mtime_ns, size, checksum) of the file the table was compiled from
+        self.source = None
+        # Whether the previous routes are used as the file can't be read
+        self.missing = False
+        self.checked = None
+
+    def refresh(self):
+        with self.lock:
+            now = self.clock()
+            if (self.table is not None and
+                    now - self.checked < self.check_interval):
+                return
+            self.checked = now
+
+            try:
+                stat = os.stat(self.path)
+                if self.source and self.source[:2] == (stat.st_mtime_ns,
+                                                       stat.st_size):
+                    self.missing = False
+                    return
+                checksum = lib.resources.get_file_checksum(self.path)
+            except OSError:
+                # Keep the previous routes while the file is missing, e.g.
+                # while it's being replaced
+                if self.table is None:
+                    raise
+                if not self.missing:
+                    logger.warning(
+                        "Unable to read routes from {}, using the previous "
+                        "routes".format(self.path)
+                    )
+                    self.missing = True
+                return
+            self.missing = False
+            if self.source and self.source[2] == checksum:
+                self.source = (stat.st_mtime_ns, stat.st_size, checksum)
+                return
+            try:
+                table = RoutingTable(parse_routes_file(self.path))
+            except Exception:
+                if self.table is None:
+                    raise
+                logger.exception(
+                    "Unable to reload routes from {}, using the previous "
+                    "routes".format(self.path)
+                )
+                self.source = (stat.st_mtime_ns, stat.st_size, checksum)
+                return
+            self.table = table
+            self.source = (stat.st_mtime_ns, stat.st_size, checksum)
+            logger.info("Loaded {} routes from {}".format(
+                len(table.routes), self.path
+            ))
+
+    def get_table(self):
+        self.refresh()
+        return self.table
+
+
+_routes_cache = RoutesCache(ROUTES_PATH) if ROUTES_PATH else None
+
+
+def get_message_attributes(c7n_message, severity):
+    return {
+        'account_id': str(c7n_message['account_id']),
+        'region': c7n_message['region'],
+        'resource_type': c7n_message['policy']['resource'],
+        'policy': c7n_message['policy']['name'],
+        'severity': severity
+    }
+
+
+def get_destinations(c7n_message, severity):
+    # The routed (destination, template) pairs for the message, empty when
+    # there are no routes or none of them match
+    if _routes_cache is None:
+        return []
+    return _routes_cache.get_table().get_destinations(
+        get_message_attributes(c7n_message, severity),
+        c7n_message['action']['template']
+    )
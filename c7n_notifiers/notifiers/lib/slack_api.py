@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+
+import lib.circuit
+import lib.deadline
+import lib.ratelimit
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# The base url can be pointed at a local stand-in, see
+# devtools/slack_standin.py
+API_URL = os.environ.get('SLACK_API_URL', 'https://slack.com/api/')
+TOKEN_ENVIRONMENT_VARIABLE = 'SLACK_API_TOKEN'
+# Destinations starting with this are sent through the Web API rather than
+# a webhook, e.g. slack://#cloud-custodian or slack://C0123456789
+DESTINATION_PREFIX = 'slack://'
+# chat.postMessage allows roughly one message per second per channel
+POST_MESSAGE_RATE = 1.0
+MAX_RETRIES = 3
+
+
+def is_api_destination(destination):
+    return destination.startswith(DESTINATION_PREFIX)
+
+
+def get_channel(destination):
+    return destination[len(DESTINATION_PREFIX):]
+
+
+def get_token(token=None):
+    if token:
+        return token
+    try:
+        return os.environ[TOKEN_ENVIRONMENT_VARIABLE]
+    except KeyError:
+        raise RuntimeError(
+            "{} must be set to send messages through the slack "
+            "Web API".format(TOKEN_ENVIRONMENT_VARIABLE)
+        )
+
+
+def call_api(method, payload, token=None):
+    post_data = json.dumps(payload).encode('utf8')
+    req = urllib.request.Request(
+        API_URL + method,
+        headers={
+            'content-type': 'application/json; charset=utf-8',
+            'authorization': 'Bearer {}'.format(get_token(token))
+        },
+        data=post_data
+    )
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = lib.circuit.urlopen(req)
+            break
+        except urllib.error.HTTPError as e:
+            # Slack asks for calls to back off with a 429 and a Retry-After
+            # header when a rate limit is exceeded
+            if e.code != 429 or attempt == MAX_RETRIES:
+                raise
+            retry_after = int(e.headers.get('Retry-After', 1))
+            deadline = lib.deadline.get_current()
+            if deadline is not None and retry_after >= deadline.remaining():
+                raise lib.deadline.DeadlineExceeded(
+                    "Ran out of time waiting to retry Slack API {} "
+                    "call".format(method)
+                ) from e
+            logger.warning(
+                "Slack API {} call rate limited, retrying in {}s".format(
+                    method, retry_after
+                )
+            )
+            lib.ratelimit.sleep(retry_after)
+
+    result = json.loads(response.read().decode('utf8'))
+    logger.debug("Slack API {} response: {}".format(method, result))
+    if not result.get('ok'):
+        raise RuntimeError(
+            "Slack API {} call failed: {}".format(method,
+                                                  result.get('error'))
+        )
+    return result
+
+
+def post_message(channel, message_body, thread_ts=None, token=None):
+    payload = dict(message_body, channel=channel)
+    if thread_ts:
+        payload['thread_ts'] = thread_ts
+    logger.debug(
+        "Posting message to slack channel {}: {}".format(channel, payload)
+    )
+    return call_api('chat.postMessage', payload, token=token)
@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import marshal
+import os
+import sys
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(current_dir)
+# Everything the notifier prepares at cold start, written by build_snapshot
+# when the deploy package is built, see lib/build.py
+SNAPSHOT_PATH = os.path.join(PACKAGE_DIR, "warm_state.snapshot")
+SNAPSHOT_MAGIC = b'C7NWS'
+# Bump whenever the layout of the snapshot changes
+SNAPSHOT_VERSION = 2
+# Set in Lambda, where the deploy package can't change after it's built
+LAMBDA_FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+
+def get_source_paths():
+    import lib.resources
+    import lib.templates
+    paths = [lib.resources.MAPPINGS_FILE_PATH]
+    for name in sorted(os.listdir(lib.templates.TEMPLATES_PATH)):
+        if not name.startswith('.'):
+            paths.append(os.path.join(lib.templates.TEMPLATES_PATH, name))
+    return paths
+
+
+def get_source_stats(paths):
+    # The size and modification time of each source, which are checked
+    # without reading them. Keyed by path relative to the package so the
+    # snapshot can be built in one directory and used from another.
+    stats = {}
+    for path in paths:
+        stat = os.stat(path)
+        stats[os.path.relpath(path, PACKAGE_DIR)] = [stat.st_size,
+                                                     stat.st_mtime_ns]
+    return stats
+
+
+def build_snapshot(snapshot_path=SNAPSHOT_PATH):
+    # Parse the resource mappings (which include their url templates),
+    # compile their JMESPath expressions to ASTs and compile the templates,
+    # then write the lot to a single file.
+    import jmespath
+    import lib.resources
+    import lib.templates
+
+    mappings = lib.resources.get_mappings()
+    expressions = {}
+    for resource_mapping in mappings.values():
+        for path in resource_mapping['info'].values():
+            expressions[path] = jmespath.compile(path).parsed
+
+    payload = marshal.dumps({
+        'version': SNAPSHOT_VERSION,
+        'cache_tag': sys.implementation.cache_tag,
+        'sources': get_source_stats(get_source_paths()),
+        'mappings': mappings,
+        'expressions': expressions,
+        # Stored as the bundle's own bytes so a bundle with code this
+        # Python can't unmarshal doesn't stop the rest loading
+        'templates': lib.templates.get_bundle_data()
+    })
+    checksum = hashlib.sha256(payload).hexdigest().encode('ascii')
+    with open(snapshot_path, 'wb') as snapshot_file:
+        snapshot_file.write(
+            SNAPSHOT_MAGIC + b'\n' + checksum + b'\n' + payload
+        )
+
+    logger.info(
+        "Wrote warm state snapshot of {} resource types and {} expressions "
+        "to {}".format(len(mappings), len(expressions), snapshot_path)
+    )
+
+
+def is_current(snapshot):
+    # The deploy package is trusted to be as it was built, as long as it
+    # was built with the runtime's Python, whose marshal format and
+    # compiled templates it holds. Elsewhere, e.g. when a template is
+    # edited after a local build, the sources are checked for changes.
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return False
+    if snapshot.get('cache_tag') != sys.implementation.cache_tag:
+        return False
+    if LAMBDA_FUNCTION_NAME:
+        return True
+    sources = snapshot['sources']
+    paths = [os.path.join(PACKAGE_DIR, path) for path in sources]
+    try:
+        return get_source_stats(paths) == sources
+    except OSError:
+        return False
+
+
+def read_snapshot(snapshot_path=SNAPSHOT_PATH):
+    # Returns the snapshot, or None when there isn't a usable one, in which
+    # case everything is prepared from the source files instead.
+    try:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        magic, checksum, payload = data.split(b'\n', 2)
+    except ValueError:
+        magic = None
+    if magic != SNAPSHOT_MAGIC:
+        logger.warning(
+            "{} is not a warm state snapshot, ignoring it".format(
+                snapshot_path
+            )
+        )
+        return None
+    if hashlib.sha256(payload).hexdigest().encode('ascii') != checksum:
+        logger.warning(
+            "Checksum of warm state snapshot {} does not match, ignoring "
+            "it".format(snapshot_path)
+        )
+        return None
+
+    try:
+        return marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        logger.warning(
+            "Unable to load warm state snapshot {}, ignoring it".format(
+                snapshot_path
+            )
+        )
+        return None
+
+
+_snapshot = read_snapshot()
+# A stale snapshot means the sources changed after the deploy package was
+# built, so anything else built with it, like the template bundle, is
+# stale too.
+stale = _snapshot is not None and not is_current(_snapshot)
+if stale:
+    logger.warning(
+        "Warm state snapshot {} is stale, ignoring it".format(SNAPSHOT_PATH)
+    )
+    _snapshot = None
+
+
+def get_section(name):
+    if _snapshot is None:
+        return None
+    return _snapshot.get(name)
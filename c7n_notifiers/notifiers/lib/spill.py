@@ -0,0 +1,134 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Where messages that couldn't be processed are saved in full, a
+# directory, file:// url or s3://bucket/prefix url. Lambda's /tmp only
+# lasts as long as the container, so use S3 to keep them.
+SPILL_LOCATION = os.environ.get('C7N_NOTIFIERS_SPILL_LOCATION',
+                                '/tmp/c7n_notifiers/spill')
+SPILL_SUFFIX = '.json.gz'
+# Spilled messages are written while handling an error, so favour speed
+# over size
+SPILL_COMPRESSION_LEVEL = 1
+
+
+def get_spill_id():
+    # Sorts by the time it was spilled, with a random suffix so messages
+    # spilled in the same second by different containers don't collide.
+    return "{}-{}".format(datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'),
+                          os.urandom(6).hex())
+
+
+class LocalSpillStore:
+    def __init__(self, path):
+        self.path = path
+
+    def put(self, spill_id, data):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, spill_id + SPILL_SUFFIX)
+        # Written under a temporary name so a partly written file is never
+        # mistaken for a spilled message
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'wb') as spill_file:
+            spill_file.write(data)
+        os.replace(temporary_path, file_path)
+        return file_path
+
+    def get(self, spill_id):
+        file_path = os.path.join(self.path, spill_id + SPILL_SUFFIX)
+        with open(file_path, 'rb') as spill_file:
+            return spill_file.read()
+
+
+class S3SpillStore:
+    # boto3 is part of the Lambda runtime rather than the deploy package,
+    # so it is only imported when an S3 location is used.
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('s3')
+        return self.client
+
+    def get_key(self, spill_id):
+        return self.prefix + spill_id + SPILL_SUFFIX
+
+    def put(self, spill_id, data):
+        key = self.get_key(spill_id)
+        self.get_client().put_object(Bucket=self.bucket, Key=key, Body=data,
+                                     ContentEncoding='gzip',
+                                     ContentType='application/json')
+        return "s3://{}/{}".format(self.bucket, key)
+
+    def get(self, spill_id):
+        response = self.get_client().get_object(Bucket=self.bucket,
+                                                Key=self.get_key(spill_id))
+        return response['Body'].read()
+
+
+def get_local_store(location):
+    return LocalSpillStore(location)
+
+
+def get_s3_store(location):
+    bucket, _, prefix = location.partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return S3SpillStore(bucket, prefix)
+
+
+# Spill stores by url scheme, each created from the rest of the location.
+# Locations without a scheme are local directories.
+SPILL_STORES = {
+    'file': get_local_store,
+    's3': get_s3_store
+}
+
+
+def get_spill_store(location=SPILL_LOCATION):
+    scheme, separator, rest = location.partition('://')
+    if not separator:
+        return get_local_store(location)
+    try:
+        return SPILL_STORES[scheme](rest)
+    except KeyError:
+        raise ValueError(
+            "Unknown spill location {}, must be a directory or one of "
+            "{}".format(location, ', '.join(
+                scheme + '://' for scheme in sorted(SPILL_STORES)
+            ))
+        )
+
+
+_spill_store = None
+
+
+def spill_message(c7n_message):
+    # Saves the full message, returning where it was saved, or None if it
+    # couldn't be. This is called while handling another error, so it never
+    # raises.
+    global _spill_store
+    spill_id = get_spill_id()
+    try:
+        if _spill_store is None:
+            _spill_store = get_spill_store()
+        data = gzip.compress(
+            json.dumps(c7n_message, default=str).encode('utf8'),
+            compresslevel=SPILL_COMPRESSION_LEVEL
+        )
+        location = _spill_store.put(spill_id, data)
+    except Exception:
+        logger.exception("Unable to spill message {}".format(spill_id))
+        return None
+    logger.info("Spilled message {} to {}".format(spill_id, location))
+    return location
@@ -0,0 +1,555 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import lib.spill
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Where rendered messages that couldn't be delivered are kept until they are
+# replayed, a directory, file:// url, s3://bucket/prefix url or
+# objects:// url, see get_spool. Lambda's /tmp only lasts as long as the
+# container, so use a mounted volume or S3 to keep them.
+SPOOL_LOCATION = os.environ.get('C7N_NOTIFIERS_SPOOL_LOCATION',
+                                '/tmp/c7n_notifiers/spool')
+# Seconds a replayer has to send the entries it claims before others can
+# claim them, longer than any invocation can run
+SPOOL_CLAIM_SECONDS = float(
+    os.environ.get('C7N_NOTIFIERS_SPOOL_CLAIM_SECONDS', 900)
+)
+# Failed replays of an entry before it's moved to the dead letters, so
+# payloads that can never be sent don't hold up the rest
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('C7N_NOTIFIERS_SPOOL_MAX_ATTEMPTS',
+                                        5))
+# Payloads are spooled while delivering, so favour speed over size
+SPOOL_COMPRESSION_LEVEL = 1
+INDEX_FILE_NAME = 'index.ndjson'
+LOCK_FILE_NAME = 'index.lock'
+SEGMENT_DIRECTORY = 'segments'
+DEAD_DIRECTORY = 'dead'
+SEGMENT_SUFFIX = '.ndjson.gz'
+
+
+def compress_payload(payload):
+    return gzip.compress(json.dumps(payload).encode('utf8'),
+                         compresslevel=SPOOL_COMPRESSION_LEVEL)
+
+
+def decompress_payload(data):
+    return json.loads(gzip.decompress(data).decode('utf8'))
+
+
+def get_entry(spool_id, payload):
+    # What the index keeps about a spooled payload, enough to schedule its
+    # delivery without reading it
+    return {
+        'id': spool_id,
+        'destination': payload['destination'],
+        'severity': payload.get('severity'),
+        'spooled': time.time()
+    }
+
+
+def get_release(entry, error):
+    # The entry's claim given up, with error counted as a failed attempt if
+    # there was one. Returns it with whether it has run out of attempts.
+    released = dict(entry, claimed_until=0)
+    released.pop('claim', None)
+    if error is None:
+        return released, False
+    released['attempts'] = entry.get('attempts', 0) + 1
+    released['error'] = error
+    return released, released['attempts'] >= SPOOL_MAX_ATTEMPTS
+
+
+def log_dead(entry, location):
+    logger.error(
+        "Moved spooled delivery {} for {} to {} after {} failed attempts, "
+        "the last with {}".format(entry['id'], entry['destination'],
+                                  location, entry['attempts'],
+                                  entry['error'])
+    )
+
+
+class DirectorySpool:
+    # Payloads are appended to a segment file of this process as gzip
+    # members, and an index line giving the segment, offset and length of
+    # each is appended to the index file. Claims, failed attempts, progress
+    # and replayed payloads being done are recorded with more index lines.
+    # Appends hold a lock file so containers can share a spool on a mounted
+    # volume. Entries that run out of attempts are copied to the dead
+    # directory.
+    def __init__(self, path):
+        self.path = path
+        self.segment = lib.spill.get_spill_id() + SEGMENT_SUFFIX
+        self.lock = threading.Lock()
+
+    def get_lock(self):
+        # flock is released when the file is closed
+        import fcntl
+        os.makedirs(os.path.join(self.path, SEGMENT_DIRECTORY),
+                    exist_ok=True)
+        lock_file = open(os.path.join(self.path, LOCK_FILE_NAME), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def append_index(self, lines):
+        with open(os.path.join(self.path, INDEX_FILE_NAME), 'a') as index:
+            index.write(''.join(json.dumps(line) + "\n" for line in lines))
+            index.flush()
+            os.fsync(index.fileno())
+
+    def read_index(self):
+        # The pending entries, oldest first, with the changes made to them
+        entries = {}
+        try:
+            index = open(os.path.join(self.path, INDEX_FILE_NAME))
+        except FileNotFoundError:
+            return []
+        with index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line left partly written by a container that
+                    # stopped while appending
+                    continue
+                if entry.get('done'):
+                    entries.pop(entry['id'], None)
+                elif 'destination' in entry:
+                    entries[entry['id']] = entry
+                elif entry['id'] in entries:
+                    entries[entry['id']].update(entry)
+        return list(entries.values())
+
+    def append(self, payload):
+        data = compress_payload(payload)
+        entry = get_entry(lib.spill.get_spill_id(), payload)
+        with self.lock, self.get_lock():
+            segment_path = os.path.join(self.path, SEGMENT_DIRECTORY,
+                                        self.segment)
+            with open(segment_path, 'ab') as segment:
+                entry.update(segment=self.segment, offset=segment.tell(),
+                             length=len(data))
+                segment.write(data)
+                segment.flush()
+                os.fsync(segment.fileno())
+            self.append_index([entry])
+        return entry['id']
+
+    def claim(self, limit=None, lease=SPOOL_CLAIM_SECONDS):
+        # Claims up to limit of the pending entries no one else has claimed,
+        # oldest first, for lease seconds. Each must be completed or
+        # released.
+        now = time.time()
+        with self.lock, self.get_lock():
+            entries = [
+                entry for entry in self.read_index()
+                if entry.get('claimed_until', 0) <= now
+            ][:limit]
+            for entry in entries:
+                entry['claimed_until'] = now + lease
+            if entries:
+                self.append_index([
+                    {'id': entry['id'], 'claimed_until': now + lease}
+                    for entry in entries
+                ])
+        return entries
+
+    def update(self, entry, progress):
+        # Records what of a claimed entry has been sent
+        with self.lock, self.get_lock():
+            self.append_index([{'id': entry['id'], 'progress': progress}])
+
+    def release(self, entry, error=None):
+        # Gives up the claim on entry, counting error as a failed attempt
+        released, dead = get_release(entry, error)
+        if dead:
+            self.bury(released)
+            return
+        with self.lock, self.get_lock():
+            self.append_index([{
+                key: released[key]
+                for key in ('id', 'claimed_until', 'attempts', 'error')
+                if key in released
+            }])
+
+    def read(self, entry):
+        segment_path = os.path.join(self.path, SEGMENT_DIRECTORY,
+                                    entry['segment'])
+        with open(segment_path, 'rb') as segment:
+            segment.seek(entry['offset'])
+            return decompress_payload(segment.read(entry['length']))
+
+    def complete(self, entry):
+        with self.lock, self.get_lock():
+            self.append_index([{'id': entry['id'], 'done': True}])
+
+    def bury(self, entry):
+        # Copies the entry and its payload to the dead directory, where
+        # they're left to be looked at, and marks it done
+        dead_directory = os.path.join(self.path, DEAD_DIRECTORY)
+        os.makedirs(dead_directory, exist_ok=True)
+        with open(os.path.join(dead_directory, entry['id'] + SEGMENT_SUFFIX),
+                  'wb') as dead_payload:
+            dead_payload.write(compress_payload(self.read(entry)))
+        with open(os.path.join(dead_directory, entry['id'] + '.json'),
+                  'w') as dead_entry:
+            json.dump(entry, dead_entry)
+        self.complete(entry)
+        log_dead(entry, dead_directory)
+
+    def compact(self):
+        # Rewrites the index with only the pending entries and removes
+        # segments that have none left
+        with self.lock, self.get_lock():
+            entries = self.read_index()
+            index_path = os.path.join(self.path, INDEX_FILE_NAME)
+            temporary_path = index_path + '.tmp'
+            with open(temporary_path, 'w') as index:
+                for entry in entries:
+                    index.write(json.dumps(entry) + "\n")
+            os.replace(temporary_path, index_path)
+            segments = {entry['segment'] for entry in entries}
+            segment_directory = os.path.join(self.path, SEGMENT_DIRECTORY)
+            for segment in os.listdir(segment_directory):
+                if segment not in segments:
+                    os.remove(os.path.join(segment_directory, segment))
+
+    def __str__(self):
+        return self.path
+
+
+class LocalObjectStore:
+    # The object store interface on a local directory, a stand-in for S3
+    # that keeps the same layout
+    def __init__(self, path):
+        self.path = path
+
+    def put(self, key, data):
+        file_path = os.path.join(self.path, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'wb') as object_file:
+            object_file.write(data)
+        os.replace(temporary_path, file_path)
+
+    def get(self, key):
+        with open(os.path.join(self.path, key), 'rb') as object_file:
+            return object_file.read()
+
+    def create(self, key, data):
+        # Puts an object only if there isn't one at key, returning whether
+        # it did
+        file_path = os.path.join(self.path, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            descriptor = os.open(file_path,
+                                 os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with open(descriptor, 'wb') as object_file:
+            object_file.write(data)
+        return True
+
+    def delete(self, key):
+        file_path = os.path.join(self.path, key)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        # Directories aren't objects, so empty ones aren't left behind
+        try:
+            os.rmdir(os.path.dirname(file_path))
+        except OSError:
+            pass
+
+    def list(self, prefix, limit=None):
+        directory, _, name_prefix = prefix.rpartition('/')
+        try:
+            names = os.listdir(os.path.join(self.path, directory))
+        except FileNotFoundError:
+            return []
+        keys = sorted(
+            os.path.join(directory, name) for name in names
+            if name.startswith(name_prefix) and not name.endswith('.tmp')
+        )
+        return keys[:limit]
+
+    def __str__(self):
+        return "objects://" + self.path
+
+
+class S3ObjectStore:
+    # boto3 is part of the Lambda runtime rather than the deploy package,
+    # so it is only imported when an S3 location is used.
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = None
+        self.versioned = False
+
+    def get_client(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('s3')
+        return self.client
+
+    def put(self, key, data):
+        self.get_client().put_object(Bucket=self.bucket,
+                                     Key=self.prefix + key, Body=data)
+
+    def get(self, key):
+        response = self.get_client().get_object(Bucket=self.bucket,
+                                                Key=self.prefix + key)
+        return response['Body'].read()
+
+    def check_versioned(self):
+        # Claims rely on the order of an object's versions
+        if self.versioned:
+            return
+        response = self.get_client().get_bucket_versioning(
+            Bucket=self.bucket
+        )
+        if response.get('Status') != 'Enabled':
+            raise ValueError(
+                "Spool bucket {} must have versioning enabled for spooled "
+                "deliveries to be claimed".format(self.bucket)
+            )
+        self.versioned = True
+
+    def create(self, key, data):
+        # Puts an object only if there isn't one at key, returning whether
+        # it did. The boto3 in the python3.6 runtime can't make conditional
+        # writes, so every writer puts a version of the object and the one
+        # that put the oldest has created it. S3 lists an object's versions
+        # newest first, and a listing made after a put includes every
+        # version put before it, so each writer sees whether another came
+        # first. Later versions are deleted, leaving the first's data.
+        self.check_versioned()
+        client = self.get_client()
+        version_id = client.put_object(Bucket=self.bucket,
+                                       Key=self.prefix + key,
+                                       Body=data)['VersionId']
+        response = client.list_object_versions(Bucket=self.bucket,
+                                               Prefix=self.prefix + key)
+        version_ids = [
+            version['VersionId'] for version in response.get('Versions', [])
+            if version['Key'] == self.prefix + key
+        ]
+        if version_ids[-1] == version_id:
+            return True
+        client.delete_object(Bucket=self.bucket, Key=self.prefix + key,
+                             VersionId=version_id)
+        return False
+
+    def delete(self, key):
+        self.get_client().delete_object(Bucket=self.bucket,
+                                        Key=self.prefix + key)
+
+    def list(self, prefix, limit=None):
+        # Keys are listed in order, so only as many pages as are needed
+        keys = []
+        paginator = self.get_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket,
+                                       Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                keys.append(item['Key'][len(self.prefix):])
+                if limit is not None and len(keys) >= limit:
+                    return keys
+        return keys
+
+    def __str__(self):
+        return "s3://{}/{}".format(self.bucket, self.prefix)
+
+
+class ObjectStoreSpool:
+    # Objects can't be appended to, so each payload is an object of its own
+    # under records/, and its index entry an object under index/. Both are
+    # named by the spool id, which sorts by the time it was spooled. An
+    # entry is claimed by creating claims/<id>/<generation>.json only if it
+    # doesn't exist, so only one replayer can make each claim. A claim that
+    # has run out is taken over with the next generation. Entries that run
+    # out of attempts are moved under dead/.
+    def __init__(self, store):
+        self.store = store
+
+    def get_index_key(self, entry):
+        return 'index/' + entry['id'] + '.json'
+
+    def get_record_key(self, entry):
+        return 'records/' + entry['id'] + SEGMENT_SUFFIX
+
+    def claim_entry(self, entry, now, lease):
+        # The key of a new claim on entry, or None if it's claimed already
+        claim_keys = self.store.list('claims/' + entry['id'] + '/')
+        generation = 0
+        if claim_keys:
+            try:
+                claim = json.loads(self.store.get(claim_keys[-1]))
+            except Exception:
+                # Being written, or the entry is being completed
+                return None
+            if claim['claimed_until'] > now:
+                return None
+            generation = int(
+                claim_keys[-1].rpartition('/')[2].partition('.')[0]
+            ) + 1
+        claim_key = 'claims/{}/{:06d}.json'.format(entry['id'], generation)
+        claim = json.dumps({'claimed_until': now + lease}).encode('utf8')
+        if not self.store.create(claim_key, claim):
+            return None
+        return claim_key
+
+    def append(self, payload):
+        entry = get_entry(lib.spill.get_spill_id(), payload)
+        # The record is written first so an index entry always has one
+        self.store.put(self.get_record_key(entry), compress_payload(payload))
+        self.store.put(self.get_index_key(entry),
+                       json.dumps(entry).encode('utf8'))
+        return entry['id']
+
+    def read_entry(self, key):
+        try:
+            return json.loads(self.store.get(key))
+        except Exception:
+            # Replayed by another container since it was listed
+            logger.debug("Unable to read spool entry {}".format(key))
+            return None
+
+    def claim(self, limit=None, lease=SPOOL_CLAIM_SECONDS):
+        # Claims up to limit of the pending entries no one else has claimed,
+        # oldest first, for lease seconds. Each must be completed or
+        # released.
+        now = time.time()
+        entries = []
+        for key in self.store.list('index/'):
+            if limit is not None and len(entries) >= limit:
+                break
+            entry = self.read_entry(key)
+            if entry is None:
+                continue
+            claim_key = self.claim_entry(entry, now, lease)
+            if claim_key is None:
+                continue
+            # Read again now it's claimed, in case it was completed or
+            # changed since it was first read
+            entry = self.read_entry(key)
+            if entry is None:
+                self.store.delete(claim_key)
+                continue
+            entry['claim'] = claim_key
+            entries.append(entry)
+        return entries
+
+    def put_entry(self, entry):
+        # Claims are kept in their own objects
+        stored = dict(entry)
+        stored.pop('claim', None)
+        stored.pop('claimed_until', None)
+        self.store.put(self.get_index_key(entry),
+                       json.dumps(stored).encode('utf8'))
+
+    def update(self, entry, progress):
+        # Records what of a claimed entry has been sent
+        self.put_entry(dict(entry, progress=progress))
+
+    def release(self, entry, error=None):
+        # Gives up the claim on entry, counting error as a failed attempt
+        released, dead = get_release(entry, error)
+        if dead:
+            self.bury(released, entry['claim'])
+            return
+        self.put_entry(released)
+        self.store.put(entry['claim'],
+                       json.dumps({'claimed_until': 0}).encode('utf8'))
+
+    def read(self, entry):
+        return decompress_payload(self.store.get(self.get_record_key(entry)))
+
+    def complete(self, entry):
+        # The index entry goes first, so the entry is never replayed once
+        # its record has gone
+        self.store.delete(self.get_index_key(entry))
+        self.store.delete(self.get_record_key(entry))
+        for claim_key in self.store.list('claims/' + entry['id'] + '/'):
+            self.store.delete(claim_key)
+
+    def bury(self, entry, claim_key):
+        self.store.put('dead/' + self.get_record_key(entry),
+                       self.store.get(self.get_record_key(entry)))
+        self.store.put('dead/' + self.get_index_key(entry),
+                       json.dumps(entry).encode('utf8'))
+        self.complete(dict(entry, claim=claim_key))
+        log_dead(entry, "dead/ in {}".format(self.store))
+
+    def compact(self):
+        pass
+
+    def __str__(self):
+        return str(self.store)
+
+
+def get_directory_spool(location):
+    return DirectorySpool(location)
+
+
+def get_s3_spool(location):
+    bucket, _, prefix = location.partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return ObjectStoreSpool(S3ObjectStore(bucket, prefix))
+
+
+def get_objects_spool(location):
+    return ObjectStoreSpool(LocalObjectStore(location))
+
+
+# Spools by url scheme, each created from the rest of the location.
+# Locations without a scheme are local directories.
+SPOOLS = {
+    'file': get_directory_spool,
+    'objects': get_objects_spool,
+    's3': get_s3_spool
+}
+
+
+def get_spool(location=SPOOL_LOCATION):
+    scheme, separator, rest = location.partition('://')
+    if not separator:
+        return get_directory_spool(location)
+    try:
+        return SPOOLS[scheme](rest)
+    except KeyError:
+        raise ValueError(
+            "Unknown spool location {}, must be a directory or one of "
+            "{}".format(location, ', '.join(
+                scheme + '://' for scheme in sorted(SPOOLS)
+            ))
+        )
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_default_spool():
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = get_spool()
+        return _spool
+
+
+def spool_payload(payload):
+    # Spools a rendered payload, see get_spool_payload in slack_notifier
+    spool = get_default_spool()
+    spool_id = spool.append(payload)
+    logger.info("Spooled {} messages for {} to {} as {}".format(
+        len(payload['messages']), payload['destination'], spool, spool_id
+    ))
+    return spool_id
@@ -0,0 +1,379 @@
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Where suppression rules are read from, a YAML or JSON file or an
+# s3://bucket/key url, see the README
+SUPPRESSIONS_LOCATION = os.environ.get('C7N_NOTIFIERS_SUPPRESSIONS_LOCATION',
+                                       '')
+# How long, in seconds, rules are used before they're read again
+SUPPRESSIONS_TTL = float(
+    os.environ.get('C7N_NOTIFIERS_SUPPRESSIONS_TTL', 60)
+)
+
+# Keys matched against the message, the rest against each resource
+MESSAGE_KEYS = ('account_id', 'region', 'resource_type', 'policy')
+RESOURCE_KEYS = ('tag', 'id_prefix')
+WINDOW_KEYS = ('from', 'until')
+RULE_KEYS = set(MESSAGE_KEYS + RESOURCE_KEYS + WINDOW_KEYS) | {'reason'}
+WINDOW_FORMATS = ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def as_list(value):
+    return value if type(value) is list else [value]
+
+
+def parse_window_time(value):
+    # PyYAML loads unquoted timestamps as datetimes, anything else must be
+    # a string in one of WINDOW_FORMATS. Times are UTC.
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if type(value) is str:
+        for window_format in WINDOW_FORMATS:
+            try:
+                return datetime.strptime(value, window_format)
+            except ValueError:
+                pass
+    return None
+
+
+def get_window_time(rule, key):
+    if key not in rule:
+        return None
+    return parse_window_time(rule[key])
+
+
+def validate_suppressions(config, source):
+    def invalid(message):
+        return ValueError("Invalid suppressions in {}: {}".format(
+            source, message
+        ))
+
+    if (type(config) is not dict or
+            type(config.get('suppressions')) is not list):
+        raise invalid("must be a mapping with a list of suppressions")
+    for number, rule in enumerate(config['suppressions'], 1):
+        if type(rule) is not dict:
+            raise invalid("suppression {} must be a mapping".format(number))
+        unknown_keys = set(rule) - RULE_KEYS
+        if unknown_keys:
+            raise invalid("suppression {} has unknown keys {}".format(
+                number, sorted(unknown_keys)
+            ))
+        if not set(rule) & set(MESSAGE_KEYS + RESOURCE_KEYS):
+            raise invalid(
+                "suppression {} must match on at least one of {}".format(
+                    number, ', '.join(MESSAGE_KEYS + RESOURCE_KEYS)
+                )
+            )
+        for key in MESSAGE_KEYS + RESOURCE_KEYS:
+            if key in rule and (
+                    not as_list(rule[key]) or
+                    any(type(value) not in (str, int)
+                        for value in as_list(rule[key]))):
+                raise invalid(
+                    "suppression {} {} must be a value or list of "
+                    "values".format(number, key)
+                )
+        for key in WINDOW_KEYS:
+            if key in rule and parse_window_time(rule[key]) is None:
+                raise invalid(
+                    "suppression {} {} must be a time like "
+                    "2020-01-31T18:00:00Z".format(number, key)
+                )
+
+
+class PrefixTrie:
+    # Resource id prefixes, so an id is checked against every prefix in a
+    # single walk of its characters
+    END = ''
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self.root
+        for character in prefix:
+            node = node.setdefault(character, {})
+        node[self.END] = True
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def matches(self, value):
+        node = self.root
+        if self.END in node:
+            return True
+        for character in value:
+            node = node.get(character)
+            if node is None:
+                return False
+            if self.END in node:
+                return True
+        return False
+
+
+class ResourceMatcher:
+    # The resource conditions of a set of suppressions: tag keys, tag
+    # key=value pairs and id prefixes, any of which suppresses a resource.
+    # Suppressions combining tags with id prefixes need both, so each
+    # gets a matcher of its own in all_of. Only sets and dicts, so it can
+    # be pickled for the extraction processes, see lib/parallel.py.
+    def __init__(self):
+        self.tag_keys = set()
+        self.tags = set()
+        self.id_prefixes = PrefixTrie()
+        self.all_of = []
+        # Set when a suppression has no resource conditions, so every
+        # resource is suppressed
+        self.everything = False
+
+    def add_tags(self, tags):
+        for tag in tags:
+            key, separator, value = str(tag).partition('=')
+            if separator:
+                self.tags.add((key, value))
+            else:
+                self.tag_keys.add(key)
+
+    def add(self, rule):
+        has_tags = 'tag' in rule
+        has_prefixes = 'id_prefix' in rule
+        if has_tags and has_prefixes:
+            tag_matcher = ResourceMatcher()
+            tag_matcher.add_tags(as_list(rule['tag']))
+            prefix_matcher = ResourceMatcher()
+            for prefix in as_list(rule['id_prefix']):
+                prefix_matcher.id_prefixes.add(str(prefix))
+            self.all_of.append((tag_matcher, prefix_matcher))
+        elif has_tags:
+            self.add_tags(as_list(rule['tag']))
+        elif has_prefixes:
+            for prefix in as_list(rule['id_prefix']):
+                self.id_prefixes.add(str(prefix))
+        else:
+            self.everything = True
+
+    def has_tag(self, resource_data):
+        if not (self.tag_keys or self.tags):
+            return False
+        if type(resource_data) is not dict:
+            return False
+        tags = resource_data.get('Tags')
+        if type(tags) is not list:
+            return False
+        for tag in tags:
+            if type(tag) is not dict:
+                continue
+            key = tag.get('Key')
+            if type(key) is not str:
+                continue
+            if key in self.tag_keys or (key, tag.get('Value')) in self.tags:
+                return True
+        return False
+
+    def has_id_prefix(self, resource_id):
+        if not self.id_prefixes or type(resource_id) is not str:
+            return False
+        return self.id_prefixes.matches(resource_id)
+
+    def is_suppressed(self, resource_data, get_id):
+        # Checked before the resource is extracted, so suppressed resources
+        # never are. get_id returns the id of resource_data, and is only
+        # called when there are id prefixes to match it against.
+        if self.everything:
+            return True
+        if self.has_tag(resource_data):
+            return True
+        if not (self.id_prefixes or self.all_of):
+            return False
+        resource_id = get_id(resource_data)
+        if self.has_id_prefix(resource_id):
+            return True
+        for tag_matcher, prefix_matcher in self.all_of:
+            if (tag_matcher.has_tag(resource_data) and
+                    prefix_matcher.has_id_prefix(resource_id)):
+                return True
+        return False
+
+
+class Suppressions:
+    # Compiled suppression rules. Each rule's message conditions are turned
+    # into sets and its time window parsed, so a message is checked against
+    # them once, then the resource conditions of the rules that apply are
+    # combined into a single ResourceMatcher for all its resources.
+    def __init__(self, rules):
+        self.rules = []
+        for rule in rules:
+            self.rules.append({
+                'rule': rule,
+                'from': get_window_time(rule, 'from'),
+                'until': get_window_time(rule, 'until'),
+                'match': {
+                    key: {str(value) for value in as_list(rule[key])}
+                    for key in MESSAGE_KEYS if key in rule
+                }
+            })
+
+    def get_matcher(self, message_attributes, now=None):
+        # The ResourceMatcher for the message, or None when no suppressions
+        # apply to it
+        if now is None:
+            now = datetime.utcnow()
+        matcher = None
+        for compiled in self.rules:
+            if compiled['from'] is not None and now < compiled['from']:
+                continue
+            if compiled['until'] is not None and now >= compiled['until']:
+                continue
+            if any(message_attributes[key] not in values
+                   for key, values in compiled['match'].items()):
+                continue
+            if matcher is None:
+                matcher = ResourceMatcher()
+            matcher.add(compiled['rule'])
+        return matcher
+
+
+def parse_suppressions(data, source):
+    if source.endswith('.json'):
+        config = json.loads(data.decode('utf8'))
+    else:
+        import yaml
+        config = yaml.safe_load(data.decode('utf8'))
+    validate_suppressions(config, source)
+    return config['suppressions']
+
+
+class FileSuppressionStore:
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, 'rb') as suppressions_file:
+            return suppressions_file.read()
+
+
+class S3SuppressionStore:
+    # boto3 is part of the Lambda runtime rather than the deploy package,
+    # so it is only imported when an S3 location is used.
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+
+    def read(self):
+        import boto3
+        response = boto3.client('s3').get_object(Bucket=self.bucket,
+                                                 Key=self.key)
+        return response['Body'].read()
+
+
+def get_file_store(location):
+    return FileSuppressionStore(location)
+
+
+def get_s3_store(location):
+    bucket, _, key = location.partition('/')
+    return S3SuppressionStore(bucket, key)
+
+
+# Suppression stores by url scheme, each created from the rest of the
+# location. Locations without a scheme are local files.
+SUPPRESSION_STORES = {
+    'file': get_file_store,
+    's3': get_s3_store
+}
+
+
+def get_suppression_store(location):
+    scheme, separator, rest = location.partition('://')
+    if not separator:
+        return get_file_store(location)
+    try:
+        return SUPPRESSION_STORES[scheme](rest)
+    except KeyError:
+        raise ValueError(
+            "Unknown suppressions location {}, must be a file or one of "
+            "{}".format(location, ', '.join(
+                scheme + '://' for scheme in sorted(SUPPRESSION_STORES)
+            ))
+        )
+
+
+class SuppressionsCache:
+    # Rules are read from the store again once they're ttl seconds old, and
+    # only compiled again when they have changed.
+    def __init__(self, location, store, ttl=SUPPRESSIONS_TTL,
+                 clock=time.monotonic):
+        self.location = location
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.suppressions = None
+        self.checksum = None
+        self.loaded = None
+
+    def get_suppressions(self):
+        with self.lock:
+            now = self.clock()
+            if (self.suppressions is not None and
+                    now - self.loaded < self.ttl):
+                return self.suppressions
+            self.loaded = now
+            try:
+                data = self.store.read()
+                checksum = hashlib.sha256(data).hexdigest()
+                if checksum != self.checksum:
+                    self.suppressions = Suppressions(
+                        parse_suppressions(data, self.location)
+                    )
+                    self.checksum = checksum
+                    logger.info("Loaded {} suppressions from {}".format(
+                        len(self.suppressions.rules), self.location
+                    ))
+            except Exception:
+                if self.suppressions is None:
+                    raise
+                logger.exception(
+                    "Unable to reload suppressions from {}, using the "
+                    "previous suppressions".format(self.location)
+                )
+            return self.suppressions
+
+
+_suppressions_cache = None
+if SUPPRESSIONS_LOCATION:
+    _suppressions_cache = SuppressionsCache(
+        SUPPRESSIONS_LOCATION, get_suppression_store(SUPPRESSIONS_LOCATION)
+    )
+
+
+def get_message_attributes(c7n_message):
+    return {
+        'account_id': str(c7n_message['account_id']),
+        'region': c7n_message['region'],
+        'resource_type': c7n_message['policy']['resource'],
+        'policy': c7n_message['policy']['name']
+    }
+
+
+def get_matcher(c7n_message):
+    # The ResourceMatcher for the message, or None when nothing in it can
+    # be suppressed
+    if _suppressions_cache is None:
+        return None
+    return _suppressions_cache.get_suppressions().get_matcher(
+        get_message_attributes(c7n_message)
+    )
@@ -0,0 +1,322 @@
+import collections
+import hashlib
+import json
+import logging
+import marshal
+import os
+import sys
+import threading
+import types
+
+import lib.metrics
+import lib.snapshot
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_PATH = os.path.join(os.path.dirname(current_dir), "templates")
+# All the templates packed into one file by build_bundle, see lib/build.py
+BUNDLE_PATH = os.path.join(os.path.dirname(current_dir), "templates.bundle")
+BUNDLE_MAGIC = b'C7NTB2'
+
+RENDER_CACHE_SIZE = int(
+    os.environ.get('C7N_NOTIFIERS_RENDER_CACHE_SIZE', 256)
+)
+# Characters the rendered templates in the cache can add up to, so a few
+# huge tables can't take up the function's memory
+RENDER_CACHE_CHARACTERS = int(
+    os.environ.get('C7N_NOTIFIERS_RENDER_CACHE_CHARACTERS', 8 * 1024 * 1024)
+)
+# Rendered templates longer than this aren't cached. They're for messages
+# with many resources, which are rarely the same twice.
+RENDER_CACHE_MAX_CHARACTERS = int(
+    os.environ.get('C7N_NOTIFIERS_RENDER_CACHE_MAX_CHARACTERS', 256 * 1024)
+)
+
+
+class RenderCache:
+    # LRU of rendered templates, bounded by both their number and their
+    # total characters. Rendering is deterministic for a template and
+    # context, so the same policy producing the same output run after run
+    # only renders once per warm container.
+    def __init__(self, max_size=RENDER_CACHE_SIZE,
+                 max_characters=RENDER_CACHE_CHARACTERS,
+                 max_entry_characters=RENDER_CACHE_MAX_CHARACTERS):
+        self.max_size = max_size
+        self.max_characters = max_characters
+        self.max_entry_characters = min(max_entry_characters,
+                                        max_characters)
+        self.entries = collections.OrderedDict()
+        self.characters = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                lib.metrics.increment('render_cache.miss')
+                return None
+            self.entries.move_to_end(key)
+        lib.metrics.increment('render_cache.hit')
+        return value
+
+    def accepts(self, characters):
+        # Whether a render of this many characters can be cached
+        return characters <= self.max_entry_characters
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        if not self.accepts(len(value)):
+            lib.metrics.increment('render_cache.too_large')
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.characters -= len(previous)
+            self.entries[key] = value
+            self.characters += len(value)
+            while (len(self.entries) > self.max_size or
+                    self.characters > self.max_characters):
+                _, evicted = self.entries.popitem(last=False)
+                self.characters -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.characters = 0
+
+
+def get_bundle_data(templates_path=TEMPLATES_PATH):
+    # Pack the source of every template, plus the code Jinja compiles it
+    # into, into a single blob. The sources and versions are a line of JSON
+    # that any Python can read, followed by the marshalled code, which is
+    # only unmarshalled by the same Python version that built the bundle.
+    # Anything else compiles the source.
+    import jinja2
+    environment = jinja2.Environment()
+    sources = {}
+    codes = {}
+    for name in sorted(os.listdir(templates_path)):
+        if name.startswith('.'):
+            continue
+        with open(os.path.join(templates_path, name)) as template_file:
+            sources[name] = template_file.read()
+        codes[name] = environment.compile(sources[name], name,
+                                          '<bundle>/' + name)
+
+    header = json.dumps({
+        'cache_tag': sys.implementation.cache_tag,
+        'jinja2_version': jinja2.__version__,
+        'sources': sources
+    })
+    payload = header.encode('utf8') + b'\n' + marshal.dumps(codes)
+    checksum = hashlib.sha256(payload).hexdigest().encode('ascii')
+    return BUNDLE_MAGIC + b'\n' + checksum + b'\n' + payload
+
+
+def build_bundle(templates_path=TEMPLATES_PATH, bundle_path=BUNDLE_PATH):
+    data = get_bundle_data(templates_path)
+    with open(bundle_path, 'wb') as bundle_file:
+        bundle_file.write(data)
+
+    logger.info("Bundled templates into {}".format(bundle_path))
+
+
+def parse_bundle(data, bundle_name):
+    # Returns the bundle packed by get_bundle_data, or None if it isn't
+    # usable. This doesn't need Jinja, so a bundle can be read when the
+    # module is imported without importing Jinja.
+    try:
+        magic, checksum, payload = data.split(b'\n', 2)
+    except ValueError:
+        magic = None
+    if magic != BUNDLE_MAGIC:
+        logger.warning(
+            "{} is not a template bundle, ignoring it".format(bundle_name)
+        )
+        return None
+    if hashlib.sha256(payload).hexdigest().encode('ascii') != checksum:
+        logger.warning(
+            "Checksum of template bundle {} does not match, ignoring "
+            "it".format(bundle_name)
+        )
+        return None
+
+    header, _, code_data = payload.partition(b'\n')
+    try:
+        bundle = json.loads(header.decode('utf8'))
+    except ValueError:
+        logger.warning(
+            "Unable to load template bundle {}, ignoring it".format(
+                bundle_name
+            )
+        )
+        return None
+    codes = {}
+    if bundle['cache_tag'] == sys.implementation.cache_tag:
+        try:
+            codes = marshal.loads(code_data)
+        except (EOFError, ValueError, TypeError):
+            logger.warning(
+                "Unable to load the code in template bundle {}, compiling "
+                "its templates".format(bundle_name)
+            )
+    bundle['templates'] = {
+        name: (source, codes.get(name))
+        for name, source in bundle.pop('sources').items()
+    }
+    return bundle
+
+
+def read_bundle(bundle_path=BUNDLE_PATH):
+    # Returns the bundle built by build_bundle, or None when there is no
+    # usable bundle and the templates should be read from the templates
+    # directory.
+    try:
+        with open(bundle_path, 'rb') as bundle_file:
+            data = bundle_file.read()
+    except FileNotFoundError:
+        return None
+    return parse_bundle(data, bundle_path)
+
+
+def get_bundle_templates(bundle):
+    # Returns an immutable mapping of template name to (source, code). The
+    # code is dropped when the bundle was built by a different Jinja
+    # version, or was never unmarshalled as it was built by a different
+    # Python, so the source is compiled instead.
+    import jinja2
+    templates = bundle['templates']
+    if bundle['jinja2_version'] != jinja2.__version__:
+        templates = {
+            name: (source, None) for name, (source, _) in templates.items()
+        }
+    return types.MappingProxyType(templates)
+
+
+def load_bundle(bundle_path=BUNDLE_PATH):
+    bundle = read_bundle(bundle_path)
+    if bundle is None:
+        return None
+    return get_bundle_templates(bundle)
+
+
+def _uptodate():
+    return True
+
+
+class BundleLoader:
+    # Serves templates from a loaded bundle. Everything is already in
+    # memory and never changes, so loading a template makes no system calls
+    # and templates are always up to date. Implements the same interface as
+    # jinja2.BaseLoader, without subclassing it so Jinja isn't imported
+    # until a template is rendered.
+    has_source_access = True
+
+    def __init__(self, templates):
+        self.templates = templates
+
+    def get_source(self, environment, template):
+        import jinja2
+        try:
+            source, _ = self.templates[template]
+        except KeyError:
+            raise jinja2.TemplateNotFound(template)
+        return source, None, _uptodate
+
+    def list_templates(self):
+        return sorted(self.templates)
+
+    def load(self, environment, name, globals=None):
+        import jinja2
+        try:
+            source, code = self.templates[name]
+        except KeyError:
+            raise jinja2.TemplateNotFound(name)
+        if code is None:
+            code = environment.compile(source, name, '<bundle>/' + name)
+        return environment.template_class.from_code(
+            environment, code, globals or {}, _uptodate
+        )
+
+
+def get_startup_bundle():
+    # Templates from the warm state snapshot when it is current, otherwise
+    # from the template bundle, if either exists. The bundle was built with
+    # the snapshot, so isn't used when the snapshot is stale.
+    if lib.snapshot.stale:
+        return None
+    snapshot_bundle = lib.snapshot.get_section('templates')
+    if snapshot_bundle is not None:
+        bundle = parse_bundle(snapshot_bundle, lib.snapshot.SNAPSHOT_PATH)
+        if bundle is not None:
+            return bundle
+    return read_bundle()
+
+
+_bundle = get_startup_bundle()
+_environment = None
+_environment_lock = threading.Lock()
+render_cache = RenderCache()
+
+
+def get_loader():
+    import jinja2
+    if _bundle is not None:
+        return BundleLoader(get_bundle_templates(_bundle))
+    return jinja2.FileSystemLoader(TEMPLATES_PATH)
+
+
+def get_environment():
+    # Jinja is only imported, and the environment created, the first time
+    # a template is rendered.
+    import jinja2
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            loader = get_loader()
+            _environment = jinja2.Environment(
+                loader=loader,
+                # Bundled templates never change, so there is nothing for
+                # Jinja to check
+                auto_reload=not isinstance(loader, BundleLoader)
+            )
+        return _environment
+
+
+def get_context_hash(template_info):
+    # A stable hash of the render context. Keys are sorted so dict ordering
+    # doesn't matter, values json can't encode are hashed by their str.
+    context_json = json.dumps(template_info, sort_keys=True, default=str)
+    return hashlib.sha256(context_json.encode('utf8')).hexdigest()
+
+
+def get_context_characters(template_info):
+    # The characters of the context's strings. Only the top level is
+    # counted, the resource table being the one value that grows.
+    return sum(len(value) for value in template_info.values()
+               if type(value) is str)
+
+
+def render_uncached(template_name, template_info):
+    template = get_environment().get_template(template_name)
+    return template.render(**template_info)
+
+
+def render(template_name, template_info):
+    # A context too big to cache a render of, i.e. a large resource table,
+    # is rendered without hashing it, which would take about as long
+    if render_cache.max_size <= 0:
+        return render_uncached(template_name, template_info)
+    if not render_cache.accepts(get_context_characters(template_info)):
+        lib.metrics.increment('render_cache.too_large')
+        return render_uncached(template_name, template_info)
+    key = (template_name, get_context_hash(template_info))
+    rendered = render_cache.get(key)
+    if rendered is None:
+        rendered = render_uncached(template_name, template_info)
+        render_cache.put(key, rendered)
+    return rendered
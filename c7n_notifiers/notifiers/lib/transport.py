@@ -0,0 +1,341 @@
+import http.client
+import io
+import logging
+import os
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import lib.metrics
+import lib.ratelimit
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# How requests are sent, 'asyncio' to send them over connections kept open
+# for as long as the container, or 'urllib' to open one per request
+TRANSPORT = os.environ.get('C7N_NOTIFIERS_TRANSPORT', 'asyncio')
+# Requests in flight to each host, and the connections kept open to it
+HOST_CONCURRENCY = int(
+    os.environ.get('C7N_NOTIFIERS_HOST_CONCURRENCY', 8)
+)
+# Requests per second to each host, 0 for no limit. Requests waiting on the
+# limit don't hold up requests to other hosts.
+HOST_RATE = float(os.environ.get('C7N_NOTIFIERS_HOST_RATE', 0))
+# Seconds a connection can be idle before it's closed rather than reused
+KEEPALIVE_SECONDS = 30
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+MAX_LINE_BYTES = 65536
+
+
+class Response:
+    # Enough of urllib's response for the notifier, with the body already
+    # read so the connection can be reused
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.code = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __repr__(self):
+        return "<Response {} {}>".format(self.status, self.url)
+
+
+async def read_line(reader):
+    line = await reader.readline()
+    if len(line) > MAX_LINE_BYTES:
+        raise http.client.LineTooLong("header line")
+    return line
+
+
+async def read_body(reader, headers, status, method):
+    # Returns the body and whether the connection can be reused after it
+    if method == 'HEAD' or status in (204, 304):
+        return b'', True
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        chunks = []
+        while True:
+            size_line = await read_line(reader)
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        # Trailers, up to the blank line that ends the body
+        while (await read_line(reader)) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks), True
+    content_length = headers.get('Content-Length')
+    if content_length is not None:
+        return await reader.readexactly(int(content_length)), True
+    # The body runs until the server closes the connection
+    return await reader.read(), False
+
+
+async def read_response(reader, method):
+    while True:
+        status_line = await read_line(reader)
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server")
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        version, status = parts[0], int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = http.client.HTTPMessage()
+        while True:
+            line = await read_line(reader)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip()] = value.strip()
+        # Informational responses are followed by the real one
+        if not 100 <= status < 200:
+            break
+    body, reusable = await read_body(reader, headers, status, method)
+    reusable = (
+        reusable and version == 'HTTP/1.1' and
+        headers.get('Connection', '').lower() != 'close'
+    )
+    return status, reason, headers, body, reusable
+
+
+class HostPool:
+    # Connections to one host. At most concurrency requests are in flight
+    # at once, each on a connection of its own, and connections are kept
+    # for the next request when the server allows it.
+    def __init__(self, scheme, host, port, concurrency=HOST_CONCURRENCY,
+                 rate=HOST_RATE, ssl_context=None):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = None
+        if rate > 0:
+            self.rate_limiter = lib.ratelimit.RateLimiter(rate,
+                                                          clock=loop.time)
+        self.loop = loop
+        # (reader, writer, idle since), the most recently used last
+        self.idle = []
+
+    async def get_connection(self):
+        # Returns a connection, and whether it was open already
+        while self.idle:
+            reader, writer, idle_since = self.idle.pop()
+            if (reader.at_eof() or
+                    self.loop.time() - idle_since > KEEPALIVE_SECONDS):
+                writer.close()
+                continue
+            lib.metrics.increment('transport_connections_reused')
+            return reader, writer, True
+        reader, writer = await self.open_connection()
+        return reader, writer, False
+
+    async def open_connection(self):
+        import asyncio
+        connection = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl_context,
+            server_hostname=self.host if self.ssl_context else None
+        )
+        lib.metrics.increment('transport_connections_opened')
+        return connection
+
+    async def send(self, reader, writer, method, target, headers, body):
+        try:
+            # In one write, as a body sent after the head waits on the
+            # server acknowledging it
+            writer.write(get_request_head(method, target, headers, body) +
+                         (body or b''))
+            await writer.drain()
+            status, reason, response_headers, response_body, reusable = (
+                await read_response(reader, method)
+            )
+        except BaseException:
+            writer.close()
+            raise
+        if reusable:
+            self.idle.append((reader, writer, self.loop.time()))
+        else:
+            writer.close()
+        return status, reason, response_headers, response_body
+
+    async def request(self, method, target, headers, body):
+        async with self.semaphore:
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve()
+                if delay > 0:
+                    import asyncio
+                    await asyncio.sleep(delay)
+            reader, writer, reused = await self.get_connection()
+            try:
+                return await self.send(reader, writer, method, target,
+                                       headers, body)
+            except ConnectionError:
+                # A kept connection can be closed by the server just as
+                # it's reused, before it responds, so the request is sent
+                # once more on a new connection
+                if not reused:
+                    raise
+            reader, writer = await self.open_connection()
+            return await self.send(reader, writer, method, target, headers,
+                                   body)
+
+    def close(self):
+        for reader, writer, idle_since in self.idle:
+            writer.close()
+        self.idle = []
+
+
+def get_request_head(method, target, headers, body):
+    lines = ["{} {} HTTP/1.1".format(method, target)]
+    for name, value in headers:
+        lines.append("{}: {}".format(name, value))
+    lines.append("Content-Length: {}".format(len(body or b'')))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+def get_headers(req, netloc):
+    headers = [('Host', netloc), ('Accept-Encoding', 'identity'),
+               ('Connection', 'keep-alive')]
+    for name, value in req.header_items():
+        if name.lower() not in ('host', 'content-length', 'connection',
+                                'transfer-encoding'):
+            headers.append((name, value))
+    return headers
+
+
+class Transport:
+    # Sends requests from any thread on an event loop run by a thread of
+    # its own, kept for as long as the process so its connections outlast
+    # each invocation. Lambda freezes the thread between invocations along
+    # with everything else. asyncio is only imported once the first request
+    # is sent, as it adds a lot to the cold start.
+    def __init__(self, concurrency=HOST_CONCURRENCY, rate=HOST_RATE):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.loop = None
+        self.pools = {}
+        self.ssl_context = None
+        self.lock = threading.Lock()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever,
+                                          name='c7n-notifiers-transport',
+                                          daemon=True)
+                thread.start()
+                self.loop = loop
+            return self.loop
+
+    def get_pool(self, scheme, host, port):
+        # Only called on the loop's thread, so pools are created there
+        key = (scheme, host, port)
+        pool = self.pools.get(key)
+        if pool is None:
+            ssl_context = None
+            if scheme == 'https':
+                if self.ssl_context is None:
+                    import ssl
+                    self.ssl_context = ssl.create_default_context()
+                ssl_context = self.ssl_context
+            pool = HostPool(scheme, host, port, self.concurrency, self.rate,
+                            ssl_context)
+            self.pools[key] = pool
+        return pool
+
+    async def fetch(self, req, timeout=None):
+        import asyncio
+        url = urllib.parse.urlsplit(req.full_url)
+        port = url.port or DEFAULT_PORTS[url.scheme]
+        pool = self.get_pool(url.scheme, url.hostname, port)
+        target = url.path or '/'
+        if url.query:
+            target += '?' + url.query
+        try:
+            status, reason, headers, body = await asyncio.wait_for(
+                pool.request(req.get_method(), target,
+                             get_headers(req, url.netloc), req.data),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out")
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError(
+                "Connection closed by the server mid response"
+            ) from e
+        if status >= 400:
+            raise urllib.error.HTTPError(req.full_url, status, reason,
+                                         headers, io.BytesIO(body))
+        return Response(req.full_url, status, reason, headers, body)
+
+    def urlopen(self, req, timeout=None):
+        # Blocks the calling thread until the response has been read
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(
+            self.fetch(req, timeout), self.get_loop()
+        ).result()
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            # The pools are taken with the loop, so a loop started before
+            # the old one stops keeps the pools it makes
+            loop, pools = self.loop, self.pools
+            self.loop, self.pools = None, {}
+
+        def stop():
+            for pool in pools.values():
+                pool.close()
+            loop.stop()
+        loop.call_soon_threadsafe(stop)
+
+
+_transport = Transport()
+
+
+def can_send(req):
+    # Streamed bodies and requests through a proxy are left to urllib
+    scheme = urllib.parse.urlsplit(req.full_url).scheme
+    return (
+        scheme in DEFAULT_PORTS and
+        (req.data is None or type(req.data) is bytes) and
+        scheme not in urllib.request.getproxies()
+    )
+
+
+def urlopen(req, timeout=None):
+    # In place of urllib.request.urlopen, with the same exceptions for
+    # errors: HTTPError for error responses, OSError for the rest
+    if TRANSPORT != 'asyncio' or not can_send(req):
+        return urllib.request.urlopen(req, timeout=timeout)
+    return _transport.urlopen(req, timeout)
+
+
+def close():
+    # Closes the kept connections and stops the event loop, which is started
+    # again by the next request
+    _transport.close()
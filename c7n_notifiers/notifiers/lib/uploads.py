@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import logging
+import urllib.request
+import zlib
+
+import lib.circuit
+import lib.formatting
+import lib.slack_api
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+UPLOAD_FORMATS = ('csv', 'ndjson')
+CSV_COLUMNS = ('id', 'name', 'creation_datetime', 'creator', 'region', 'url')
+# Rows are encoded into pieces of about this size before being sent, so
+# the request isn't made up of lots of tiny chunks.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def get_row_values(resource):
+    values = []
+    for column in CSV_COLUMNS:
+        value = resource.get(column)
+        if column == 'creation_datetime':
+            value = lib.formatting.format_datetime(value)
+        values.append('' if value is None else value)
+    return values
+
+
+def iter_csv(resources):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for resource in resources:
+        writer.writerow(get_row_values(resource))
+        if buffer.tell() >= UPLOAD_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf8')
+
+
+def iter_ndjson(resources):
+    lines = []
+    size = 0
+    for resource in resources:
+        line = json.dumps(dict(zip(CSV_COLUMNS, get_row_values(resource))))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= UPLOAD_CHUNK_SIZE:
+            yield ("\n".join(lines) + "\n").encode('utf8')
+            lines = []
+            size = 0
+    if lines:
+        yield ("\n".join(lines) + "\n").encode('utf8')
+
+
+def iter_gzip(chunks):
+    # wbits of 31 writes a gzip header and trailer rather than a raw zlib
+    # stream, so the upload can be opened as a .gz file.
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_resource_file(resources, upload_format='csv', compress=False):
+    if upload_format == 'csv':
+        chunks = iter_csv(resources)
+    elif upload_format == 'ndjson':
+        chunks = iter_ndjson(resources)
+    else:
+        raise ValueError(
+            "Upload format must be one of {}, but is {}".format(
+                UPLOAD_FORMATS, upload_format
+            )
+        )
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
+
+
+def iter_multipart(boundary, fields, filename, file_chunks):
+    for name, value in fields.items():
+        yield (
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+            '{}\r\n'.format(boundary, name, value)
+        ).encode('utf8')
+    yield (
+        '--{}\r\nContent-Disposition: form-data; name="file"; '
+        'filename="{}"\r\nContent-Type: application/octet-stream\r\n'
+        '\r\n'.format(boundary, filename)
+    ).encode('utf8')
+    for chunk in file_chunks:
+        yield chunk
+    yield '\r\n--{}--\r\n'.format(boundary).encode('utf8')
+
+
+def get_upload_name(filename, upload_format='csv', compress=False):
+    # The full filename and slack filetype of an upload
+    filename = "{}.{}".format(filename, upload_format)
+    filetype = upload_format
+    if compress:
+        filename += '.gz'
+        filetype = 'gzip'
+    return filename, filetype
+
+
+def upload_resources(channel, resources, filename, title, thread_ts=None,
+                     upload_format='csv', compress=False, token=None):
+    # Upload all the resources as a single file in one files.upload call.
+    # The file is generated while it is sent, using chunked transfer
+    # encoding, so it is never held in memory in full.
+    filename, filetype = get_upload_name(filename, upload_format, compress)
+    logger.debug(
+        "Uploading {} resources to slack channel {} as {}".format(
+            len(resources), channel, filename
+        )
+    )
+    return upload_file(
+        channel,
+        iter_resource_file(resources, upload_format, compress),
+        filename,
+        filetype,
+        title,
+        thread_ts=thread_ts,
+        token=token
+    )
+
+
+def upload_file(channel, file_chunks, filename, filetype, title,
+                thread_ts=None, token=None):
+    fields = {
+        'channels': channel,
+        'filename': filename,
+        'filetype': filetype,
+        'title': title
+    }
+    if thread_ts:
+        fields['thread_ts'] = thread_ts
+
+    # uuid is slow to import on older Pythons and is only needed here
+    import uuid
+    boundary = uuid.uuid4().hex
+    body = iter_multipart(boundary, fields, filename, file_chunks)
+    # urllib sends an iterable body with chunked transfer encoding as long
+    # as no Content-Length is given.
+    req = urllib.request.Request(
+        lib.slack_api.API_URL + 'files.upload',
+        headers={
+            'content-type': 'multipart/form-data; boundary={}'.format(
+                boundary
+            ),
+            'authorization': 'Bearer {}'.format(
+                lib.slack_api.get_token(token)
+            ),
+            'transfer-encoding': 'chunked'
+        },
+        data=body
+    )
+    response = lib.circuit.urlopen(req)
+    result = json.loads(response.read().decode('utf8'))
+    if not result.get('ok'):
+        raise RuntimeError(
+            "Slack API files.upload call failed: {}".format(
+                result.get('error')
+            )
+        )
+    return result
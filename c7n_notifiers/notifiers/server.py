@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# Runs the notifier as a long-running HTTP service, for accounts that can't
+# use Lambda, subscribed to the SNS topic with an HTTP or HTTPS
+# subscription. Notifications are queued and handed to lambda_handler by a
+# pool of worker threads, as Lambda would invoke it, so the mappings,
+# templates, routes and connections warmed by one message are there for
+# every later one. SNS is told a notification was received once it's queued,
+# so the server retries the ones that fail itself, as SNS would for Lambda.
+#
+#   python3 server.py --port 8080
+import argparse
+import heapq
+import http.server
+import json
+import logging
+import os
+import queue
+import re
+import signal
+import socketserver
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import lib.circuit
+import lib.metrics
+import lib.resources
+import lib.spill
+import lib.templates
+import lib.transport
+import slack_notifier
+
+logger = logging.getLogger('c7n_notifiers')
+logger.setLevel(logging.INFO)
+
+# Notifications handled at once
+SERVER_WORKERS = int(os.environ.get('C7N_NOTIFIERS_SERVER_WORKERS', 4))
+# Notifications waiting for a worker before SNS is told to retry later
+SERVER_QUEUE_SIZE = int(
+    os.environ.get('C7N_NOTIFIERS_SERVER_QUEUE_SIZE', 100)
+)
+# Seconds each notification can take, in place of the Lambda timeout
+SERVER_MESSAGE_TIMEOUT = float(
+    os.environ.get('C7N_NOTIFIERS_SERVER_MESSAGE_TIMEOUT', 60)
+)
+# Seconds given to the queued notifications after SIGTERM
+SERVER_DRAIN_SECONDS = float(
+    os.environ.get('C7N_NOTIFIERS_SERVER_DRAIN_SECONDS', 30)
+)
+# Topics to accept messages from, separated by commas, or any when empty.
+# Message signatures aren't checked, so set this when the server can be
+# reached by anything but SNS.
+SERVER_TOPIC_ARNS = [
+    arn.strip()
+    for arn in os.environ.get('C7N_NOTIFIERS_SERVER_TOPIC_ARNS',
+                              '').split(',')
+    if arn.strip()
+]
+# Where queued notifications are kept until they've been handled, so those
+# that fail, or are still queued when the server stops, aren't lost. Each
+# server needs a directory of its own.
+SERVER_PENDING_DIRECTORY = os.environ.get(
+    'C7N_NOTIFIERS_SERVER_PENDING_DIRECTORY', '/tmp/c7n_notifiers/pending'
+)
+# Times a notification is handled before it's moved to the dead letters
+SERVER_MAX_ATTEMPTS = int(
+    os.environ.get('C7N_NOTIFIERS_SERVER_MAX_ATTEMPTS', 5)
+)
+# Seconds before a failed notification is retried, doubled for each attempt
+SERVER_RETRY_SECONDS = float(
+    os.environ.get('C7N_NOTIFIERS_SERVER_RETRY_SECONDS', 10)
+)
+# Seconds SNS is asked to wait before retrying when the queue is full
+RETRY_AFTER_SECONDS = 5
+# SNS messages are at most 256KiB, this leaves room for the envelope
+MAX_BODY_BYTES = 1024 * 1024
+# Subscriptions are only confirmed through SNS's own endpoints
+SNS_HOST = re.compile(r'^sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?$')
+
+NOTIFICATION = 'Notification'
+SUBSCRIPTION_CONFIRMATION = 'SubscriptionConfirmation'
+UNSUBSCRIBE_CONFIRMATION = 'UnsubscribeConfirmation'
+PENDING_SUFFIX = '.json'
+DEAD_DIRECTORY = 'dead'
+
+
+class MessageContext:
+    # The part of a Lambda context the handler uses. Its time starts when a
+    # worker takes the notification off the queue, and is cut short while
+    # the server drains so what can't be sent in time is spooled.
+    def __init__(self, server, message_id, timeout=SERVER_MESSAGE_TIMEOUT):
+        self.server = server
+        self.aws_request_id = message_id
+        self.end = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        end = self.end
+        if self.server.drain_end is not None:
+            end = min(end, self.server.drain_end)
+        return max(0, int((end - time.monotonic()) * 1000))
+
+
+def get_sns_event(envelope):
+    # The event SNS would invoke lambda_handler with for the notification
+    return {
+        'Records': [{
+            'EventSource': 'aws:sns',
+            'EventSubscriptionArn': envelope.get('SubscriptionArn'),
+            'Sns': {
+                'Type': NOTIFICATION,
+                'MessageId': envelope.get('MessageId'),
+                'TopicArn': envelope.get('TopicArn'),
+                'Subject': envelope.get('Subject'),
+                'Message': envelope['Message'],
+                'Timestamp': envelope.get('Timestamp')
+            }
+        }]
+    }
+
+
+def get_envelope(headers, body):
+    # The SNS message posted, from its JSON body, or from its headers when
+    # the subscription has raw message delivery enabled, in which case the
+    # body is the message
+    if headers.get('x-amz-sns-rawdelivery', '').lower() == 'true':
+        return {
+            'Type': headers.get('x-amz-sns-message-type', NOTIFICATION),
+            'MessageId': headers.get('x-amz-sns-message-id'),
+            'TopicArn': headers.get('x-amz-sns-topic-arn'),
+            'SubscriptionArn': headers.get('x-amz-sns-subscription-arn'),
+            'Message': body.decode('utf8')
+        }
+    envelope = json.loads(body.decode('utf8'))
+    if type(envelope) is not dict:
+        raise ValueError("SNS message must be a JSON object")
+    return envelope
+
+
+def confirm_subscription(envelope):
+    # SNS posts a SubscriptionConfirmation when the subscription is made,
+    # which is confirmed by fetching its SubscribeURL
+    subscribe_url = envelope.get('SubscribeURL') or ''
+    url = urllib.parse.urlsplit(subscribe_url)
+    if url.scheme != 'https' or not SNS_HOST.match(url.hostname or ''):
+        raise ValueError(
+            "SubscribeURL {!r} isn't an SNS endpoint".format(subscribe_url)
+        )
+    lib.circuit.urlopen(urllib.request.Request(subscribe_url)).read()
+    logger.info("Confirmed subscription to {}".format(
+        envelope.get('TopicArn')
+    ))
+
+
+class PendingNotifications:
+    # A file for each queued notification, with the attempts made to handle
+    # it, written before SNS is told it was received and removed once it
+    # has been handled. Those that run out of attempts are moved to dead/.
+    def __init__(self, path=SERVER_PENDING_DIRECTORY):
+        self.path = path
+
+    def get_path(self, pending_id):
+        return os.path.join(self.path, pending_id + PENDING_SUFFIX)
+
+    def put(self, notification):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self.get_path(notification['id'])
+        # Written under a temporary name so a partly written file is never
+        # loaded as a notification
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'w') as pending_file:
+            json.dump(notification, pending_file)
+            pending_file.flush()
+            os.fsync(pending_file.fileno())
+        os.replace(temporary_path, file_path)
+
+    def add(self, envelope):
+        notification = {
+            'id': lib.spill.get_spill_id(),
+            'envelope': envelope,
+            'attempts': 0,
+            'received': time.time()
+        }
+        self.put(notification)
+        return notification
+
+    def remove(self, notification):
+        os.remove(self.get_path(notification['id']))
+
+    def bury(self, notification):
+        # Written with the attempt that used up the last of them
+        PendingNotifications(
+            os.path.join(self.path, DEAD_DIRECTORY)
+        ).put(notification)
+        self.remove(notification)
+
+    def load(self):
+        # The notifications left by the last server, oldest first. Ids only
+        # sort by the second they were made in.
+        try:
+            names = sorted(os.listdir(self.path))
+        except FileNotFoundError:
+            return []
+        notifications = []
+        for name in names:
+            if not name.endswith(PENDING_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as pending_file:
+                    notifications.append(json.load(pending_file))
+            except (OSError, ValueError):
+                logger.exception("Unable to load pending notification "
+                                 "{}".format(name))
+        notifications.sort(
+            key=lambda notification: notification.get('received', 0)
+        )
+        return notifications
+
+
+def warm():
+    # Loads what the first notification would otherwise wait on
+    lib.resources.get_all_mappings()
+    lib.templates.get_environment()
+
+
+class NotifierServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers=SERVER_WORKERS,
+                 queue_size=SERVER_QUEUE_SIZE, topic_arns=SERVER_TOPIC_ARNS,
+                 pending=None, max_attempts=SERVER_MAX_ATTEMPTS,
+                 retry_seconds=SERVER_RETRY_SECONDS):
+        super().__init__(address, NotifierRequestHandler)
+        self.queue = queue.Queue(queue_size)
+        self.topic_arns = topic_arns
+        self.pending = PendingNotifications() if pending is None else pending
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        # (due, order, notification) of those to be handled again, kept out
+        # of the queue so retries don't take the place of new notifications
+        self.retries = []
+        self.retry_order = 0
+        self.workers = [
+            threading.Thread(target=self.work,
+                             name='c7n-notifiers-worker-{}'.format(number),
+                             daemon=True)
+            for number in range(workers)
+        ]
+        self.lock = threading.Lock()
+        self.draining = False
+        self.drain_end = None
+        self.stopping = threading.Event()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        left = self.pending.load()
+        if left:
+            logger.info("Handling {} notifications left by the last "
+                        "server".format(len(left)))
+        for notification in left:
+            self.retry(notification, 0)
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self.serve_forever,
+                         name='c7n-notifiers-server', daemon=True).start()
+
+    def accepts_topic(self, topic_arn):
+        return not self.topic_arns or topic_arn in self.topic_arns
+
+    def enqueue(self, envelope):
+        # Whether the notification was queued, False when the queue is full,
+        # the server is draining or it couldn't be kept until it's handled
+        with self.lock:
+            if self.draining:
+                return False
+            if self.queue.full():
+                lib.metrics.increment('server_queue_full')
+                return False
+            try:
+                notification = self.pending.add(envelope)
+            except OSError:
+                logger.exception("Unable to keep SNS message {}".format(
+                    envelope.get('MessageId')
+                ))
+                return False
+            self.queue.put_nowait(notification)
+        return True
+
+    def retry(self, notification, delay):
+        with self.lock:
+            self.retry_order += 1
+            heapq.heappush(self.retries, (time.monotonic() + delay,
+                                          self.retry_order, notification))
+
+    def get_retry(self):
+        # The first retry that's due, if any
+        with self.lock:
+            if self.retries and self.retries[0][0] <= time.monotonic():
+                return heapq.heappop(self.retries)[2]
+            return None
+
+    def work(self):
+        while True:
+            notification = self.get_retry()
+            if notification is not None:
+                self.handle_notification(notification)
+                continue
+            try:
+                notification = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            try:
+                self.handle_notification(notification)
+            finally:
+                self.queue.task_done()
+
+    def handle_notification(self, notification):
+        envelope = notification['envelope']
+        message_id = envelope.get('MessageId')
+        try:
+            summary = slack_notifier.lambda_handler(
+                get_sns_event(envelope), MessageContext(self, message_id)
+            )
+            logger.info("Handled SNS message {}: {}".format(message_id,
+                                                           summary))
+        except Exception:
+            lib.metrics.increment('server_messages_failed')
+            logger.exception("Unable to handle SNS message {}".format(
+                message_id
+            ))
+            self.handle_failure(notification)
+            return
+        try:
+            self.pending.remove(notification)
+        except OSError:
+            logger.exception("Unable to remove handled SNS message {}, it "
+                             "may be handled again".format(message_id))
+
+    def handle_failure(self, notification):
+        # Failures while draining are down to the drain, and the
+        # notification is handled again when the server next starts
+        if self.draining:
+            return
+        notification['attempts'] += 1
+        message_id = notification['envelope'].get('MessageId')
+        try:
+            if notification['attempts'] >= self.max_attempts:
+                self.pending.bury(notification)
+                lib.metrics.increment('server_messages_dead')
+                logger.error(
+                    "Gave up on SNS message {} after {} attempts, it's in "
+                    "{}".format(message_id, notification['attempts'],
+                                os.path.join(self.pending.path,
+                                             DEAD_DIRECTORY))
+                )
+                return
+            self.pending.put(notification)
+        except OSError:
+            logger.exception("Unable to record the attempt at SNS message "
+                             "{}".format(message_id))
+        self.retry(notification, self.retry_seconds *
+                   2 ** (notification['attempts'] - 1))
+
+    def drain(self, seconds=SERVER_DRAIN_SECONDS):
+        # Stops accepting notifications and gives the workers seconds to
+        # handle the queued ones. Called from another thread than the one
+        # serving requests.
+        with self.lock:
+            self.draining = True
+            self.drain_end = time.monotonic() + seconds
+        logger.info("Draining {} queued notifications".format(
+            self.queue.qsize()
+        ))
+        self.shutdown()
+        self.server_close()
+        self.stopping.set()
+        for worker in self.workers:
+            # The workers' deadlines end with the drain, a little more lets
+            # them spool what they couldn't send
+            worker.join(max(0.0, self.drain_end - time.monotonic()) + 1)
+        with self.lock:
+            left = [notification for _, _, notification in self.retries]
+        while True:
+            try:
+                left.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if left:
+            logger.warning(
+                "{} notifications weren't handled, they're kept in {} until "
+                "the server next starts: {}".format(
+                    len(left), self.pending.path,
+                    ", ".join(str(notification['envelope'].get('MessageId'))
+                              for notification in left)
+                )
+            )
+        lib.transport.close()
+
+
+class NotifierRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Responses are sent in one write, see devtools/slack_standin.py
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        logger.debug("{} {}".format(self.address_string(), format % args))
+
+    def respond(self, status, result, headers=()):
+        body = json.dumps(result).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.respond(404, {'error': "Not found"})
+            return
+        self.respond(503 if self.server.draining else 200, {
+            'queued': self.server.queue.qsize(),
+            'draining': self.server.draining
+        })
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            # The body is left unread, so the connection can't be reused
+            self.close_connection = True
+            self.respond(413, {'error': "Body must be up to {} bytes".format(
+                MAX_BODY_BYTES
+            )})
+            return
+        body = self.rfile.read(length)
+        try:
+            envelope = get_envelope(self.headers, body)
+        except ValueError as e:
+            self.respond(400, {'error': "Not an SNS message: {}".format(e)})
+            return
+        if not self.server.accepts_topic(envelope.get('TopicArn')):
+            logger.warning("Refused SNS message from topic {}".format(
+                envelope.get('TopicArn')
+            ))
+            self.respond(403, {'error': "Topic not accepted"})
+            return
+
+        message_type = envelope.get('Type')
+        if message_type == NOTIFICATION and 'Message' in envelope:
+            if self.server.enqueue(envelope):
+                self.respond(202, {'queued': envelope.get('MessageId')})
+            else:
+                self.respond(503, {'error': "Queue is full or draining"},
+                             [('Retry-After', str(RETRY_AFTER_SECONDS))])
+        elif message_type == SUBSCRIPTION_CONFIRMATION:
+            try:
+                confirm_subscription(envelope)
+            except ValueError as e:
+                self.respond(400, {'error': str(e)})
+            except Exception as e:
+                logger.exception("Unable to confirm subscription to "
+                                 "{}".format(envelope.get('TopicArn')))
+                self.respond(502, {'error': str(e)})
+            else:
+                self.respond(200, {'confirmed': envelope.get('TopicArn')})
+        elif message_type == UNSUBSCRIBE_CONFIRMATION:
+            logger.info("Unsubscribed from {}".format(
+                envelope.get('TopicArn')
+            ))
+            self.respond(200, {})
+        else:
+            self.respond(400, {'error': "Unexpected SNS message type "
+                                        "{!r}".format(message_type)})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the notifier as an HTTP endpoint for SNS "
+                    "subscriptions"
+    )
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--certfile',
+                        help="Certificate chain to serve HTTPS with")
+    parser.add_argument('--keyfile',
+                        help="Private key of the certificate, if it isn't "
+                             "in the certfile")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--queue-size', type=int, default=SERVER_QUEUE_SIZE)
+    parser.add_argument('--pending-directory',
+                        default=SERVER_PENDING_DIRECTORY,
+                        help="Where queued notifications are kept until "
+                             "they've been handled")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger.setLevel(args.log_level.upper())
+    warm()
+
+    server = NotifierServer((args.host, args.port), args.workers,
+                            args.queue_size,
+                            pending=PendingNotifications(
+                                args.pending_directory
+                            ))
+    if args.certfile:
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.certfile, args.keyfile)
+        # The handshake is left to each request's thread, so a slow client
+        # doesn't hold up accepting the others
+        server.socket = context.wrap_socket(server.socket, server_side=True,
+                                            do_handshake_on_connect=False)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    server.start()
+    logger.info("Listening for SNS messages on {}:{} with {} workers".format(
+        args.host, args.port, args.workers
+    ))
+    # Waits with a timeout so the signal handlers get to run
+    while not stop.wait(1):
+        pass
+    server.drain()
+    lib.metrics.log_metrics()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,100 @@
 #!/usr/bin/env python3
+import base64
 from datetime import datetime
+import functools
 import json
-import os
 import logging
+import os
+import time
 import traceback
 import urllib.request
 
-import jinja2
-
+import lib.blocks
+import lib.circuit
+import lib.deadline
+import lib.delivery
+import lib.formatting
+import lib.idempotency
 import lib.messaging
+import lib.metrics
+import lib.ratelimit
 import lib.resources
+import lib.routing
+import lib.slack_api
+import lib.spill
+import lib.spool
+import lib.templates
+import lib.uploads
 
 logger = logging.getLogger('c7n_notifiers')
 logger.setLevel(logging.DEBUG)
 
+# Bound on the traceback in error messages
+MAX_TRACEBACK_CHARACTERS = 3000
+# Number of records in an SQS batch processed at once by sqs_handler
+SQS_CONCURRENCY = int(os.environ.get('C7N_NOTIFIERS_SQS_CONCURRENCY', 4))
+# Number of spooled payloads each invocation tries to deliver along with
+# its own messages, 0 leaves them to replay_handler
+REPLAY_LIMIT = int(os.environ.get('C7N_NOTIFIERS_REPLAY_LIMIT', 10))
+# Keys of replayed deliveries start with this, so they never match a message
+SPOOL_KEY_PREFIX = 'spool:'
 
-def send_slack_message(webhook_url, message_dict):
+
+def get_message_body(message_dict):
     if type(message_dict) is not dict:
         raise TypeError(
-            "Slack message must be dict, but is {}".format(type(message))
+            "Slack message must be dict, but is {}".format(type(message_dict))
         )
 
     footer_text = "{} - All times in UTC".format(
         datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
     )
 
+    if message_dict.get('suppressed'):
+        footer_text += " - {} muted resource{}".format(
+            message_dict['suppressed'],
+            "" if message_dict['suppressed'] == 1 else "s"
+        )
+
     color = message_dict.get('color', '#6d6c6c')
 
-    message_body = {
-        'attachments': [
-            {
-                'color': color,
-                'footer': footer_text,
-                'text': message_dict['text'],
-                'title': message_dict['title']
-            }
+    if message_dict.get('blocks'):
+        # Block Kit messages are sent inside an attachment so they keep the
+        # color bar. The footer becomes a context block as legacy attachment
+        # fields aren't shown alongside blocks.
+        blocks = message_dict['blocks'] + [
+            lib.blocks.get_context_block(footer_text)
         ]
-    }
+        message_body = {
+            'text': message_dict['title'],
+            'attachments': [
+                {
+                    'color': color,
+                    'fallback': message_dict['title'],
+                    'blocks': blocks
+                }
+            ]
+        }
+    else:
+        message_body = {
+            'attachments': [
+                {
+                    'color': color,
+                    'footer': footer_text,
+                    'text': message_dict['text'],
+                    'title': message_dict['title']
+                }
+            ]
+        }
 
+    return message_body
+
+
+def send_slack_message(webhook_url, message_dict):
+    post_webhook_message(webhook_url, get_message_body(message_dict))
+
+
+def post_webhook_message(webhook_url, message_body):
     logger.debug(
         "Sending message to slack webhook {}: {}".format(webhook_url,
                                                          message_body)
@@ -48,36 +105,105 @@ def send_slack_message(webhook_url, message_dict):
     req = urllib.request.Request(webhook_url,
                                  headers={'content-type': 'application/json'},
                                  data=post_data)
-    response = urllib.request.urlopen(req)
+    response = lib.circuit.urlopen(req)
     logger.debug("Message response: {}".format(response))
 
 
+def deliver_slack_message(destination, message_dict, thread_ts=None):
+    # Destinations are either a webhook url or a slack:// channel sent
+    # through the Web API. Returns the ts of Web API messages so replies can
+    # be threaded under them.
+    if not lib.slack_api.is_api_destination(destination):
+        send_slack_message(destination, message_dict)
+        return None
+    response = lib.slack_api.post_message(
+        lib.slack_api.get_channel(destination),
+        get_message_body(message_dict),
+        thread_ts=thread_ts
+    )
+    return response['ts']
+
+
+def get_reply_rate_limiter():
+    # The rate limiter of the destination being delivered to, which the
+    # scheduler waited on before the first message was posted, see
+    # lib/ratelimit.py. Without a scheduler, one whose first token has gone
+    # to that message.
+    rate_limiter = lib.ratelimit.get_current()
+    if rate_limiter is None:
+        rate_limiter = lib.ratelimit.RateLimiter(
+            lib.slack_api.POST_MESSAGE_RATE
+        )
+        rate_limiter.reserve()
+    return rate_limiter
+
+
+def send_threaded_slack_messages(destination, message_data, progress=None):
+    # Send a short summary to the channel and the full list of resources as
+    # replies in its thread. The summary is sent while the details are
+    # rendered, then the replies are sent under the channel rate limit.
+    # progress is updated as each is sent, see send_resource_messages.
+    import concurrent.futures
+    if progress is None:
+        progress = {'sent': 0}
+    summary_message = format_slack_summary_message(message_data)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        summary_future = executor.submit(
+            lib.deadline.bind(deliver_slack_message),
+            destination,
+            summary_message
+        )
+        detail_messages = format_slack_detail_messages(message_data)
+        thread_ts = summary_future.result()
+    progress.update(sent=1, thread_ts=thread_ts)
+
+    rate_limiter = get_reply_rate_limiter()
+    for index, detail_message in enumerate(detail_messages):
+        rate_limiter.wait()
+        deliver_slack_message(destination, detail_message, thread_ts=thread_ts)
+        progress['sent'] = index + 2
+
+
+def render_template(template_name, template_info):
+    return lib.templates.render(template_name, template_info)
+
+
+def get_message_color(policy):
+    actions = set()
+    for action_item in policy['actions']:
+        if type(action_item) is dict:
+            # If there is an op sepcified add that, otherwise add the type
+            action = action_item.get('op', action_item['type'])
+            actions.add(action)
+        else:
+            actions.add(action_item)
+
+    danger_actions = {'delete', 'terminate'}
+    if actions.intersection(danger_actions):
+        return 'danger'
+    return 'warning'
+
+
 def format_exception_message(c7n_message, exception):
+    # Messages can be megabytes, so only a preview goes to slack and the
+    # whole message is spilled to where it can be looked at later.
     tb = ''.join(traceback.format_exception(
-        etype=type(exception),
-        value=exception,
-        tb=exception.__traceback__)
+        type(exception),
+        exception,
+        exception.__traceback__)
     )
-
-    # format JSON to something better readable in the slack message
-    formatted_c7n_message = json.dumps(c7n_message, indent=4)
+    if len(tb) > MAX_TRACEBACK_CHARACTERS:
+        # The end of a traceback is the most useful part
+        tb = "…" + tb[-(MAX_TRACEBACK_CHARACTERS - 1):]
 
     slack_message_info = {
         'traceback': tb,
-        'c7n_message': formatted_c7n_message
+        'c7n_message': lib.messaging.get_message_preview(c7n_message),
+        'spill_location': lib.spill.spill_message(c7n_message)
     }
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    template_path = current_dir + "/templates"
-    subject_template = 'exception.subject'
-    body_template = 'exception.body'
-    jinja_env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_path)
-    )
-    slack_subject_template = jinja_env.get_template(subject_template)
-    slack_subject = slack_subject_template.render(**slack_message_info)
-    slack_body_template = jinja_env.get_template(body_template)
-    slack_body = slack_body_template.render(**slack_message_info)
+    slack_subject = render_template('exception.subject', slack_message_info)
+    slack_body = render_template('exception.body', slack_message_info)
 
     slack_message = {
         'title': slack_subject,
@@ -89,118 +215,350 @@ def format_exception_message(c7n_message, exception):
 
 
 def format_slack_resource_message(message_data):
+    # When there are too many resources to render they are uploaded as a
+    # file, so the message is only a summary.
+    if message_data['overflow']:
+        return format_slack_summary_message(message_data)
+
     # Formatting resource info in Python since slack doesn't support robust
     # formatting.
-    formatted_lines = []
-    resource_id_pad = 22
-    resource_name_pad = 15
-    creation_dt_pad = 19
-    creator_pad = 12
-    line_layout = (
-        "{:<{resource_id_pad}}  {:<{resource_name_pad}}  "
-        "{:<{creation_dt_pad}}  {:<{creator_pad}}"
+    formatted_resources = lib.formatting.format_resource_table(
+        message_data['resources']
     )
-    header_line = line_layout.format("ResourceId",
-                                     "ResourceName",
-                                     "CreationDateTime",
-                                     "Creator",
-                                     resource_id_pad=resource_id_pad,
-                                     resource_name_pad=resource_name_pad,
-                                     creation_dt_pad=creation_dt_pad,
-                                     creator_pad=creator_pad
-                                     )
-    formatted_lines.append(header_line)
-    for resource_info in message_data['resources']:
-        # Padding needs to be calculated for each resource id as slack renders
-        # the link, which removes many characters on screen,
-        # so need to add white space to compensate the removal of characters
-        # when rendered.
-        resource_pad = resource_id_pad
-        if resource_info.get('url'):
-            resource = resource_info['id'][:resource_id_pad]
-            resource_url = resource_info['url']
-            resource_link = '<{}|{}>'.format(resource_url, resource)
-            resource_pad = (
-                len(resource_link) - len(resource) + resource_id_pad
-            )
-            resource = resource_link
-        else:
-            resource = resource_info['id'][:resource_id_pad]
 
-        name = resource_info['name'][:resource_name_pad]
+    slack_message_info = {
+        'resource_type': message_data['resource_type'],
+        'region': message_data['region'],
+        'account_info': message_data['account_info'],
+        'resources': formatted_resources
+    }
 
-        datetime_string = resource_info['creation_datetime'].strftime(
-            '%Y-%m-%d %H:%M:%S'
-        )
-        creator = resource_info['creator'][:creator_pad]
-
-        formatted_lines.append(
-            line_layout.format(resource,
-                               name,
-                               datetime_string,
-                               creator,
-                               resource_id_pad=resource_pad,
-                               resource_name_pad=resource_name_pad,
-                               creation_dt_pad=creation_dt_pad,
-                               creator_pad=creator_pad
-                               )
-        )
+    template = message_data['message_template']
+    slack_subject = render_template(template + '.subject',
+                                    slack_message_info)
+    slack_body = render_template(template + '.body', slack_message_info)
 
+    color = get_message_color(message_data['policy'])
+
+    slack_message = {
+        'title': slack_subject,
+        'text': slack_body,
+        'color': color,
+        'suppressed': message_data['suppressed']
+    }
+
+    return slack_message
+
+
+def format_slack_block_messages(message_data):
+    # Block Kit alternative to format_slack_resource_message. The resources
+    # are rendered as section fields, paginated over as many messages as
+    # needed to stay within slack's block and character limits. The
+    # template's .blocks file is used in place of its .body file.
     slack_message_info = {
         'resource_type': message_data['resource_type'],
         'region': message_data['region'],
-        'account_info': message_data['account_info'],
-        'resources': "\n".join(formatted_lines)
+        'account_info': message_data['account_info']
     }
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    template_path = current_dir + "/templates"
-    subject_template = message_data['message_template'] + '.subject'
-    body_template = message_data['message_template'] + '.body'
-    jinja_env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_path)
-    )
-    slack_subject_template = jinja_env.get_template(
-        subject_template
-    )
-    slack_subject = slack_subject_template.render(**slack_message_info)
-    slack_body_template = jinja_env.get_template(
-        body_template
-    )
-    slack_body = slack_body_template.render(**slack_message_info)
+    template = message_data['message_template']
+    slack_subject = render_template(template + '.subject',
+                                    slack_message_info)
+    slack_intro = render_template(template + '.blocks', slack_message_info)
 
-    actions = set()
-    for action_item in message_data['policy']['actions']:
-        if type(action_item) is dict:
-            # If there is an op sepcified add that, otherwise add the type
-            action = action_item.get('op', action_item['type'])
-            actions.add(action)
-        else:
-            actions.add(action_item)
+    color = get_message_color(message_data['policy'])
+
+    slack_messages = []
+    pages = lib.blocks.format_resource_pages(slack_subject,
+                                             slack_intro,
+                                             message_data['resources'])
+    for blocks in pages:
+        slack_messages.append({
+            'title': slack_subject,
+            'blocks': blocks,
+            'color': color,
+            'suppressed': message_data['suppressed']
+        })
+
+    return slack_messages
 
-    danger_actions = {'delete', 'terminate'}
-    if actions.intersection(danger_actions):
-        color = 'danger'
-    else:
-        color = 'warning'
+
+def format_slack_summary_message(message_data):
+    slack_message_info = {
+        'resource_type': message_data['resource_type'],
+        'region': message_data['region'],
+        'account_info': message_data['account_info'],
+        'resource_count': len(message_data['resources'])
+    }
+
+    template = message_data['message_template']
+    slack_subject = render_template(template + '.subject',
+                                    slack_message_info)
+    slack_body = render_template(template + '.summary', slack_message_info)
 
     slack_message = {
         'title': slack_subject,
         'text': slack_body,
-        'color': color
+        'color': get_message_color(message_data['policy']),
+        'suppressed': message_data['suppressed']
     }
 
     return slack_message
 
 
-def lambda_handler(event, context):
-    encoded_message = event['Records'][0]['Sns']['Message']
-    logger.debug(
-        "Received encoded message from Cloud Custodian: {}".format(
-            encoded_message
-        )
+def format_slack_detail_messages(message_data):
+    # The thread replies for send_threaded_slack_messages. These only carry
+    # the resources, the summary has everything else.
+    if message_data['message_format'] == 'blocks':
+        return format_slack_block_messages(message_data)
+
+    color = get_message_color(message_data['policy'])
+    table = lib.formatting.format_resource_table(message_data['resources'])
+    slack_messages = []
+    for chunk in lib.formatting.split_resource_table(table):
+        slack_messages.append({
+            'title': '',
+            'text': "```\n{}\n```".format(chunk),
+            'color': color,
+            'suppressed': message_data['suppressed']
+        })
+
+    return slack_messages
+
+
+def format_slack_messages(message_data):
+    if (message_data['message_format'] == 'blocks' and
+            not message_data['overflow']):
+        return format_slack_block_messages(message_data)
+    return [format_slack_resource_message(message_data)]
+
+
+def send_overflow_slack_messages(destination, message_data, progress=None):
+    # Post the summary, then upload every resource as a file in its thread
+    if progress is None:
+        progress = {'sent': 0}
+    summary_message = format_slack_resource_message(message_data)
+    thread_ts = deliver_slack_message(destination, summary_message)
+    progress.update(sent=1, thread_ts=thread_ts)
+    filename = "{}-{}-{}".format(message_data['policy']['name'],
+                                 message_data['resource_type'],
+                                 message_data['region'])
+    lib.uploads.upload_resources(
+        lib.slack_api.get_channel(destination),
+        message_data['resources'],
+        filename,
+        summary_message['title'],
+        thread_ts=thread_ts,
+        upload_format=message_data['overflow_format'],
+        compress=message_data['overflow_gzip']
     )
-    c7n_message = lib.messaging.decode_message(encoded_message)
+
+
+def send_resource_messages(destination, message_data, progress=None):
+    # progress, if given, is updated with how many of the messages
+    # get_spool_payload would render have been sent, and the ts of the
+    # thread they're in, so a delivery that runs out of time part way is
+    # spooled without what it had sent
+    if progress is None:
+        progress = {'sent': 0}
+    if not lib.slack_api.is_api_destination(destination):
+        if message_data['overflow']:
+            logger.warning(
+                "Resources can only be uploaded to slack:// destinations, "
+                "sending them in the message instead."
+            )
+            message_data['overflow'] = False
+        for index, slack_message in enumerate(
+                format_slack_messages(message_data)):
+            send_slack_message(destination, slack_message)
+            progress['sent'] = index + 1
+    elif message_data['overflow']:
+        send_overflow_slack_messages(destination, message_data, progress)
+    else:
+        send_threaded_slack_messages(destination, message_data, progress)
+
+
+def get_spool_payload(destination, message_data, progress=None):
+    # Renders everything send_resource_messages would send as slack message
+    # bodies, for deliveries that are spooled rather than sent. On Web API
+    # destinations the first message is posted to the channel and the rest,
+    # along with any upload, in its thread. progress is what
+    # send_resource_messages sent before the delivery was deferred, which
+    # replaying the payload carries on from.
+    api_destination = lib.slack_api.is_api_destination(destination)
+    payload = {
+        'destination': destination,
+        'severity': get_message_color(message_data['policy']),
+        'threaded': api_destination
+    }
+    if not api_destination:
+        message_data = dict(message_data, overflow=False)
+        slack_messages = format_slack_messages(message_data)
+    elif message_data['overflow']:
+        summary_message = format_slack_resource_message(message_data)
+        slack_messages = [summary_message]
+        filename = "{}-{}-{}".format(message_data['policy']['name'],
+                                     message_data['resource_type'],
+                                     message_data['region'])
+        content = b''.join(lib.uploads.iter_resource_file(
+            message_data['resources'],
+            message_data['overflow_format'],
+            message_data['overflow_gzip']
+        ))
+        payload['upload'] = {
+            'filename': filename,
+            'title': summary_message['title'],
+            'format': message_data['overflow_format'],
+            'compress': message_data['overflow_gzip'],
+            'content': base64.b64encode(content).decode('ascii')
+        }
+    else:
+        slack_messages = [format_slack_summary_message(message_data)]
+        slack_messages.extend(format_slack_detail_messages(message_data))
+    payload['messages'] = [
+        get_message_body(slack_message) for slack_message in slack_messages
+    ]
+    if progress and progress['sent']:
+        payload['progress'] = dict(progress)
+    return payload
+
+
+def send_spooled_payload(payload, progress=None, save_progress=None):
+    # Sends a payload from get_spool_payload. progress is what an earlier
+    # attempt sent, which isn't sent again, and save_progress is called
+    # with the progress after every post. Without one, the payload carries
+    # on from what was sent before it was spooled.
+    progress = dict(progress or payload.get('progress') or {'sent': 0})
+
+    def advance(**changes):
+        progress.update(changes)
+        if save_progress is not None:
+            save_progress(progress)
+
+    destination = payload['destination']
+    if not payload['threaded']:
+        for index, message_body in enumerate(payload['messages']):
+            if index < progress['sent']:
+                continue
+            post_webhook_message(destination, message_body)
+            advance(sent=index + 1)
+        return
+
+    channel = lib.slack_api.get_channel(destination)
+    rate_limiter = get_reply_rate_limiter()
+    thread_ts = progress.get('thread_ts')
+    first_index = progress['sent']
+    for index, message_body in enumerate(payload['messages']):
+        if index < first_index:
+            continue
+        if index > first_index:
+            rate_limiter.wait()
+        response = lib.slack_api.post_message(channel, message_body,
+                                              thread_ts=thread_ts)
+        if thread_ts is None:
+            thread_ts = response['ts']
+        advance(sent=index + 1, thread_ts=thread_ts)
+    upload = payload.get('upload')
+    if upload:
+        filename, filetype = lib.uploads.get_upload_name(
+            upload['filename'], upload['format'], upload['compress']
+        )
+        lib.uploads.upload_file(
+            channel,
+            [base64.b64decode(upload['content'])],
+            filename,
+            filetype,
+            upload['title'],
+            thread_ts=thread_ts
+        )
+
+
+def save_replay_progress(spool, entry, progress):
+    # Losing the progress only means some messages may be sent twice, so it
+    # doesn't fail the replay
+    entry['progress'] = dict(progress)
+    try:
+        spool.update(entry, entry['progress'])
+    except Exception:
+        logger.exception("Unable to save the progress of spooled delivery "
+                         "{}".format(entry['id']))
+
+
+def release_spooled(spool, entry, error=None):
+    try:
+        spool.release(entry, error)
+    except Exception:
+        logger.exception("Unable to release spooled delivery {}, it will "
+                         "be replayed once its claim runs out".format(
+                             entry['id']
+                         ))
+
+
+def replay_spooled(spool, entry):
+    # Sends a claimed entry, completing it once it's sent. A replay that
+    # fails is released as a failed attempt, to carry on from its progress
+    # next time. Replays that are deferred are released by record_replay.
+    try:
+        send_spooled_payload(
+            spool.read(entry),
+            entry.get('progress'),
+            functools.partial(save_replay_progress, spool, entry)
+        )
+    except (lib.circuit.CircuitOpenError, lib.deadline.DeadlineExceeded):
+        raise
+    except Exception as e:
+        release_spooled(spool, entry, "{}: {}".format(type(e).__name__, e))
+        raise
+    spool.complete(entry)
+
+
+def record_replay(spool, entry, outcome):
+    # A replay that was deferred stays in the spool for the next replayer
+    if outcome == lib.delivery.SPOOLED:
+        release_spooled(spool, entry)
+
+
+def add_spooled_deliveries(scheduler, limit=REPLAY_LIMIT):
+    # Claims and schedules up to limit payloads from the spool, oldest
+    # first, so they aren't also sent by other invocations replaying the
+    # same spool. Returns the spool, or None if nothing was scheduled.
+    if limit is not None and limit <= 0:
+        return None
+    try:
+        spool = lib.spool.get_default_spool()
+        entries = spool.claim(limit)
+    except Exception:
+        logger.exception("Unable to read the spool")
+        return None
+    for entry in entries:
+        scheduler.add(lib.delivery.Delivery(
+            entry['destination'],
+            entry['severity'],
+            functools.partial(replay_spooled, spool, entry),
+            None,
+            key=SPOOL_KEY_PREFIX + entry['id'],
+            created=entry['spooled'],
+            host=lib.circuit.get_host(
+                get_destination_url(entry['destination'])
+            ),
+            record=functools.partial(record_replay, spool, entry)
+        ))
+    if not entries:
+        return None
+    logger.info("Replaying {} spooled deliveries".format(len(entries)))
+    return spool
+
+
+def compact_spool(spool):
+    if spool is None:
+        return
+    try:
+        spool.compact()
+    except Exception:
+        logger.exception("Unable to compact the spool")
+
+
+def get_destination(c7n_message):
     # Currently assume one webhook url, maybe add support for multiples in
     # the future
     if len(c7n_message['action']['to']) > 1:
@@ -208,23 +566,262 @@ def lambda_handler(event, context):
             "More than one destination (i.e. 'to') has been specified, "
             "but only using the first one. "
         )
-    webhook_url = c7n_message['action']['to'][0]
+    return c7n_message['action']['to'][0]
+
 
-    # Try to get the data from the c7n_message and format a message for
-    # slack If an exception is encountered, send the error to slack and
-    # re-raise the exception
+def get_destination_url(destination):
+    if lib.slack_api.is_api_destination(destination):
+        return lib.slack_api.API_URL
+    return destination
+
+
+def prepare_deliveries(c7n_message, key=None, created=None,
+                       message_id=None, deadline=None):
+    # Routes are matched before anything is rendered, the message goes to
+    # the policy's destination when none of them match
+    severity = get_message_color(c7n_message['policy'])
+    routed_destinations = lib.routing.get_destinations(c7n_message, severity)
+    if not routed_destinations:
+        routed_destinations = [
+            (get_destination(c7n_message), c7n_message['action']['template'])
+        ]
+    # When the message is a retry, destinations it was already delivered or
+    # spooled to are skipped before anything is extracted or rendered
+    outcomes = lib.idempotency.get_outcomes(message_id)
+    if outcomes:
+        routed_destinations = [
+            routed_destination for routed_destination in routed_destinations
+            if routed_destination not in outcomes
+        ]
+        logger.info(
+            "Message {} was already delivered to {} destinations, {} "
+            "left".format(message_id, len(outcomes),
+                          len(routed_destinations))
+        )
+        if not routed_destinations:
+            return []
+    message_data = lib.messaging.get_message_data(c7n_message, deadline)
+    if message_data['suppressed'] and not message_data['resources']:
+        logger.info("Every resource is muted, not sending a message")
+        return []
+
+    deliveries = []
+    for destination, template in routed_destinations:
+        route_data = dict(message_data, message_template=template)
+        progress = {'sent': 0}
+        deliveries.append(lib.delivery.Delivery(
+            destination,
+            severity,
+            functools.partial(send_resource_messages, destination,
+                              route_data, progress),
+            functools.partial(get_spool_payload, destination, route_data,
+                              progress),
+            key=key,
+            created=created,
+            host=lib.circuit.get_host(get_destination_url(destination)),
+            record=functools.partial(lib.idempotency.record_outcome,
+                                     message_id, destination, template)
+        ))
+    return deliveries
+
+
+def report_exception(c7n_message, exception):
+    slack_message = format_exception_message(c7n_message, exception)
+    deliver_slack_message(get_destination(c7n_message), slack_message)
+
+
+def prepare_message(encoded_message, key=None, created=None,
+                    message_id=None, deadline=None):
+    # Returns the decoded message and its deliveries. If an exception is
+    # encountered, send the error to slack and re-raise the exception
+    logger.debug(
+        "Received encoded message from Cloud Custodian: {}".format(
+            encoded_message
+        )
+    )
+    c7n_message = lib.messaging.decode_message(encoded_message)
     try:
-        message_data = lib.messaging.get_message_data(c7n_message)
-        slack_message = format_slack_resource_message(message_data)
-        send_slack_message(webhook_url, slack_message)
+        deliveries = prepare_deliveries(c7n_message, key, created,
+                                        message_id, deadline)
+    except lib.deadline.DeadlineExceeded:
+        # Not an error in the message, so it's retried without sending one
+        logger.warning("Ran out of time preparing the message")
+        raise
     # Yes this is broad but we want to send info on any exception to slack
     except Exception as e:
-        slack_message = format_exception_message(c7n_message, e)
-        send_slack_message(webhook_url, slack_message)
+        # The error goes to the same destination, which may be why it
+        # failed, so the original exception is raised whatever happens
+        try:
+            report_exception(c7n_message, e)
+        except Exception:
+            logger.exception("Unable to send the error to slack")
         raise
+    return c7n_message, deliveries
+
+
+def deliver_scheduled(scheduler, c7n_messages):
+    # Runs the scheduler, sending the error for each message with a failed
+    # delivery to slack. c7n_messages are keyed on the key of their
+    # deliveries. Returns the report and the first exception of each failed
+    # message by key. Messages with cancelled deliveries fail with
+    # DeadlineExceeded, which isn't sent to slack, so they are retried.
+    report = scheduler.run()
+    failures = {}
+    for delivery, exception in report.failed:
+        # Replayed deliveries that failed stay in the spool
+        if delivery.key in failures or delivery.key not in c7n_messages:
+            continue
+        failures[delivery.key] = exception
+        try:
+            report_exception(c7n_messages[delivery.key], exception)
+        except Exception:
+            logger.exception("Unable to send the error to slack")
+    for delivery in report.cancelled:
+        if delivery.key in failures or delivery.key not in c7n_messages:
+            continue
+        failures[delivery.key] = lib.deadline.DeadlineExceeded(
+            "Ran out of time delivering to {}".format(delivery.destination)
+        )
+    return report, failures
+
+
+def get_context_clock(context):
+    # The clock the context's remaining time follows, and how to wait on
+    # it. A Lambda context follows the real time, a FakeContext its
+    # FakeClock, see devtools/fake_context.py.
+    clock = getattr(context, 'clock', None)
+    if clock is None:
+        return time.monotonic, time.sleep
+    return clock, getattr(clock, 'sleep', time.sleep)
+
+
+def get_scheduler(deadline, clock=time.monotonic, sleep=time.sleep):
+    # Sends stop in time to spool what's left before the deadline, or after
+    # C7N_NOTIFIERS_DELIVERY_BUDGET seconds when there's no deadline. The
+    # destinations' rate limits are kept with clock and waited on with sleep.
+    if deadline is None:
+        return lib.delivery.DeliveryScheduler(clock=clock, sleep=sleep)
+    return lib.delivery.DeliveryScheduler(
+        deadline=deadline.keep_back(lib.deadline.SPOOL_RESERVE),
+        cancel_deadline=deadline,
+        clock=clock,
+        sleep=sleep
+    )
 
 
+def get_extraction_deadline(deadline):
+    if deadline is None:
+        return None
+    return deadline.share(lib.deadline.EXTRACTION_SHARE)
 
 
+def handle_message(encoded_message, message_id=None, deadline=None,
+                   clock=time.monotonic, sleep=time.sleep):
+    # Returns the report of the message's deliveries, see lib/delivery.py
+    c7n_message, deliveries = prepare_message(
+        encoded_message,
+        message_id=message_id,
+        deadline=get_extraction_deadline(deadline)
+    )
+    scheduler = get_scheduler(deadline, clock, sleep)
+    for delivery in deliveries:
+        scheduler.add(delivery)
+    spool = add_spooled_deliveries(scheduler)
+    report, failures = deliver_scheduled(scheduler, {None: c7n_message})
+    compact_spool(spool)
+    if failures:
+        raise failures[None]
+    return report
+
+
+def prepare_sqs_record(record, scheduler, deadline=None):
+    encoded_message, message_id = lib.messaging.get_sqs_message(record)
+    c7n_message, deliveries = prepare_message(
+        encoded_message,
+        key=record['messageId'],
+        created=lib.messaging.get_sqs_sent_time(record),
+        message_id=message_id,
+        deadline=deadline
+    )
+    for delivery in deliveries:
+        scheduler.add(delivery)
+    return c7n_message
 
 
+def lambda_handler(event, context):
+    # Returns what was delivered, deferred to the spool and cancelled
+    try:
+        sns = event['Records'][0]['Sns']
+        report = handle_message(sns['Message'], sns.get('MessageId'),
+                                lib.deadline.from_context(context),
+                                *get_context_clock(context))
+    finally:
+        lib.metrics.log_metrics()
+    return report.get_summary()
+
+
+def sqs_handler(event, context):
+    # For when the function is fed from an SQS queue subscribed to the SNS
+    # topic, which bounds how many are running and lets one warm container
+    # process a batch of messages. The records are prepared concurrently,
+    # then their deliveries are made by one scheduler so the most severe
+    # messages in the batch go first. Only records that failed, or ran out
+    # of time, are reported, so only they are retried.
+    import concurrent.futures
+    records = event['Records']
+    deadline = lib.deadline.from_context(context)
+    extraction_deadline = get_extraction_deadline(deadline)
+    scheduler = get_scheduler(deadline, *get_context_clock(context))
+    c7n_messages = {}
+    batch_item_failures = []
+    workers = max(1, min(SQS_CONCURRENCY, len(records)))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(prepare_sqs_record, record, scheduler,
+                                extraction_deadline)
+                for record in records
+            ]
+            for record, future in zip(records, futures):
+                try:
+                    c7n_messages[record['messageId']] = future.result()
+                except Exception:
+                    logger.exception(
+                        "Unable to process SQS message {}".format(
+                            record['messageId']
+                        )
+                    )
+                    batch_item_failures.append({
+                        'itemIdentifier': record['messageId']
+                    })
+        spool = add_spooled_deliveries(scheduler)
+        report, failures = deliver_scheduled(scheduler, c7n_messages)
+        compact_spool(spool)
+        for record in records:
+            if record['messageId'] in failures:
+                logger.error(
+                    "Unable to deliver SQS message {}".format(
+                        record['messageId']
+                    )
+                )
+                batch_item_failures.append({
+                    'itemIdentifier': record['messageId']
+                })
+    finally:
+        lib.metrics.log_metrics()
+    return {'batchItemFailures': batch_item_failures}
+
+
+def replay_handler(event, context):
+    # Delivers payloads from the spool, for a schedule to call when the
+    # spool is on a mounted volume or S3 and so outlives the containers
+    # that spooled them.
+    scheduler = get_scheduler(lib.deadline.from_context(context),
+                              *get_context_clock(context))
+    try:
+        spool = add_spooled_deliveries(scheduler, limit=None)
+        report = scheduler.run()
+        compact_spool(spool)
+    finally:
+        lib.metrics.log_metrics()
+    return report.get_summary()
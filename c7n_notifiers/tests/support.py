@@ -0,0 +1,120 @@
+# Shared by the tests: puts the notifier, its dependencies and devtools on
+# the path, keeps idempotency outcomes in memory and sends requests with
+# urllib so they can be answered in place of Slack.
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+import zlib
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [
+    os.path.join(base_dir, 'notifiers'),
+    os.path.join(base_dir, 'dependencies'),
+    os.path.join(base_dir, 'devtools')
+]
+os.environ['C7N_NOTIFIERS_IDEMPOTENCY_LOCATION'] = 'memory://'
+os.environ['C7N_NOTIFIERS_TRANSPORT'] = 'urllib'
+
+import lib.spool  # noqa: E402
+
+WEBHOOK = 'https://hooks.slack.com/services/T0/B0/tests'
+
+
+class Response:
+    status = 200
+
+    def __init__(self, body=b'ok'):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def get_message(resource_count=3, resource_type='ec2', resources=None,
+                to=WEBHOOK, **action):
+    if resources is None:
+        resources = [
+            {
+                'InstanceId': 'i-{:017d}'.format(number),
+                'LaunchTime': '2018-01-01T10:00:00+00:00',
+                'Tags': [
+                    {'Key': 'Name', 'Value': 'name{}'.format(number)},
+                    {'Key': 'Creator', 'Value': 'creator'}
+                ]
+            }
+            for number in range(resource_count)
+        ]
+    return {
+        'account': 'test', 'account_id': '123456789012',
+        'region': 'us-east-1',
+        'policy': {
+            'name': 'tests', 'resource': resource_type,
+            'actions': [{'type': 'mark-for-op', 'op': 'stop'}]
+        },
+        'action': dict({'to': [to], 'template': 'reaper'}, **action),
+        'resources': resources
+    }
+
+
+def encode_message(c7n_message):
+    return base64.b64encode(
+        zlib.compress(json.dumps(c7n_message).encode('utf8'))
+    ).decode('ascii')
+
+
+def get_sns_event(message_id, c7n_message):
+    return {'Records': [{'Sns': {
+        'MessageId': message_id, 'Message': encode_message(c7n_message)
+    }}]}
+
+
+def use_spool(test):
+    # Gives the test a spool of its own, returning its directory
+    spool_path = tempfile.mkdtemp()
+    patch = mock.patch('lib.spool._spool', lib.spool.get_spool(spool_path))
+    patch.start()
+    test.addCleanup(patch.stop)
+    test.addCleanup(shutil.rmtree, spool_path)
+    return spool_path
+
+
+def quiet_metrics(test):
+    patch = mock.patch('lib.metrics.log_metrics')
+    patch.start()
+    test.addCleanup(patch.stop)
+
+
+def use_standin(test):
+    # Points the Web API at a slack stand-in of the test's own, see
+    # devtools/slack_standin.py, returning it
+    import slack_standin
+    server = slack_standin.start_standin()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    for patch in [
+            mock.patch('lib.slack_api.API_URL', server.base_url + '/api/'),
+            mock.patch.dict(os.environ, {'SLACK_API_TOKEN': 'xoxb-tests'})]:
+        patch.start()
+        test.addCleanup(patch.stop)
+    return server
+
+
+def get_posts(server):
+    # The chat.postMessage payloads the stand-in was sent, in order
+    return [
+        json.loads(request['body'].decode('utf8'))
+        for request in server.requests_for('/api/chat.postMessage')
+    ]
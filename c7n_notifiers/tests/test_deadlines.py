@@ -0,0 +1,167 @@
+# The handlers driven with a FakeContext whose time follows a FakeClock, see
+# devtools/fake_context.py, so how they behave near their deadline is tried
+# without waiting for it. Webhook requests are answered in place of Slack,
+# moving the clock on by however long each should take.
+#
+#   python3 -m unittest discover tests
+import json
+import os
+import unittest
+from unittest import mock
+
+from support import (
+    WEBHOOK, Response, encode_message, get_message, get_sns_event,
+    quiet_metrics, use_spool
+)
+from fake_context import FakeClock, FakeContext
+import lib.deadline
+import lib.ratelimit
+import lib.resources
+import lib.slack_api
+import lib.spool
+import slack_notifier
+
+
+def get_sqs_event(message_ids):
+    return {'Records': [
+        {
+            'messageId': message_id,
+            'body': encode_message(get_message()),
+            'attributes': {'SentTimestamp': str(1500000000000 + number)}
+        }
+        for number, message_id in enumerate(message_ids)
+    ]}
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        self.send_seconds = 0.0
+        # Web API posts
+        self.posted = []
+        use_spool(self)
+        quiet_metrics(self)
+        patch = mock.patch('lib.transport.urlopen', self.urlopen)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def urlopen(self, req, timeout=None):
+        self.sent.append(req.full_url)
+        self.clock.advance(self.send_seconds)
+        if req.full_url.startswith(lib.slack_api.API_URL):
+            self.posted.append(json.loads(req.data.decode('utf8')))
+            return Response(json.dumps({
+                'ok': True, 'ts': str(len(self.posted))
+            }).encode('utf8'))
+        return Response()
+
+    def get_spooled(self):
+        return lib.spool.get_default_spool().claim()
+
+    def test_extraction_out_of_time_raises(self):
+        # Extracting each resource takes a millisecond, so the half of the
+        # second left that extraction gets runs out on the thousandth
+        extract = lib.resources.get_resource_info
+
+        def slow_extract(*args, **kwargs):
+            self.clock.advance(0.001)
+            return extract(*args, **kwargs)
+
+        context = FakeContext(1.0 + lib.deadline.DEADLINE_MARGIN,
+                              clock=self.clock)
+        with mock.patch('lib.resources.get_resource_info', slow_extract):
+            with self.assertRaises(lib.deadline.DeadlineExceeded):
+                slack_notifier.lambda_handler(
+                    get_sns_event('extraction', get_message(1500)), context
+                )
+        # Nothing is sent, not even the error, so the message is retried
+        self.assertEqual(self.sent, [])
+
+    def test_deliveries_past_reserve_are_spooled(self):
+        # Sends take 0.8s and the destination takes one a second, so only
+        # two fit before the sends stop, the spool reserve before the end
+        self.send_seconds = 0.8
+        context = FakeContext(3.0 + lib.deadline.DEADLINE_MARGIN,
+                              clock=self.clock)
+        result = slack_notifier.sqs_handler(
+            get_sqs_event(['reserve-1', 'reserve-2', 'reserve-3',
+                           'reserve-4']),
+            context
+        )
+        self.assertEqual(result, {'batchItemFailures': []})
+        self.assertEqual(self.sent, [WEBHOOK, WEBHOOK])
+        # The rate limit was waited on with the fake clock
+        self.assertAlmostEqual(self.clock(), 1.8)
+        spooled = self.get_spooled()
+        self.assertEqual([entry['destination'] for entry in spooled],
+                         [WEBHOOK, WEBHOOK])
+
+    def test_deliveries_past_deadline_are_cancelled(self):
+        # The first send takes all the time there was, leaving none to
+        # spool the second, whose message is retried
+        self.send_seconds = 3.5
+        context = FakeContext(3.0 + lib.deadline.DEADLINE_MARGIN,
+                              clock=self.clock)
+        result = slack_notifier.sqs_handler(
+            get_sqs_event(['cancel-1', 'cancel-2']), context
+        )
+        self.assertEqual(result, {'batchItemFailures': [
+            {'itemIdentifier': 'cancel-2'}
+        ]})
+        self.assertEqual(self.sent, [WEBHOOK])
+        self.assertEqual(self.get_spooled(), [])
+
+    @mock.patch.dict(os.environ, {'SLACK_API_TOKEN': 'xoxb-tests'})
+    def test_partly_sent_delivery_is_spooled_with_progress(self):
+        # Posts take 0.5s and one can be made a second, so the summary and
+        # two of the replies are posted before the third runs out of time.
+        # The delivery is spooled with them sent and replaying it only posts
+        # the rest, in the summary's thread.
+        self.send_seconds = 0.5
+        context = FakeContext(3.5 + lib.deadline.DEADLINE_MARGIN,
+                              clock=self.clock)
+        slack_notifier.lambda_handler(
+            get_sns_event('partial', get_message(200, to='slack://C0TESTS')),
+            context
+        )
+        self.assertEqual(len(self.posted), 3)
+        self.assertNotIn('thread_ts', self.posted[0])
+        [entry] = self.get_spooled()
+        payload = lib.spool.get_default_spool().read(entry)
+        self.assertEqual(payload['progress'], {'sent': 3, 'thread_ts': '1'})
+
+        self.posted = []
+        self.send_seconds = 0.0
+        rate_limiter = lib.ratelimit.RateLimiter(1.0, clock=self.clock,
+                                                 sleep=self.clock.sleep)
+        with lib.ratelimit.limit(rate_limiter):
+            slack_notifier.send_spooled_payload(payload)
+        self.assertEqual(self.posted, [
+            dict(message_body, channel='C0TESTS', thread_ts='1')
+            for message_body in payload['messages'][3:]
+        ])
+
+    def test_lambda_handler_reports_cancelled_delivery(self):
+        self.clock.advance(1.0)
+        context = FakeContext(0.2 + lib.deadline.DEADLINE_MARGIN,
+                              clock=self.clock)
+        # The context runs out once the message has been prepared
+        prepare_message = slack_notifier.prepare_message
+
+        def slow_prepare(*args, **kwargs):
+            prepared = prepare_message(*args, **kwargs)
+            self.clock.advance(1.0)
+            return prepared
+
+        with mock.patch('slack_notifier.prepare_message', slow_prepare):
+            with self.assertRaises(lib.deadline.DeadlineExceeded):
+                slack_notifier.lambda_handler(
+                    get_sns_event('late', get_message()), context
+                )
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.get_spooled(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# The extractors generated for each resource mapping, see lib/extractors.py,
+# against searching the mappings' JMESPath expressions. Both are run over
+# the same generated resources, including ones with missing, malformed and
+# unusual values, and must return the same resource info or raise the same
+# error.
+import random
+import unittest
+
+import support  # noqa: F401
+import lib.inference
+import lib.resources
+from resource_generator import make_resource
+
+CHECK_COUNT = 500
+REGION = 'eu-west-1'
+# Samples for mappings inferred for types without one
+INFERRED_SAMPLES = {
+    'test-extractors-widget': {
+        'WidgetId': 'w-1', 'DisplayName': 'first',
+        'CreateTime': '2021-03-04T05:06:07+00:00'
+    },
+    'test-extractors-gadget': {
+        'GadgetId': 'g-1', 'CreateTime': '2021-03-04T05:06:07+00:00',
+        'Tags': [{'Key': 'Name', 'Value': 'first'},
+                 {'Key': 'Creator', 'Value': 'someone'}]
+    }
+}
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return (type(e), str(e))
+
+
+class ExtractorTest(unittest.TestCase):
+    def check(self, resource_type, prepared_mapping):
+        rng = random.Random(resource_type)
+        interpret = lib.resources.extract_resource_info
+        extract = prepared_mapping['extract']
+        resources = [
+            make_resource(prepared_mapping, rng, odd=True)
+            for _ in range(CHECK_COUNT)
+        ] + [None, [], "resource"]
+        for resource in resources:
+            self.assertEqual(
+                outcome(extract, resource, REGION),
+                outcome(interpret, prepared_mapping, resource, REGION),
+                "{} extractor differs for {!r}".format(resource_type,
+                                                       resource)
+            )
+
+    def test_mapped_types(self):
+        mappings = lib.resources.get_mappings()
+        for resource_type, resource_mapping in sorted(mappings.items()):
+            with self.subTest(resource_type=resource_type):
+                self.check(resource_type,
+                           lib.resources.prepare_mapping(resource_mapping))
+
+    def test_inferred_types(self):
+        for resource_type, sample in sorted(INFERRED_SAMPLES.items()):
+            resource_mapping = lib.inference.infer_mapping(
+                resource_type, sample, lib.resources.get_datetime
+            )
+            with self.subTest(resource_type=resource_type):
+                self.check(resource_type,
+                           lib.resources.prepare_mapping(resource_mapping))
+
+
+if __name__ == '__main__':
+    unittest.main()
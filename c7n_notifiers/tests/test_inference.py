@@ -0,0 +1,99 @@
+# Mappings inferred for resource types without one come from the first
+# resource seen, so later resources of the type may not have the keys it
+# had. They must still be listed rather than failing the message.
+import unittest
+from unittest import mock
+
+from support import (
+    WEBHOOK, Response, get_message, get_sns_event, quiet_metrics, use_spool
+)
+import lib.formatting
+import lib.resources
+import slack_notifier
+
+REGION = 'us-east-1'
+RESOURCES = [
+    {
+        'WidgetId': 'w-1', 'DisplayName': 'first',
+        'CreateTime': '2021-03-04T05:06:07+00:00'
+    },
+    {'WidgetId': 'w-2'},
+    {'DisplayName': 'no id', 'CreateTime': 'yesterday'},
+    {'WidgetId': 7, 'DisplayName': ['a', 'b']}
+]
+TAGGED_RESOURCES = [
+    {
+        'GadgetId': 'g-1', 'CreateTime': '2021-03-04T05:06:07+00:00',
+        'Tags': [{'Key': 'Name', 'Value': 'first'},
+                 {'Key': 'Creator', 'Value': 'someone'}]
+    },
+    {'GadgetId': 'g-2', 'Tags': []},
+    {'GadgetId': 'g-3', 'CreateTime': '2021-03-05T05:06:07+00:00'}
+]
+
+
+class InferredMappingTest(unittest.TestCase):
+    def setUp(self):
+        use_spool(self)
+        quiet_metrics(self)
+        self.sent = []
+        patch = mock.patch('lib.transport.urlopen', self.urlopen)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def urlopen(self, req, timeout=None):
+        self.sent.append(req.full_url)
+        return Response()
+
+    def extract_both(self, resource_type, resources):
+        # The resource info from the generated extractor, after checking
+        # the interpreted one returns the same
+        prepared_mapping = lib.resources.get_prepared_mapping(
+            resource_type, resources[0]
+        )
+        extracted = []
+        for resource in resources:
+            resource_info = prepared_mapping['extract'](resource, REGION)
+            self.assertEqual(
+                lib.resources.extract_resource_info(prepared_mapping,
+                                                    resource, REGION),
+                resource_info
+            )
+            extracted.append(resource_info)
+        return extracted
+
+    def test_missing_keys_are_blank(self):
+        extracted = self.extract_both('test-mixed-widget', RESOURCES)
+        self.assertEqual(
+            [(info['id'], info['name'], info['creator'])
+             for info in extracted],
+            [('w-1', 'first', ''), ('w-2', '', ''), ('', 'no id', ''),
+             ('7', '', '')]
+        )
+        self.assertEqual(
+            [info['creation_datetime'] for info in extracted[1:]],
+            [lib.formatting.UNKNOWN_DATETIME] * 3
+        )
+
+    def test_missing_tags_are_blank(self):
+        extracted = self.extract_both('test-mixed-gadget', TAGGED_RESOURCES)
+        self.assertEqual(
+            [(info['name'], info['creator']) for info in extracted],
+            [('first', 'someone'), ('', ''), ('', '')]
+        )
+
+    def test_message_with_mixed_resources_is_sent(self):
+        for resource_type, resources in [
+                ('test-message-widget', RESOURCES),
+                ('test-message-gadget', TAGGED_RESOURCES)]:
+            self.sent = []
+            slack_notifier.lambda_handler(get_sns_event(
+                resource_type,
+                get_message(resource_type=resource_type,
+                            resources=resources)
+            ), None)
+            self.assertEqual(self.sent, [WEBHOOK])
+
+
+if __name__ == '__main__':
+    unittest.main()
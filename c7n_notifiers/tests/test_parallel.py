@@ -0,0 +1,41 @@
+# Extraction over the process pool, see lib/parallel.py, which is only
+# available outside Lambda, e.g. to the server.
+import unittest
+from unittest import mock
+
+from support import get_message
+import lib.messaging
+import lib.parallel
+
+REGION = 'us-east-1'
+
+
+class ExtractionPoolTest(unittest.TestCase):
+    def get_pool(self, **kwargs):
+        pool = lib.parallel.ExtractionPool(workers=2, **kwargs)
+        pool.tuner.default_threshold = 1
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_lambda_extracts_without_splitting(self):
+        pool = self.get_pool(lambda_function_name='c7n-notifier')
+        resources = get_message(1000)['resources']
+        with mock.patch('lib.parallel.split_resources') as split_resources:
+            self.assertIsNone(pool.extract('ec2', resources, REGION))
+        split_resources.assert_not_called()
+        self.assertIsNone(pool.executor)
+
+    def test_pool_extracts_as_serial(self):
+        pool = self.get_pool(lambda_function_name=None)
+        c7n_message = get_message(1000)
+        with mock.patch('lib.parallel.extract_resources', lambda *args: None):
+            expected = lib.messaging.get_message_data(c7n_message)
+        self.assertEqual(
+            pool.extract('ec2', c7n_message['resources'], REGION),
+            expected['resources']
+        )
+        self.assertIsNotNone(pool.executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# The long-running server, see notifiers/server.py, on an ephemeral port
+# with a pending directory of its own. lambda_handler is replaced, so what
+# is tried is how notifications are queued, retried and kept.
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from support import encode_message, get_message, quiet_metrics
+import server
+
+TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:c7n-notifier-tests'
+
+
+def get_notification(message_id):
+    return {
+        'Type': server.NOTIFICATION,
+        'MessageId': message_id,
+        'TopicArn': TOPIC_ARN,
+        'Message': encode_message(get_message())
+    }
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        quiet_metrics(self)
+        self.pending_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pending_path)
+        self.handled = []
+        self.failing = set()
+        patch = mock.patch('slack_notifier.lambda_handler', self.handle)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def handle(self, event, context):
+        message_id = event['Records'][0]['Sns']['MessageId']
+        if message_id in self.failing:
+            raise RuntimeError("Unable to send {}".format(message_id))
+        self.handled.append(message_id)
+        return {}
+
+    def get_server(self, start=True, **kwargs):
+        notifier_server = server.NotifierServer(
+            ('127.0.0.1', 0),
+            pending=server.PendingNotifications(self.pending_path),
+            **kwargs
+        )
+        if start:
+            notifier_server.start()
+            self.addCleanup(self.drain, notifier_server)
+        else:
+            self.addCleanup(notifier_server.server_close)
+        return notifier_server
+
+    def drain(self, notifier_server):
+        if not notifier_server.draining:
+            notifier_server.drain(0)
+
+    def post(self, notifier_server, envelope):
+        # The status, headers and result of posting envelope
+        req = urllib.request.Request(
+            notifier_server.base_url + '/',
+            data=json.dumps(envelope).encode('utf8'),
+            headers={'content-type': 'text/plain; charset=UTF-8'}
+        )
+        try:
+            response = urllib.request.urlopen(req, timeout=5)
+        except urllib.error.HTTPError as e:
+            response = e
+        with response:
+            return (response.status if hasattr(response, 'status')
+                    else response.code, response.headers,
+                    json.loads(response.read().decode('utf8')))
+
+    def get_pending_ids(self):
+        return [
+            notification['envelope']['MessageId']
+            for notification in server.PendingNotifications(
+                self.pending_path
+            ).load()
+        ]
+
+    def test_full_queue_asks_sns_to_retry_later(self):
+        # Without workers nothing is taken off the queue
+        notifier_server = self.get_server(workers=0, queue_size=1)
+        status, _, result = self.post(notifier_server,
+                                      get_notification('queued'))
+        self.assertEqual((status, result), (202, {'queued': 'queued'}))
+        status, headers, _ = self.post(notifier_server,
+                                       get_notification('refused'))
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['Retry-After'],
+                         str(server.RETRY_AFTER_SECONDS))
+        # Only the queued one is kept
+        self.assertEqual(self.get_pending_ids(), ['queued'])
+
+    @mock.patch('lib.circuit.urlopen')
+    def test_subscribe_url_must_be_sns(self, urlopen):
+        notifier_server = self.get_server(workers=0)
+        for subscribe_url in [
+                'https://attacker.example.com/?Action=ConfirmSubscription',
+                'http://sns.us-east-1.amazonaws.com/?Action=Confirm',
+                'https://sns.us-east-1.amazonaws.com.example.com/',
+                None]:
+            status, _, result = self.post(notifier_server, {
+                'Type': server.SUBSCRIPTION_CONFIRMATION,
+                'TopicArn': TOPIC_ARN,
+                'SubscribeURL': subscribe_url
+            })
+            self.assertEqual(status, 400, subscribe_url)
+            self.assertIn("isn't an SNS endpoint", result['error'])
+        urlopen.assert_not_called()
+
+        status, _, _ = self.post(notifier_server, {
+            'Type': server.SUBSCRIPTION_CONFIRMATION,
+            'TopicArn': TOPIC_ARN,
+            'SubscribeURL': 'https://sns.eu-west-1.amazonaws.com/'
+                            '?Action=ConfirmSubscription&Token=t'
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(urlopen.call_count, 1)
+
+    def test_failures_are_retried_then_buried(self):
+        notifier_server = self.get_server(start=False, max_attempts=2,
+                                          retry_seconds=10)
+        self.failing.add('failing')
+        notification = notifier_server.pending.add(
+            get_notification('failing')
+        )
+        notifier_server.handle_notification(notification)
+        # Kept with the attempt counted, and retried after retry_seconds
+        [kept] = notifier_server.pending.load()
+        self.assertEqual(kept['attempts'], 1)
+        [(due, _, retry)] = notifier_server.retries
+        self.assertIs(retry, notification)
+        self.assertAlmostEqual(due - time.monotonic(), 10, delta=1)
+        self.assertIsNone(notifier_server.get_retry())
+
+        notifier_server.handle_notification(notification)
+        self.assertEqual(notifier_server.pending.load(), [])
+        self.assertEqual(len(notifier_server.retries), 1)
+        dead = server.PendingNotifications(
+            os.path.join(self.pending_path, server.DEAD_DIRECTORY)
+        ).load()
+        self.assertEqual([notification['attempts'] for notification in dead],
+                         [2])
+
+    def test_handled_notifications_are_removed(self):
+        notifier_server = self.get_server(start=False)
+        notifier_server.handle_notification(
+            notifier_server.pending.add(get_notification('handled'))
+        )
+        self.assertEqual(self.handled, ['handled'])
+        self.assertEqual(self.get_pending_ids(), [])
+
+    def test_drain_keeps_queued_notifications_for_next_start(self):
+        notifier_server = self.get_server(workers=0)
+        for message_id in ['first', 'second']:
+            status, _, _ = self.post(notifier_server,
+                                     get_notification(message_id))
+            self.assertEqual(status, 202)
+        notifier_server.drain(0)
+        self.assertEqual(self.handled, [])
+        self.assertEqual(self.get_pending_ids(), ['first', 'second'])
+
+        self.get_server(workers=1)
+        for _ in range(100):
+            if not self.get_pending_ids():
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.handled, ['first', 'second'])
+        self.assertEqual(self.get_pending_ids(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Deliveries to slack:// channels against the slack stand-in, see
+# devtools/slack_standin.py: a summary posted to the channel followed by
+# the resources as replies in its thread, kept to the destination's rate.
+import re
+import unittest
+import urllib.error
+from unittest import mock
+
+from support import (
+    Response, encode_message, get_message, get_posts, get_sns_event,
+    quiet_metrics, use_spool, use_standin
+)
+from fake_context import FakeClock, FakeContext
+import lib.ratelimit
+import lib.slack_api
+import slack_notifier
+
+DESTINATION = 'slack://C0TESTS'
+
+
+class ThreadedDeliveryTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = use_standin(self)
+        use_spool(self)
+        quiet_metrics(self)
+
+    def test_summary_then_threaded_replies(self):
+        slack_notifier.lambda_handler(
+            get_sns_event('threaded', get_message(200, to=DESTINATION)),
+            FakeContext(60, clock=self.clock)
+        )
+        summary, *replies = get_posts(self.server)
+        self.assertEqual(summary['channel'], 'C0TESTS')
+        self.assertNotIn('thread_ts', summary)
+        self.assertGreater(len(replies), 1)
+        self.assertEqual(len({reply['thread_ts'] for reply in replies}), 1)
+        self.assertEqual(
+            len({
+                instance_id for reply in replies
+                for instance_id in re.findall(
+                    r'i-\d{17}', reply['attachments'][0]['text']
+                )
+            }),
+            200
+        )
+        # Every reply, the first included, waited a second on the fake
+        # clock after the message before it
+        self.assertAlmostEqual(self.clock(), len(replies))
+
+    def test_deliveries_share_destination_rate(self):
+        # The second message's summary waits on the first's last reply
+        event = {'Records': [
+            {
+                'messageId': message_id,
+                'body': encode_message(get_message(to=DESTINATION)),
+                'attributes': {'SentTimestamp': '1500000000000'}
+            }
+            for message_id in ['first', 'second']
+        ]}
+        slack_notifier.sqs_handler(event, FakeContext(60, clock=self.clock))
+        posts = get_posts(self.server)
+        self.assertEqual([post.get('thread_ts') is None for post in posts],
+                         [True, False, True, False])
+        self.assertAlmostEqual(self.clock(), 3)
+
+
+class RateLimitedCallTest(unittest.TestCase):
+    @mock.patch.dict('os.environ', {'SLACK_API_TOKEN': 'xoxb-tests'})
+    def test_retry_waits_on_current_clock(self):
+        clock = FakeClock()
+        responses = [
+            urllib.error.HTTPError(lib.slack_api.API_URL, 429,
+                                   'Too Many Requests',
+                                   {'Retry-After': '7'}, None),
+            Response(b'{"ok": true, "ts": "1"}')
+        ]
+
+        def urlopen(req, timeout=None):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        rate_limiter = lib.ratelimit.RateLimiter(1.0, clock=clock,
+                                                 sleep=clock.sleep)
+        with mock.patch('lib.transport.urlopen', urlopen), \
+                lib.ratelimit.limit(rate_limiter):
+            result = lib.slack_api.post_message('C0TESTS', {'text': 'hi'})
+        self.assertEqual(result['ts'], '1')
+        self.assertEqual(clock(), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
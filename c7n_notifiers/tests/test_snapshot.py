@@ -0,0 +1,44 @@
+# Whether a warm state snapshot, see lib/snapshot.py, can be used. In
+# Lambda its sources aren't checked, but it must still have been built with
+# the runtime's Python.
+import sys
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+import lib.snapshot
+
+
+def get_snapshot(**changes):
+    return dict({
+        'version': lib.snapshot.SNAPSHOT_VERSION,
+        'cache_tag': sys.implementation.cache_tag,
+        'sources': {'missing.yaml': [0, 0]}
+    }, **changes)
+
+
+@mock.patch('lib.snapshot.LAMBDA_FUNCTION_NAME', 'c7n-notifier')
+class LambdaSnapshotTest(unittest.TestCase):
+    def test_sources_are_trusted(self):
+        self.assertTrue(lib.snapshot.is_current(get_snapshot()))
+
+    def test_other_python_is_stale(self):
+        self.assertFalse(
+            lib.snapshot.is_current(get_snapshot(cache_tag='cpython-00'))
+        )
+        self.assertFalse(
+            lib.snapshot.is_current(get_snapshot(cache_tag=None))
+        )
+
+    def test_other_version_is_stale(self):
+        self.assertFalse(lib.snapshot.is_current(get_snapshot(version=1)))
+
+
+class LocalSnapshotTest(unittest.TestCase):
+    @mock.patch('lib.snapshot.LAMBDA_FUNCTION_NAME', None)
+    def test_changed_sources_are_stale(self):
+        self.assertFalse(lib.snapshot.is_current(get_snapshot()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# Claims on an s3:// spool, made without conditional writes by comparing
+# the versions put of the claim object, against a client keeping objects'
+# versions the way a versioned bucket does.
+import io
+import itertools
+import unittest
+
+import support  # noqa: F401
+import lib.spool
+
+
+class VersionedClient:
+    def __init__(self, versioning='Enabled'):
+        self.versioning = versioning
+        # Each key's versions, oldest first
+        self.objects = {}
+        self.version_ids = itertools.count()
+        self.before_list = []
+
+    def get_bucket_versioning(self, Bucket):
+        return {'Status': self.versioning} if self.versioning else {}
+
+    def put_object(self, Bucket, Key, Body):
+        version_id = str(next(self.version_ids))
+        self.objects.setdefault(Key, []).append((version_id, Body))
+        return {'VersionId': version_id}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key][-1][1])}
+
+    def list_object_versions(self, Bucket, Prefix):
+        # Lets a test put versions between a put and its listing
+        while self.before_list:
+            self.before_list.pop(0)()
+        return {'Versions': [
+            {'Key': key, 'VersionId': version_id}
+            for key in sorted(self.objects) if key.startswith(Prefix)
+            for version_id, _ in reversed(self.objects[key])
+        ]}
+
+    def get_paginator(self, operation_name):
+        # list_objects_v2 in a single page, leaving out deleted objects
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                return [{'Contents': [
+                    {'Key': key} for key in sorted(client.objects)
+                    if key.startswith(Prefix) and client.objects[key]
+                ]}]
+        return Paginator()
+
+    def delete_object(self, Bucket, Key, VersionId):
+        self.objects[Key] = [
+            version for version in self.objects[Key]
+            if version[0] != VersionId
+        ]
+
+
+class S3ClaimTest(unittest.TestCase):
+    def get_store(self, client):
+        store = lib.spool.S3ObjectStore('bucket', 'spool/')
+        store.client = client
+        return store
+
+    def test_only_first_create_succeeds(self):
+        client = VersionedClient()
+        store = self.get_store(client)
+        self.assertTrue(store.create('claims/a/000000.json', b'first'))
+        self.assertFalse(store.create('claims/a/000000.json', b'second'))
+        self.assertEqual(store.get('claims/a/000000.json'), b'first')
+        self.assertTrue(store.create('claims/a/000001.json', b'next'))
+
+    def test_racing_creates_have_one_winner(self):
+        # The second writer puts its version before the first lists them
+        client = VersionedClient()
+        first, second = self.get_store(client), self.get_store(client)
+        results = []
+        client.before_list.append(lambda: results.append(
+            second.create('claims/a/000000.json', b'second')
+        ))
+        results.insert(0, first.create('claims/a/000000.json', b'first'))
+        self.assertEqual(results, [True, False])
+        self.assertEqual(first.get('claims/a/000000.json'), b'first')
+
+    def test_unversioned_bucket_is_rejected(self):
+        store = self.get_store(VersionedClient(versioning=None))
+        with self.assertRaisesRegex(ValueError, 'versioning'):
+            store.create('claims/a/000000.json', b'first')
+
+    def test_spool_claims_entry_once(self):
+        spool = lib.spool.ObjectStoreSpool(self.get_store(VersionedClient()))
+        spool_id = spool.append({'destination': 'https://example.com',
+                                 'messages': []})
+        self.assertEqual([entry['id'] for entry in spool.claim()],
+                         [spool_id])
+        self.assertEqual(spool.claim(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
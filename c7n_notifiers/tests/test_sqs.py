@@ -0,0 +1,106 @@
+# The SQS handler fed by the stand-in queue, see devtools/sqs_standin.py,
+# with webhooks answered by the slack stand-in. Only the records that
+# failed are reported in batchItemFailures, so only they are received
+# again, and messages are read whether or not SNS wrapped them.
+import json
+import unittest
+
+from support import (
+    encode_message, get_message, quiet_metrics, use_spool, use_standin
+)
+from fake_context import FakeClock, FakeContext
+import sqs_standin
+import lib.messaging
+import slack_notifier
+
+
+class SqsHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = use_standin(self)
+        self.webhook = self.server.base_url + '/services/T0/B0/sqs'
+        use_spool(self)
+        quiet_metrics(self)
+
+    def get_context(self):
+        return FakeContext(60, clock=self.clock)
+
+    def get_webhook_requests(self):
+        return self.server.requests_for('/services/T0/B0/sqs')
+
+    def test_only_failed_records_are_reported(self):
+        queue = sqs_standin.StandinQueue()
+        first = queue.send(encode_message(get_message(to=self.webhook)))
+        # Its resources can't be extracted
+        broken = queue.send(encode_message(
+            get_message(resources=[None], to=self.webhook)
+        ))
+        last = queue.send(encode_message(get_message(to=self.webhook)))
+        event, batch = queue.receive()
+        self.assertEqual([record['messageId'] for record in event['Records']],
+                         [first, broken, last])
+        result = slack_notifier.sqs_handler(event, self.get_context())
+        self.assertEqual(result, {'batchItemFailures': [
+            {'itemIdentifier': broken}
+        ]})
+        # The two messages, and the error for the broken one
+        self.assertEqual(len(self.get_webhook_requests()), 3)
+
+    def test_failed_records_are_retried_until_dead(self):
+        queue = sqs_standin.StandinQueue(max_receives=2)
+        queue.send(encode_message(get_message(to=self.webhook)))
+        broken = queue.send(encode_message(
+            get_message(resources=[None], to=self.webhook)
+        ))
+        invocations = queue.drain(slack_notifier.sqs_handler,
+                                  get_context=self.get_context)
+        self.assertEqual(invocations, 2)
+        self.assertEqual([message['id'] for message in queue.dead_letters],
+                         [broken])
+        # The message once, and the error for each receive of the broken one
+        self.assertEqual(len(self.get_webhook_requests()), 3)
+
+    def test_raw_messages_are_delivered(self):
+        queue = sqs_standin.StandinQueue(raw_message_delivery=True)
+        for _ in range(2):
+            queue.send(encode_message(get_message(to=self.webhook)))
+        invocations = queue.drain(slack_notifier.sqs_handler,
+                                  get_context=self.get_context)
+        self.assertEqual(invocations, 1)
+        self.assertEqual(queue.dead_letters, [])
+        self.assertEqual(len(self.get_webhook_requests()), 2)
+
+
+class SqsMessageTest(unittest.TestCase):
+    def get_record(self, raw_message_delivery):
+        queue = sqs_standin.StandinQueue(
+            raw_message_delivery=raw_message_delivery
+        )
+        self.encoded_message = encode_message(get_message())
+        self.message_id = queue.send(self.encoded_message)
+        event, _ = queue.receive()
+        return event['Records'][0]
+
+    def test_sns_envelope_is_unwrapped(self):
+        record = self.get_record(raw_message_delivery=False)
+        self.assertEqual(json.loads(record['body'])['Type'], 'Notification')
+        self.assertEqual(lib.messaging.get_sqs_message(record),
+                         (self.encoded_message, self.message_id))
+
+    def test_raw_message_uses_sqs_message_id(self):
+        record = self.get_record(raw_message_delivery=True)
+        self.assertEqual(record['body'], self.encoded_message)
+        self.assertEqual(lib.messaging.get_sqs_message(record),
+                         (self.encoded_message, record['messageId']))
+
+    def test_other_sns_envelopes_are_rejected(self):
+        record = self.get_record(raw_message_delivery=False)
+        envelope = json.loads(record['body'])
+        envelope['Type'] = 'SubscriptionConfirmation'
+        record['body'] = json.dumps(envelope)
+        with self.assertRaisesRegex(ValueError, 'SubscriptionConfirmation'):
+            lib.messaging.get_sqs_message(record)
+
+
+if __name__ == '__main__':
+    unittest.main()
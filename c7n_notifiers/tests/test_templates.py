@@ -0,0 +1,45 @@
+# The render cache, see lib/templates.py, which only hashes contexts it
+# could cache a render of.
+import unittest
+from unittest import mock
+
+from support import quiet_metrics
+import lib.templates
+
+CONTEXT = {
+    'resource_type': 'ec2', 'region': 'us-east-1',
+    'account_info': '123456789012 (test)'
+}
+
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        quiet_metrics(self)
+        self.render_cache = lib.templates.RenderCache(
+            max_entry_characters=1000
+        )
+        patch = mock.patch('lib.templates.render_cache', self.render_cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_small_context_is_cached(self):
+        rendered = lib.templates.render('reaper.body',
+                                        dict(CONTEXT, resources='table'))
+        self.assertEqual(len(self.render_cache.entries), 1)
+        self.assertEqual(
+            lib.templates.render('reaper.body',
+                                 dict(CONTEXT, resources='table')),
+            rendered
+        )
+
+    def test_large_context_is_not_hashed(self):
+        context = dict(CONTEXT, resources='x' * 1001)
+        with mock.patch('lib.templates.get_context_hash') as hash_context:
+            rendered = lib.templates.render('reaper.body', context)
+        hash_context.assert_not_called()
+        self.assertIn('x' * 1001, rendered)
+        self.assertEqual(len(self.render_cache.entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
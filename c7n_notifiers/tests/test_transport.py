@@ -0,0 +1,53 @@
+# The asyncio transport's event loop, see lib/transport.py, which can be
+# closed and started again while the old loop is still running.
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+import lib.transport
+
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = lib.transport.Transport()
+        self.addCleanup(self.transport.close)
+
+    def run_on_loop(self, function):
+        async def call():
+            return function()
+        return asyncio.run_coroutine_threadsafe(
+            call(), self.transport.get_loop()
+        ).result()
+
+    def get_pool(self):
+        return self.run_on_loop(
+            lambda: self.transport.get_pool('http', 'localhost', 80)
+        )
+
+    def test_close_keeps_pools_of_next_loop(self):
+        old_pool = self.get_pool()
+        writer = mock.Mock()
+        old_pool.idle.append((mock.Mock(), writer, 0.0))
+        old_loop = self.transport.get_loop()
+        # The old loop is kept busy so it only stops once a new loop has
+        # made a pool of its own
+        busy = threading.Event()
+        old_loop.call_soon_threadsafe(busy.wait)
+        self.transport.close()
+        new_pool = self.get_pool()
+        self.assertIsNot(new_pool, old_pool)
+        busy.set()
+        deadline = time.monotonic() + 5
+        while old_loop.is_running() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(old_loop.is_running())
+        writer.close.assert_called_once_with()
+        self.assertEqual(self.transport.pools,
+                         {('http', 'localhost', 80): new_pool})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Messages past their overflow threshold against the slack stand-in, see
+# devtools/slack_standin.py: only the summary is posted, and every resource
+# is uploaded as a file in its thread, streamed with chunked transfer
+# encoding.
+import csv
+import gzip
+import io
+import json
+import re
+import unittest
+
+from support import (
+    get_message, get_posts, get_sns_event, quiet_metrics, use_spool,
+    use_standin
+)
+from fake_context import FakeClock, FakeContext
+import lib.uploads
+import slack_notifier
+
+DESTINATION = 'slack://C0TESTS'
+
+
+def get_form(request):
+    # The fields of a multipart/form-data request, as bytes
+    headers = {key.lower(): value for key, value in request['headers'].items()}
+    boundary = headers['content-type'].partition('boundary=')[2]
+    form = {}
+    for part in request['body'].split(
+            ('--' + boundary).encode('utf8'))[1:-1]:
+        part_headers, _, value = part.partition(b'\r\n\r\n')
+        name = re.search(br'name="([^"]+)"', part_headers).group(1)
+        form[name.decode('utf8')] = value[:-len(b'\r\n')]
+    return form
+
+
+class OverflowTest(unittest.TestCase):
+    def setUp(self):
+        self.server = use_standin(self)
+        use_spool(self)
+        quiet_metrics(self)
+
+    def send(self, resource_count, **action):
+        slack_notifier.lambda_handler(
+            get_sns_event(self.id(), get_message(
+                resource_count, to=DESTINATION, **action
+            )),
+            FakeContext(60, clock=FakeClock())
+        )
+        return self.server.requests_for('/api/files.upload')
+
+    def test_csv_upload_is_chunked(self):
+        # Enough resources for the file to be sent in several chunks
+        resource_count = 1000
+        uploads = self.send(resource_count, overflow_threshold=100)
+        [summary] = get_posts(self.server)
+        self.assertNotIn('thread_ts', summary)
+        [upload] = uploads
+        self.assertEqual(upload['headers'].get('Transfer-Encoding'),
+                         'chunked')
+        form = get_form(upload)
+        self.assertTrue(form['thread_ts'])
+        self.assertEqual(form['filename'], b'tests-ec2-us-east-1.csv')
+        self.assertGreater(len(form['file']), lib.uploads.UPLOAD_CHUNK_SIZE)
+        rows = list(csv.reader(io.StringIO(form['file'].decode('utf8'))))
+        self.assertEqual(len(rows), resource_count + 1)
+
+    def test_gzipped_json_upload(self):
+        uploads = self.send(150, overflow_threshold=100,
+                            overflow_format='ndjson', overflow_gzip=True)
+        form = get_form(uploads[0])
+        self.assertEqual(form['filename'],
+                         b'tests-ec2-us-east-1.ndjson.gz')
+        lines = gzip.decompress(form['file']).decode('utf8').splitlines()
+        self.assertEqual(len(lines), 150)
+        self.assertIn('i-', json.loads(lines[0])['id'])
+
+    def test_under_threshold_is_threaded(self):
+        uploads = self.send(100, overflow_threshold=100)
+        self.assertEqual(uploads, [])
+        summary, *replies = get_posts(self.server)
+        self.assertTrue(replies)
+
+
+if __name__ == '__main__':
+    unittest.main()